@@ -0,0 +1,41 @@
+import numpy as np
+
+class ArcLengthTable:
+    """
+    Cumulative arc length sampled along a path, for converting between
+    the path parameter t and the distance s along the path without
+    svgpathtools' iterative inverse. Both lookups are a binary search
+    and a linear interpolation, and both take scalars or arrays.
+    """
+    def __init__(self, t: np.ndarray, s: np.ndarray):
+        self.t = t
+        """Path parameters of the samples, increasing from 0 to 1."""
+
+        self.s = s
+        """Arc length from the start of the path to each sample."""
+
+    @property
+    def length(self) -> float:
+        return float(self.s[-1])
+
+    def tAt(self, s):
+        """Returns the path parameter at a distance s along the path."""
+        return np.interp(s, self.s, self.t)
+
+    def sAt(self, t):
+        """Returns the distance along the path at path parameter t."""
+        return np.interp(t, self.t, self.s)
+
+    def reversed(self) -> "ArcLengthTable":
+        """Returns the table for the same path driven the other way."""
+        return ArcLengthTable(1.0 - self.t[::-1], self.length - self.s[::-1])
+
+def buildArcLengthTables(edges: list[tuple[str, str]],
+                         samples: dict[str, np.ndarray]) -> dict[tuple[str, str], ArcLengthTable]:
+    """Slices a table for each edge out of the arrays from sampleEdges."""
+    offsets = samples["edgeSampleOffsets"]
+    ts, arcLengths = samples["edgeSampleT"], samples["edgeSampleS"]
+    return {
+        edge: ArcLengthTable(ts[offsets[i]:offsets[i + 1]], arcLengths[offsets[i]:offsets[i + 1]])
+        for i, edge in enumerate(edges)
+    }
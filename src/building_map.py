@@ -0,0 +1,231 @@
+from floormap import FloorMap
+from trip_planning import DEFAULT_TIME_BUDGET, solveTour
+from typing import NamedTuple
+import os
+import numpy as np
+
+# A node somewhere in the building, as (floor id, node id)
+BuildingNode = tuple[str, str]
+
+class Portal(NamedTuple):
+    """A way between two floors, such as an elevator or a ramp."""
+    start: BuildingNode
+    end: BuildingNode
+    cost: float
+    """The cost of taking the portal, in the same units as path lengths."""
+
+class BuildingLeg(NamedTuple):
+    floorId: str
+    nodeIds: list[str]
+    """The nodes driven through on this floor, in order."""
+
+class BuildingTrip(NamedTuple):
+    legs: list[BuildingLeg]
+    """Consecutive legs are joined by a portal, except where a stop
+    ends one leg and starts the next on the same floor."""
+
+    stops: list[BuildingNode]
+    """The stops in the order they're visited, starting and ending at home."""
+
+    length: float
+    solver: str
+
+class BuildingMap:
+    """
+    A set of floor maps joined by portals. Routing is hierarchical:
+    each floor answers its own shortest paths from its tables, and a
+    small graph of portal endpoints is searched on top, so building
+    queries cost O(portals^2) no matter how many nodes the floors have.
+
+    Building files look like:
+
+        [Meta]
+        Fermier Hall
+        8F4D1C52-0D7B-4A8C-9E57-2C3B0E1F6A90
+
+        [Floors]
+        f1: FermierHall_1.floormap
+        f2: FermierHall_2.floormap
+
+        [Portals]
+        f1:elevator > f2:elevator: 600
+
+    Floor map paths are relative to the building file. The first floor
+    listed is where home is.
+    """
+    def __init__(self, filePath: str):
+        SECTION_META = "[Meta]"
+        SECTION_FLOORS = "[Floors]"
+        SECTION_PORTALS = "[Portals]"
+
+        self.name: str = None
+        self.id: str = None
+        self.floors: dict[str, FloorMap] = {}
+        self.portals: list[Portal] = []
+
+        baseDir = os.path.dirname(filePath)
+        with open(filePath, "r") as file:
+            currentSection = None
+            for line in file.readlines():
+                line = line.strip()
+                if len(line) <= 0:
+                    continue
+
+                if line.startswith('['):
+                    currentSection = line
+                    continue
+
+                if currentSection == SECTION_META:
+                    if self.name == None:
+                        self.name = line
+                    else:
+                        self.id = line
+                elif currentSection == SECTION_FLOORS:
+                    floorId, floorPath = [c.strip() for c in line.split(':')]
+                    self.floors[floorId] = FloorMap(os.path.join(baseDir, floorPath))
+                elif currentSection == SECTION_PORTALS:
+                    portalConnection, portalCost = line.rsplit(':', 1)
+                    portalStart, portalEnd = [self._parseNode(c) for c in portalConnection.split('>')]
+                    self.portals.append(Portal(portalStart, portalEnd, float(portalCost)))
+
+        # Every portal end is a node of the portal graph
+        self.portalNodes: list[BuildingNode] = list(dict.fromkeys(
+            node for portal in self.portals for node in (portal.start, portal.end)))
+        self._portalIndex = {node: i for i, node in enumerate(self.portalNodes)}
+        self._portalsByFloor: dict[str, list[int]] = {floorId: [] for floorId in self.floors}
+        for i, (floorId, _) in enumerate(self.portalNodes):
+            self._portalsByFloor[floorId].append(i)
+
+        self._portalDistances: np.ndarray = None
+        self._portalNext: np.ndarray = None
+        self._floorTables: dict[str, np.ndarray] = {}
+
+    def _parseNode(self, text: str) -> BuildingNode:
+        floorId, nodeId = [c.strip() for c in text.split(':')]
+        if floorId not in self.floors or nodeId not in self.floors[floorId].nodes:
+            raise ValueError(f"Unknown node {floorId}:{nodeId}")
+        return floorId, nodeId
+
+    def getHome(self) -> BuildingNode:
+        floorId, floor = next(iter(self.floors.items()))
+        return floorId, floor.getHome()
+
+    def _ensurePortalTables(self):
+        """
+        Builds all-pairs shortest paths over the portal graph. Floors
+        swap in new tables whenever a path is blocked or reopened, so
+        this is rebuilt if any floor's table has changed.
+        """
+        if self._portalDistances is not None \
+            and all(self._floorTables[f] is floor.distanceTable for f, floor in self.floors.items()):
+            return
+        self._floorTables = {f: floor.distanceTable for f, floor in self.floors.items()}
+
+        portalCount = len(self.portalNodes)
+        distances = np.full((portalCount, portalCount), np.inf)
+        np.fill_diagonal(distances, 0.0)
+
+        # Driving between two portals on the same floor
+        for floorId, floorPortals in self._portalsByFloor.items():
+            floor = self.floors[floorId]
+            for i in floorPortals:
+                for j in floorPortals:
+                    distances[i, j] = floor.getShortestPathLength(self.portalNodes[i][1], self.portalNodes[j][1])
+
+        # Taking a portal, in either direction
+        for portal in self.portals:
+            i, j = self._portalIndex[portal.start], self._portalIndex[portal.end]
+            distances[i, j] = distances[j, i] = min(distances[i, j], portal.cost)
+
+        # nextHop[i, j] is the portal node after i on the way to j
+        nextHop = np.tile(np.arange(portalCount), (portalCount, 1))
+        for k in range(portalCount):
+            throughK = distances[:, k, np.newaxis] + distances[np.newaxis, k, :]
+            isShorter = throughK < distances
+            distances = np.where(isShorter, throughK, distances)
+            nextHop = np.where(isShorter, nextHop[:, k, np.newaxis], nextHop)
+
+        self._portalDistances = distances
+        self._portalNext = nextHop
+
+    def _bestPortalPair(self, start: BuildingNode, end: BuildingNode) -> tuple[float, int, int]:
+        """Returns the shortest way from start to end through at least one portal."""
+        startFloor, endFloor = self.floors[start[0]], self.floors[end[0]]
+        startPortals, endPortals = self._portalsByFloor[start[0]], self._portalsByFloor[end[0]]
+        if len(startPortals) <= 0 or len(endPortals) <= 0:
+            return np.inf, -1, -1
+
+        toPortals = np.array([startFloor.getShortestPathLength(start[1], self.portalNodes[i][1]) for i in startPortals])
+        fromPortals = np.array([endFloor.getShortestPathLength(self.portalNodes[j][1], end[1]) for j in endPortals])
+        totals = toPortals[:, np.newaxis] + self._portalDistances[np.ix_(startPortals, endPortals)] + fromPortals
+        i, j = np.unravel_index(np.argmin(totals), totals.shape)
+        return float(totals[i, j]), startPortals[i], endPortals[j]
+
+    def getShortestPathLength(self, start: BuildingNode, end: BuildingNode) -> float:
+        self._ensurePortalTables()
+        length, _, _ = self._bestPortalPair(start, end)
+        if start[0] == end[0]:
+            length = min(length, self.floors[start[0]].getShortestPathLength(start[1], end[1]))
+        return length
+
+    def getShortestPath(self, start: BuildingNode, end: BuildingNode) -> tuple[float, list[BuildingLeg]]:
+        """Returns the length of the shortest route and the legs driven on each floor."""
+        self._ensurePortalTables()
+        length, startPortal, endPortal = self._bestPortalPair(start, end)
+        if start[0] == end[0]:
+            floorLength = self.floors[start[0]].getShortestPathLength(start[1], end[1])
+            if floorLength <= length:
+                _, nodeIds = self.floors[start[0]].getShortestPath(start[1], end[1])
+                return floorLength, [BuildingLeg(start[0], nodeIds)]
+        if np.isinf(length):
+            raise ValueError(f"There is no path from {start[0]}:{start[1]} to {end[0]}:{end[1]}")
+
+        # Walk the portal graph, starting a new leg at every floor change
+        hops = [startPortal]
+        while hops[-1] != endPortal:
+            hops.append(int(self._portalNext[hops[-1], endPortal]))
+
+        legs = []
+        current = start
+        for hop in hops:
+            portalNode = self.portalNodes[hop]
+            if portalNode[0] == current[0]:
+                _, nodeIds = self.floors[current[0]].getShortestPath(current[1], portalNode[1])
+                if len(legs) > 0 and legs[-1].floorId == current[0]:
+                    legs[-1].nodeIds.extend(nodeIds[1:])
+                else:
+                    legs.append(BuildingLeg(current[0], nodeIds))
+            current = portalNode
+
+        _, nodeIds = self.floors[end[0]].getShortestPath(current[1], end[1])
+        if len(legs) > 0 and legs[-1].floorId == end[0]:
+            legs[-1].nodeIds.extend(nodeIds[1:])
+        else:
+            legs.append(BuildingLeg(end[0], nodeIds))
+        return length, legs
+
+    def planTrip(self, stops: list[BuildingNode], solver: str | None = None,
+                 timeBudget: float = DEFAULT_TIME_BUDGET) -> BuildingTrip:
+        """Orders stops anywhere in the building into one trip from and back to home."""
+        self._ensurePortalTables()
+        home = self.getHome()
+        uniqueStops = [stop for stop in dict.fromkeys(stops) if stop != home]
+        tripNodes = [home, *uniqueStops]
+
+        distances = np.zeros((len(tripNodes), len(tripNodes)))
+        for i, start in enumerate(tripNodes):
+            for j, end in enumerate(tripNodes):
+                if i != j:
+                    distances[i, j] = self.getShortestPathLength(start, end)
+
+        solution = solveTour(distances, 0, 0, list(range(1, len(tripNodes))), solver, timeBudget)
+        orderedStops = [home, *[tripNodes[i] for i in solution.order], home]
+        print(f"Planned building trip with {solution.solver}, length {solution.cost:.1f}\"")
+
+        legs: list[BuildingLeg] = []
+        for start, end in zip(orderedStops[:-1], orderedStops[1:]):
+            if start == end:
+                continue
+            _, routeLegs = self.getShortestPath(start, end)
+            legs += routeLegs
+        return BuildingTrip(legs, orderedStops, solution.cost, solution.solver)
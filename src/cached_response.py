@@ -0,0 +1,69 @@
+from sanic import Request, HTTPResponse
+from sanic.response import empty, raw
+from hashlib import sha256
+import gzip
+
+class CachedResponse:
+    """
+    A response body that never changes once rendered, stored both as is
+    and gzipped. Clients that send back its ETag get an empty 304, and
+    clients that accept gzip get the compressed bytes, so serving it
+    costs next to nothing no matter how often it's polled.
+    """
+    def __init__(self, body: bytes, contentType: str):
+        self.body = body
+        self.gzippedBody = gzip.compress(body, compresslevel=9, mtime=0)
+        self.contentType = contentType
+
+        # Strong ETags have to differ between encodings of the same body
+        digest = sha256(body).hexdigest()[:32]
+        self.etag = f"\"{digest}\""
+        self.gzippedEtag = f"\"{digest}-gz\""
+
+    def respond(self, request: Request) -> HTTPResponse:
+        useGzip = acceptsGzip(request.headers.get("accept-encoding", ""))
+        etag = self.gzippedEtag if useGzip else self.etag
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            # Always check back, since the map can be reloaded
+            "Cache-Control": "no-cache",
+        }
+
+        ifNoneMatch = request.headers.get("if-none-match")
+        if ifNoneMatch is not None and self._matches(ifNoneMatch):
+            return empty(status=304, headers=headers)
+
+        if useGzip:
+            headers["Content-Encoding"] = "gzip"
+            return raw(self.gzippedBody, content_type=self.contentType, headers=headers)
+        return raw(self.body, content_type=self.contentType, headers=headers)
+
+    def _matches(self, ifNoneMatch: str) -> bool:
+        # If-None-Match compares weakly, so a W/ prefix still matches
+        for tag in ifNoneMatch.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == self.etag or tag == self.gzippedEtag:
+                return True
+        return False
+
+def acceptsGzip(acceptEncoding: str) -> bool:
+    qualities = {}
+    for coding in acceptEncoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    # An explicit gzip entry wins over the wildcard
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
@@ -0,0 +1,183 @@
+from threading import Lock
+from typing import Callable, NamedTuple
+import time
+import numpy as np
+
+# Upper bounds of the histogram buckets, in microseconds. Anything
+# slower lands in one last overflow bucket.
+HISTOGRAM_EDGES_US = np.array([50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000, 20_000, 50_000, 100_000])
+
+class HistogramSnapshot(NamedTuple):
+    edgesUs: np.ndarray
+    """Upper bound of each bucket but the last, in microseconds."""
+
+    counts: np.ndarray
+    """Samples in each bucket, one longer than edgesUs."""
+
+    count: int
+    meanUs: float
+    maxUs: float
+
+class Histogram:
+    """Counts nanosecond durations into fixed microsecond buckets."""
+    def __init__(self, edgesUs: np.ndarray = HISTOGRAM_EDGES_US):
+        self.edgesUs = edgesUs
+        self.counts = np.zeros(len(edgesUs) + 1, dtype=np.int64)
+        self.totalNs = 0
+        self.maxNs = 0
+
+    def record(self, durationNs: int):
+        self.counts[np.searchsorted(self.edgesUs, durationNs / 1000, side="left")] += 1
+        self.totalNs += durationNs
+        self.maxNs = max(self.maxNs, durationNs)
+
+    def snapshot(self) -> HistogramSnapshot:
+        count = int(self.counts.sum())
+        return HistogramSnapshot(self.edgesUs, self.counts.copy(), count,
+                                 self.totalNs / count / 1000 if count > 0 else 0.0, self.maxNs / 1000)
+
+class LoopStats(NamedTuple):
+    rate: float
+    """The target rate in Hz."""
+
+    ticks: int
+    overruns: int
+    """Ticks that finished after the next one was due."""
+
+    missedDeadlines: int
+    """Ticks skipped entirely because an overrun lasted a whole period."""
+
+    latency: HistogramSnapshot
+    """How late each tick started after its deadline."""
+
+    jitter: HistogramSnapshot
+    """How far each period between tick starts was from the target."""
+
+    duration: HistogramSnapshot
+    """How long each tick took to run."""
+
+    overrun: HistogramSnapshot
+    """How far past the next deadline each overrunning tick finished."""
+
+    def summary(self) -> str:
+        return (f"{self.ticks} ticks at {self.rate:g} Hz, {self.overruns} overruns, "
+                f"{self.missedDeadlines} missed, latency {self.latency.meanUs:.0f}/{self.latency.maxUs:.0f}us, "
+                f"jitter {self.jitter.meanUs:.0f}/{self.jitter.maxUs:.0f}us, "
+                f"tick {self.duration.meanUs:.0f}/{self.duration.maxUs:.0f}us (mean/max)")
+
+class FixedRateScheduler:
+    """
+    Runs a tick function at a fixed rate on absolute time.monotonic_ns()
+    deadlines, so time spent in the tick doesn't add to the period the
+    way sleeping after it does. A tick that overruns is followed
+    straight away by the next, and if it overruns by whole periods
+    those ticks are skipped to keep the phase. Statistics accumulate
+    across runs until resetStats is called.
+    """
+    def __init__(self, rate: float):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.periodNs = int(round(1e9 / rate))
+        self._resynced = False
+        self._statsLock = Lock()
+        self.resetStats()
+
+    def run(self, tick: Callable[[], bool]):
+        """Calls tick once per period until it returns False."""
+        deadline = time.monotonic_ns()
+        lastStart = None
+        self._resynced = False
+        while True:
+            now = time.monotonic_ns()
+            if now < deadline:
+                time.sleep((deadline - now) / 1e9)
+                now = time.monotonic_ns()
+
+            start = now
+            keepGoing = tick()
+            end = time.monotonic_ns()
+
+            with self._statsLock:
+                self._ticks += 1
+                self._latency.record(max(start - deadline, 0))
+                if lastStart is not None:
+                    self._jitter.record(abs(start - lastStart - self.periodNs))
+                self._duration.record(end - start)
+                lastStart = start
+
+                if not keepGoing:
+                    break
+
+                deadline += self.periodNs
+                if self._resynced:
+                    # The tick waited on purpose, so start a fresh schedule
+                    self._resynced = False
+                    deadline = end + self.periodNs
+                    lastStart = None
+                elif end > deadline:
+                    self._overruns += 1
+                    self._overrun.record(end - deadline)
+                    skipped = (end - deadline) // self.periodNs
+                    self._missedDeadlines += skipped
+                    deadline += skipped * self.periodNs
+
+    def resync(self):
+        """
+        Tells the scheduler the current tick is blocking on purpose, like
+        while waiting for an obstacle to clear, so it isn't counted as an
+        overrun and the schedule restarts from when the tick finishes.
+        """
+        self._resynced = True
+
+    def stats(self) -> LoopStats:
+        with self._statsLock:
+            return LoopStats(self.rate, self._ticks, self._overruns, self._missedDeadlines,
+                             self._latency.snapshot(), self._jitter.snapshot(),
+                             self._duration.snapshot(), self._overrun.snapshot())
+
+    def resetStats(self):
+        with self._statsLock:
+            self._ticks = 0
+            self._overruns = 0
+            self._missedDeadlines = 0
+            self._latency = Histogram()
+            self._jitter = Histogram()
+            self._duration = Histogram()
+            self._overrun = Histogram()
+
+if __name__ == "__main__":
+    # Compare against sleeping a fixed time after variable work, which
+    # is how the control loops used to pace themselves
+    rate, ticks = 50.0, 100
+    rng = np.random.default_rng(0)
+    workTimes = rng.uniform(0.0, 0.012, ticks)
+    workTimes[::25] = 0.03
+
+    start = time.monotonic()
+    for workTime in workTimes:
+        time.sleep(workTime)
+        time.sleep(1 / rate)
+    print(f"sleep after work: {ticks / (time.monotonic() - start):.1f} Hz")
+
+    scheduler = FixedRateScheduler(rate)
+    remaining = iter(workTimes)
+    def tick() -> bool:
+        workTime = next(remaining, None)
+        if workTime is None:
+            return False
+        time.sleep(workTime)
+        return True
+
+    start = time.monotonic()
+    scheduler.run(tick)
+    print(f"FixedRateScheduler: {ticks / (time.monotonic() - start):.1f} Hz")
+
+    stats = scheduler.stats()
+    print(stats.summary())
+    for name, histogram in (("latency", stats.latency), ("jitter", stats.jitter),
+                            ("duration", stats.duration), ("overrun", stats.overrun)):
+        buckets = [f"<={edge}us: {count}" for edge, count in zip(histogram.edgesUs, histogram.counts) if count]
+        if histogram.counts[-1]:
+            buckets.append(f">{histogram.edgesUs[-1]}us: {histogram.counts[-1]}")
+        print(f"{name}: {', '.join(buckets)}")
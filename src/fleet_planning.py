@@ -0,0 +1,225 @@
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from floormap import FloorMap, PlanTripResult
+from trip_planning import DEFAULT_TIME_BUDGET, TourSolution, solveTour
+import os
+import time
+import numpy as np
+
+# Random greedy assignments tried on top of the sweep partitions
+DEFAULT_RESTARTS = 16
+
+# Time allowed for improving the best partition, in seconds
+DEFAULT_IMPROVE_BUDGET = 2.0
+
+# Partitions are lists of stop indices per robot, where the indices
+# refer to rows of a distance matrix whose row 0 is home
+Partition = list[list[int]]
+
+def planFleetTrips(floorplan: FloorMap, stopIds: list[str], robotCount: int,
+                   capacities: list[int] | None = None,
+                   workers: int | None = None,
+                   restarts: int = DEFAULT_RESTARTS,
+                   improveBudget: float = DEFAULT_IMPROVE_BUDGET,
+                   tourTimeBudget: float = DEFAULT_TIME_BUDGET,
+                   seed: int | None = None) -> list[PlanTripResult]:
+    """
+    Splits the stops between robots that all start and end at home,
+    minimizing the length of the longest trip. stopIds has one entry
+    per bin, so a room listed twice needs two units of capacity, and
+    capacities[r] is how many bins robot r carries. Candidate
+    partitions are evaluated on a process pool with the given number
+    of workers (defaulting to every core); pass 1 to stay in-process.
+    """
+    if robotCount < 1:
+        raise ValueError("At least one robot is required")
+    if capacities is not None and len(capacities) != robotCount:
+        raise ValueError(f"Expected {robotCount} capacities, got {len(capacities)}")
+
+    homeId = floorplan.getHome()
+    demandById = Counter(stopId for stopId in stopIds if stopId != homeId)
+    uniqueStopIds = list(demandById.keys())
+    if capacities is None:
+        capacities = [len(stopIds)] * robotCount
+    if sum(demandById.values()) > sum(capacities):
+        raise ValueError(f"{sum(demandById.values())} bins don't fit in a capacity of {sum(capacities)}")
+
+    nodeIds = [homeId, *uniqueStopIds]
+    distances = floorplan.getDistanceMatrix(nodeIds)
+    demands = np.array([0, *demandById.values()])
+    rng = np.random.default_rng(seed)
+
+    candidates = _sweepPartitions(floorplan, nodeIds, demands, capacities)
+    for _ in range(restarts):
+        candidate = _greedyPartition(distances, demands, capacities, rng)
+        if candidate is not None:
+            candidates.append(candidate)
+    if len(candidates) <= 0:
+        raise ValueError("Could not find any assignment of stops that fits the robots' capacities")
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        best, bestTours = _bestOf(executor, distances, candidates, tourTimeBudget)
+        best, bestTours = _improve(executor, distances, demands, capacities,
+                                   best, bestTours, improveBudget, tourTimeBudget)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    trips = []
+    for tour in bestTours:
+        orderedIds = [homeId, *[nodeIds[i] for i in tour.order], homeId]
+        tripHash = floorplan.computeTripHash(orderedIds)
+        trips.append(PlanTripResult(tripHash, floorplan.expandRoute(orderedIds), tour.cost, tour.solver))
+
+    print(f"Planned {robotCount} trips, longest {max(t.length for t in trips):.1f}\"")
+    return trips
+
+def _evaluatePartition(distances: np.ndarray, partition: Partition,
+                       timeBudget: float) -> tuple[float, float, list[TourSolution]]:
+    """Returns the makespan, total length and tour of each robot."""
+    tours = [solveTour(distances, 0, 0, stops, timeBudget=timeBudget) for stops in partition]
+    costs = [tour.cost for tour in tours]
+    return max(costs), sum(costs), tours
+
+def _evaluateAll(executor: Executor | None, distances: np.ndarray,
+                 partitions: list[Partition], timeBudget: float):
+    count = len(partitions)
+    if executor is None:
+        return list(map(_evaluatePartition, [distances] * count, partitions, [timeBudget] * count))
+
+    # Big enough chunks that each worker only unpickles the matrix a few times
+    chunkSize = max(1, count // (4 * (os.cpu_count() or 1)))
+    return list(executor.map(_evaluatePartition, [distances] * count, partitions,
+                             [timeBudget] * count, chunksize=chunkSize))
+
+def _bestOf(executor: Executor | None, distances: np.ndarray,
+            partitions: list[Partition], timeBudget: float) -> tuple[Partition, list[TourSolution]]:
+    results = _evaluateAll(executor, distances, partitions, timeBudget)
+    bestIndex = min(range(len(results)), key=lambda i: results[i][:2])
+    return partitions[bestIndex], results[bestIndex][2]
+
+def _improve(executor: Executor | None, distances: np.ndarray, demands: np.ndarray,
+             capacities: list[int], partition: Partition, tours: list[TourSolution],
+             budget: float, timeBudget: float) -> tuple[Partition, list[TourSolution]]:
+    """
+    Repeatedly moves one stop off the longest trip, or swaps it with a
+    stop on another trip, taking the best move while it helps.
+    """
+    deadline = time.monotonic() + budget
+    makespan = max(tour.cost for tour in tours)
+    total = sum(tour.cost for tour in tours)
+
+    while time.monotonic() < deadline:
+        longest = int(np.argmax([tour.cost for tour in tours]))
+        loads = [int(demands[stops].sum()) for stops in partition]
+
+        moves: list[Partition] = []
+        for stop in partition[longest]:
+            for other in range(len(partition)):
+                if other == longest:
+                    continue
+
+                if loads[other] + demands[stop] <= capacities[other]:
+                    moved = [list(stops) for stops in partition]
+                    moved[longest].remove(stop)
+                    moved[other].append(stop)
+                    moves.append(moved)
+
+                for otherStop in partition[other]:
+                    swapDelta = demands[stop] - demands[otherStop]
+                    if loads[other] + swapDelta <= capacities[other] \
+                        and loads[longest] - swapDelta <= capacities[longest]:
+                        swapped = [list(stops) for stops in partition]
+                        swapped[longest][swapped[longest].index(stop)] = otherStop
+                        swapped[other][swapped[other].index(otherStop)] = stop
+                        moves.append(swapped)
+
+        if len(moves) <= 0:
+            break
+
+        results = _evaluateAll(executor, distances, moves, timeBudget)
+        bestIndex = min(range(len(results)), key=lambda i: results[i][:2])
+        bestMakespan, bestTotal, bestTours = results[bestIndex]
+        if (bestMakespan, bestTotal) >= (makespan - 1e-9, total - 1e-9):
+            break
+
+        partition, tours = moves[bestIndex], bestTours
+        makespan, total = bestMakespan, bestTotal
+
+    return partition, tours
+
+def _sweepPartitions(floorplan: FloorMap, nodeIds: list[str], demands: np.ndarray,
+                     capacities: list[int]) -> list[Partition]:
+    """
+    Sorts the stops by bearing from home and cuts the circle into one
+    arc per robot, trying every stop as the starting bearing.
+    """
+    home = floorplan.nodes[nodeIds[0]]
+    bearings = np.angle(np.array([floorplan.nodes[nodeId] - home for nodeId in nodeIds[1:]]))
+    byBearing = [int(i) + 1 for i in np.argsort(bearings)]
+
+    partitions = []
+    robotCount = len(capacities)
+    totalDemand = demands.sum()
+    for offset in range(max(1, len(byBearing))):
+        ordered = byBearing[offset:] + byBearing[:offset]
+        partition: Partition = [[] for _ in range(robotCount)]
+        robot, load, assigned = 0, 0, 0
+        for stop in ordered:
+            # Move on once this robot has its share or is full
+            share = (totalDemand - assigned) / (robotCount - robot) if robot < robotCount else np.inf
+            while robot < robotCount - 1 \
+                and (load >= share or load + demands[stop] > capacities[robot]):
+                robot, load = robot + 1, 0
+                share = (totalDemand - assigned) / (robotCount - robot)
+            partition[robot].append(stop)
+            load += demands[stop]
+            assigned += demands[stop]
+
+        loads = [demands[stops].sum() for stops in partition]
+        if all(load <= capacity for load, capacity in zip(loads, capacities)):
+            partitions.append(partition)
+    return partitions
+
+def _greedyPartition(distances: np.ndarray, demands: np.ndarray, capacities: list[int],
+                     rng: np.random.Generator) -> Partition | None:
+    """
+    Visits the stops in random order, giving each to the robot whose
+    trip would end up shortest after taking it (by cheapest insertion).
+    """
+    robotCount = len(capacities)
+    routes = [[0, 0] for _ in range(robotCount)]
+    lengths = np.zeros(robotCount)
+    loads = np.zeros(robotCount, dtype=int)
+
+    for stop in rng.permutation(np.arange(1, len(demands))).tolist():
+        bestRobot, bestPosition, bestLength = -1, -1, np.inf
+        for robot in range(robotCount):
+            if loads[robot] + demands[stop] > capacities[robot]:
+                continue
+            route = np.array(routes[robot])
+            insertCost = distances[route[:-1], stop] + distances[stop, route[1:]] - distances[route[:-1], route[1:]]
+            position = int(np.argmin(insertCost))
+            newLength = lengths[robot] + insertCost[position]
+            if newLength < bestLength:
+                bestRobot, bestPosition, bestLength = robot, position, newLength
+        if bestRobot < 0:
+            return None
+
+        routes[bestRobot].insert(bestPosition + 1, stop)
+        lengths[bestRobot] = bestLength
+        loads[bestRobot] += demands[stop]
+
+    return [route[1:-1] for route in routes]
+
+if __name__ == "__main__":
+    floormap = FloorMap(os.path.join("maps", "FermierHall_Small.floormap"))
+    stops = [roomId for roomId in floormap.rooms.keys() if roomId != floormap.getHome()]
+
+    start = time.perf_counter()
+    trips = planFleetTrips(floormap, stops, 2, capacities=[4, 4])
+    print(f"Planned in {time.perf_counter() - start:.2f}s")
+    for trip in trips:
+        print(f"{trip.length:.1f}\": {trip.nodeIds}")
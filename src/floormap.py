@@ -1,145 +1,828 @@
-from svgpathtools import parse_path, Path
-from nav_utils import bboxCombine
-from itertools import combinations
-import itertools
+from svgpathtools import parse_path, CubicBezier, Line, Path
+from nav_utils import Pose, PoseArray, bboxCombine, closestPointOnPath, discretizePathAdaptive, evaluatePath
+from trip_planning import DEFAULT_TIME_BUDGET, solveTour
+from floormap_cache import CompiledMap, compiledPathFor, hashSource, readCompiledMap, writeCompiledMap, \
+    encodePaths, decodePaths
+from spatial_index import EdgeSpatialIndex, EdgeLocation, sampleEdges
+from arc_length import ArcLengthTable, buildArcLengthTables
+from lru_cache import LruCache, CacheStats
+from odometry import L, estimateTravelTime
+from graph_search import Adjacency, aStar, dijkstra, landmarkHeuristic, selectLandmarks
+from threading import Lock, RLock, Thread
+import time
+from typing import NamedTuple
+import numpy as np
 
-from pathfinding.core.graph import Graph
-from pathfinding.finder.dijkstra import DijkstraFinder
+# How many distinct stop sets to remember plans for
+DEFAULT_CACHE_SIZE = 64
+
+# Landmarks used for the A* lower bounds in findRoute
+DEFAULT_LANDMARK_COUNT = 8
+
+# How wide a strip around each path the robot may stray into, in
+# inches, when the path is cut into straight moves
+DEFAULT_CORRIDOR_WIDTH = 4.0
+
+# Spacing of the poses in an edge's track, for continuous following
+TRACK_SPACING = 1.0
+
+# Corners the robot drives through without stopping are rounded off
+# with arcs this tight, unless the edges on either side are too short.
+# With the outer wheel at cruising speed, the middle of the robot still
+# keeps two thirds of that speed around the arc.
+FILLET_RADIUS = 2 * L                 # in
+
+# Corners gentler than this are driven straight through, and corners
+# sharper than it end the leg so the robot can turn in place instead
+MIN_FILLET_ANGLE = 1.0                # deg
+MAX_FILLET_ANGLE = 120.0              # deg
 
 EdgeToPathMap = dict[tuple[str, str], Path]
-PlanTripResult = tuple[str, list[str]]
 
-class FloorMap:
-    def __init__(self, filePath: str):
-        SECTION_META = "[Meta]"
-        SECTION_ROOMS = "[Rooms]"
-        SECTION_NODES = "[Nodes]"
-        SECTION_PATHS = "[Paths]"
+class PlanTripResult(NamedTuple):
+    tripHash: str
+    nodeIds: list[str]
+    """Every node visited on the trip, starting and ending at home."""
+
+    length: float
+    """The total length of the trip in inches."""
+
+    solver: str
+    """The name of the solver that ordered the stops."""
+
+class RouteProgress(NamedTuple):
+    travelled: float
+    """Inches driven since the start of the route."""
+
+    remaining: float
+    """Inches left to drive."""
+
+    timeRemaining: float
+    """Estimated seconds of driving left."""
+
+class StitchedLeg(NamedTuple):
+    nodeIds: list[str]
+    path: Path
+    """One continuous path through every node, with the corners rounded off."""
+
+    nodeArcLengths: np.ndarray
+    """
+    Distance along the path to each node. Nodes with a rounded off corner
+    are counted halfway around the fillet.
+    """
 
+    waypoints: PoseArray
+    """Discretized like getEdgeWaypoints, without the first node."""
+
+    track: PoseArray
+    """Sampled like getEdgeTrack."""
+
+    def edgeIndexAt(self, arcLength: float) -> int:
+        """Returns the index in nodeIds of the node starting the edge at that distance along the path."""
+        return int(np.clip(np.searchsorted(self.nodeArcLengths, arcLength, side="right") - 1,
+                           0, len(self.nodeIds) - 2))
+
+class DiscretizationReport(NamedTuple):
+    waypointCount: int
+    maxDeviation: float
+    """The farthest any straight move strays from the path, in inches."""
+
+class RouteResult(NamedTuple):
+    nodeIds: list[str]
+    paths: list[Path]
+    """The path driven between each pair of consecutive nodes."""
+
+    length: float
+    expanded: int
+    """How many nodes the search expanded to find the route."""
+
+def sampleTrack(path: Path, arcLengths: ArcLengthTable | None = None) -> PoseArray:
+    """Returns poses every TRACK_SPACING inches along a path, ending on its end."""
+    if arcLengths is None:
+        arcLengths = _measurePath(path)
+    ts = np.append(arcLengths.tAt(np.arange(0.0, arcLengths.length, TRACK_SPACING)), 1.0)
+    positions, tangents = evaluatePath(path, ts)
+    return PoseArray(positions, np.angle(tangents, deg=True))
+
+def _measurePath(path: Path) -> ArcLengthTable:
+    samples = sampleEdges([path])
+    return ArcLengthTable(samples["edgeSampleT"], samples["edgeSampleS"])
+
+def _fillet(start: complex, startTangent: complex, end: complex, endTangent: complex) -> CubicBezier | Line:
+    """
+    A cubic Bezier from start to end, leaving and arriving along the
+    given unit tangents, that's as close to a circular arc as a cubic
+    gets. Handles of 4/3 tan(θ/4) r give the standard approximation.
+    """
+    turn = abs(np.angle(endTangent * np.conj(startTangent)))
+    chord = abs(end - start)
+    if turn < np.deg2rad(MIN_FILLET_ANGLE) or chord == 0:
+        return Line(start, end)
+
+    radius = chord / (2 * np.sin(turn / 2))
+    handle = 4 / 3 * np.tan(turn / 4) * radius
+    return CubicBezier(start, start + handle * startTangent, end - handle * endTangent, end)
+
+class FloorMap:
+    def __init__(self, filePath: str, useCompiled: bool = True,
+                 cacheSize: int | None = DEFAULT_CACHE_SIZE,
+                 corridorWidth: float = DEFAULT_CORRIDOR_WIDTH):
         self.name: str = None
         self.id: str = None
         self.rooms: dict[str, str] = {}
         self.nodes: dict[str, complex] = {}
         self.paths: EdgeToPathMap = {}
-        self._shortestPathCache: dict[str, EdgeToPathMap] = {}
-
-        with open(filePath, "r") as file:
-            currentSection = None
-            for line in file.readlines():
-                line = line.strip()
-                if len(line) <= 0:
-                    continue
-
-                if line.startswith('['):
-                    currentSection = line
-                    continue
-
-                if currentSection == SECTION_META:
-                    if self.name == None:
-                        self.name = line
-                    else:
-                        self.id = line
-                elif currentSection == SECTION_ROOMS:
-                    roomId, roomName = line.split(':')
-                    roomId = roomId.strip()
-                    roomName = roomName.strip()
-                    self.rooms[roomId] = roomName
-                elif currentSection == SECTION_NODES:
-                    nodeId, nodeCoords = line.split(':')
-                    nodeId = nodeId.strip()
-                    nodeX, nodeY = [float(c) for c in nodeCoords.split(',')]
-                    self.nodes[nodeId] = complex(nodeX, nodeY)
-                elif currentSection == SECTION_PATHS:
-                    pathConnection, pathSvg = line.split(':')
-                    pathStartId, pathEndId = [c.strip() for c in pathConnection.split('>')]
-                    pathStart = self.nodes[pathStartId]
-                    pathEnd = self.nodes[pathEndId]
-                    pathSvg = f"M {pathStart.real} {pathStart.imag} {pathSvg.strip()} L {pathEnd.real} {pathEnd.imag}"
-                    self.paths[(pathStartId, pathEndId)] = parse_path(pathSvg)
+        self.pathLengths: dict[tuple[str, str], float] = {}
+        self._adjacentPaths: EdgeToPathMap = {}
+
+        # Planned trips are keyed by trip hash, so any ordering of the
+        # same stops shares an entry
+        self._tripCache = LruCache(cacheSize)
+
+        # Stitched paths for runs of nodes driven without stopping,
+        # keyed by the tuple of node IDs
+        self._legCache = LruCache(cacheSize)
+
+        # All-pairs shortest path tables, indexed by position in nodeIds.
+        # predecessorTable[i, j] is the node before j on the shortest
+        # path from i to j, or -1 if there is no such path.
+        self.nodeIds: list[str] = []
+        self.nodeIndex: dict[str, int] = {}
+        self.distanceTable: np.ndarray = None
+        self.predecessorTable: np.ndarray = None
+        self._adjacency: Adjacency = []
+
+        # Distances from a few spread out nodes to every node, giving
+        # A* lower bounds that stay valid while edges are blocked
+        self.landmarks: list[int] = []
+        self._landmarkDistances: np.ndarray = None
+
+        # Edges that can't currently be driven, keyed like paths, with
+        # the time.monotonic() at which they reopen (None for never).
+        # The tables above always reflect the current blocks, the
+        # unblocked tables are kept so blocks can be lifted cheaply.
+        self._blockedEdges: dict[tuple[str, str], float | None] = {}
+        self._blockLock = RLock()
+        self._openDistanceTable: np.ndarray = None
+        self._openPredecessorTable: np.ndarray = None
+
+        # Waypoints for each edge, in both directions. Only the forward
+        # direction is ever discretized, see getEdgeWaypoints.
+        self._waypointCache: dict[tuple[str, str], PoseArray] = {}
+        self._waypointDeviations: dict[tuple[str, str], float] = {}
+        self._waypointLock = Lock()
+        self.corridorWidth = corridorWidth
+
+        # Nearest-edge and nearest-node lookups, for finding where on
+        # the map a robot is when it isn't sitting on a node
+        self.spatialIndex: EdgeSpatialIndex = None
+
+        # Arc length along each edge against its path parameter, from
+        # the same samples as the spatial index
+        self.arcLengthTables: dict[tuple[str, str], ArcLengthTable] = {}
+
+        with open(filePath, "rb") as file:
+            source = file.read()
+        self.sourceHash: str = hashSource(source)
+        """Identifies the exact version of the .floormap this was loaded from."""
+
+        # Parsing and planning are skipped entirely if a compiled copy
+        # of this exact source is sitting next to it
+        compiledPath = compiledPathFor(filePath)
+        compiled = readCompiledMap(compiledPath, self.sourceHash) if useCompiled else None
+        if compiled is not None:
+            self._loadCompiled(compiled)
+            return
+
+        self._parse(source.decode("utf-8"))
+        self._indexNodes()
+        self._buildAdjacentPaths()
+        self._buildPlanningTables()
+        self._buildLandmarks()
+        edgeSamples = sampleEdges(list(self.paths.values()))
+        self._buildSpatialIndex(edgeSamples)
+        self.arcLengthTables = buildArcLengthTables(list(self.paths.keys()), edgeSamples)
+
+        if useCompiled:
+            header, arrays = self._compile()
+            writeCompiledMap(compiledPath, self.sourceHash, header, {**arrays, **edgeSamples})
+
+    def _parse(self, source: str):
+        SECTION_META = "[Meta]"
+        SECTION_ROOMS = "[Rooms]"
+        SECTION_NODES = "[Nodes]"
+        SECTION_PATHS = "[Paths]"
+
+        currentSection = None
+        for line in source.splitlines():
+            line = line.strip()
+            if len(line) <= 0:
+                continue
+
+            if line.startswith('['):
+                currentSection = line
+                continue
+
+            if currentSection == SECTION_META:
+                if self.name == None:
+                    self.name = line
+                else:
+                    self.id = line
+            elif currentSection == SECTION_ROOMS:
+                roomId, roomName = line.split(':')
+                roomId = roomId.strip()
+                roomName = roomName.strip()
+                self.rooms[roomId] = roomName
+            elif currentSection == SECTION_NODES:
+                nodeId, nodeCoords = line.split(':')
+                nodeId = nodeId.strip()
+                nodeX, nodeY = [float(c) for c in nodeCoords.split(',')]
+                self.nodes[nodeId] = complex(nodeX, nodeY)
+            elif currentSection == SECTION_PATHS:
+                pathConnection, pathSvg = line.split(':')
+                pathStartId, pathEndId = [c.strip() for c in pathConnection.split('>')]
+                pathStart = self.nodes[pathStartId]
+                pathEnd = self.nodes[pathEndId]
+                pathSvg = f"M {pathStart.real} {pathStart.imag} {pathSvg.strip()} L {pathEnd.real} {pathEnd.imag}"
+                self.paths[(pathStartId, pathEndId)] = parse_path(pathSvg)
+
+    def _compile(self) -> tuple[dict, dict[str, np.ndarray]]:
+        header = {
+            "name": self.name,
+            "id": self.id,
+            "rooms": self.rooms,
+            "nodeIds": self.nodeIds,
+            "edges": list(self.paths.keys()),
+        }
+        arrays = {
+            "nodePositions": np.array(list(self.nodes.values()), dtype=np.complex128),
+            "edgeLengths": np.array(list(self.pathLengths.values()), dtype=np.float64),
+            "distanceTable": self.distanceTable,
+            "predecessorTable": self.predecessorTable,
+            **encodePaths(list(self.paths.values())),
+        }
+        return header, arrays
+
+    def _loadCompiled(self, compiled: CompiledMap):
+        header = compiled.header
+        self.name = header["name"]
+        self.id = header["id"]
+        self.rooms = header["rooms"]
+        self.nodes = dict(zip(header["nodeIds"], compiled["nodePositions"].tolist()))
+
+        edges = [tuple(edge) for edge in header["edges"]]
+        self.paths = dict(zip(edges, decodePaths(compiled)))
+        self._indexNodes()
+        self._buildAdjacentPaths(compiled["edgeLengths"].tolist())
+
+        self.distanceTable = self._openDistanceTable = compiled["distanceTable"]
+        self.predecessorTable = self._openPredecessorTable = compiled["predecessorTable"]
+        self._buildLandmarks()
+        self._buildSpatialIndex(compiled.arrays)
+        self.arcLengthTables = buildArcLengthTables(edges, compiled.arrays)
+
+    def _indexNodes(self):
+        self.nodeIds = list(self.nodes.keys())
+        self.nodeIndex = {nodeId: i for i, nodeId in enumerate(self.nodeIds)}
+
+    def _buildAdjacentPaths(self, pathLengths: list[float] | None = None):
+        for i, ((pathStartId, pathEndId), path) in enumerate(self.paths.items()):
+            # Paths can be driven in either direction
+            self._adjacentPaths[(pathStartId, pathEndId)] = path
+            self._adjacentPaths[(pathEndId, pathStartId)] = path.reversed()
+            self.pathLengths[(pathStartId, pathEndId)] = path.length() if pathLengths is None else pathLengths[i]
+
+        self._adjacency = [[] for _ in self.nodeIds]
+        for (pathStartId, pathEndId), pathLength in self.pathLengths.items():
+            i, j = self.nodeIndex[pathStartId], self.nodeIndex[pathEndId]
+            self._adjacency[i].append((j, pathLength))
+            self._adjacency[j].append((i, pathLength))
+
+    def _buildPlanningTables(self):
+        nodeCount = len(self.nodeIds)
+        distances = np.full((nodeCount, nodeCount), np.inf)
+        np.fill_diagonal(distances, 0.0)
+        predecessors = np.full((nodeCount, nodeCount), -1, dtype=np.int32)
+
+        for (pathStartId, pathEndId), pathLength in self.pathLengths.items():
+            i, j = self.nodeIndex[pathStartId], self.nodeIndex[pathEndId]
+            if pathLength < distances[i, j]:
+                distances[i, j] = distances[j, i] = pathLength
+                predecessors[i, j] = i
+                predecessors[j, i] = j
+
+        # Floyd-Warshall, relaxing every pair through node k at once
+        for k in range(nodeCount):
+            throughK = distances[:, k, np.newaxis] + distances[np.newaxis, k, :]
+            isShorter = throughK < distances
+            distances = np.where(isShorter, throughK, distances)
+            predecessors = np.where(isShorter, predecessors[np.newaxis, k, :], predecessors)
+
+        self.distanceTable = self._openDistanceTable = distances
+        self.predecessorTable = self._openPredecessorTable = predecessors
+
+    def _buildLandmarks(self, count: int = DEFAULT_LANDMARK_COUNT):
+        self.landmarks, self._landmarkDistances = selectLandmarks(
+            lambda i: self._openDistanceTable[i], len(self.nodeIds), count)
+
+    def blockEdge(self, startNodeId: str, endNodeId: str, ttl: float | None = None):
+        """
+        Marks the path between two adjacent nodes as impassable in both
+        directions, for ttl seconds or until unblockEdge is called.
+        Only the shortest paths that used this edge are recomputed.
+        """
+        pathKey = self._getPathKey(startNodeId, endNodeId)
+        expiry = None if ttl is None else time.monotonic() + ttl
+        with self._blockLock:
+            isNew = pathKey not in self._blockedEdges
+            self._blockedEdges[pathKey] = expiry
+            if not isNew:
+                return
+
+            # A pair needs recomputing if any of its shortest paths
+            # could run through this edge, in either direction
+            u, v = self.nodeIndex[pathKey[0]], self.nodeIndex[pathKey[1]]
+            length = self.pathLengths[pathKey]
+            distances = self.distanceTable
+            tolerance = 1e-9 * np.maximum(distances, 1.0)
+            with np.errstate(invalid="ignore"):
+                usesEdge = (np.abs(distances[:, u, np.newaxis] + length + distances[np.newaxis, v, :] - distances) <= tolerance) \
+                    | (np.abs(distances[:, v, np.newaxis] + length + distances[np.newaxis, u, :] - distances) <= tolerance)
+            self._recomputeRows(np.flatnonzero(usesEdge.any(axis=1)))
+        print(f"Blocked path {pathKey[0]} > {pathKey[1]}")
+
+    def unblockEdge(self, startNodeId: str, endNodeId: str):
+        pathKey = self._getPathKey(startNodeId, endNodeId)
+        with self._blockLock:
+            if pathKey not in self._blockedEdges:
+                return
+            del self._blockedEdges[pathKey]
+            self._reopenEdges([pathKey])
+        print(f"Unblocked path {pathKey[0]} > {pathKey[1]}")
+
+    def getBlockedEdges(self) -> dict[tuple[str, str], float | None]:
+        """Returns each blocked edge with the seconds until it reopens."""
+        self._purgeExpiredBlocks()
+        now = time.monotonic()
+        with self._blockLock:
+            return {
+                pathKey: None if expiry is None else expiry - now
+                for pathKey, expiry in self._blockedEdges.items()
+            }
+
+    def isEdgeBlocked(self, startNodeId: str, endNodeId: str) -> bool:
+        self._purgeExpiredBlocks()
+        return self._getPathKey(startNodeId, endNodeId) in self._blockedEdges
+
+    def _purgeExpiredBlocks(self):
+        now = time.monotonic()
+        with self._blockLock:
+            expired = [pathKey for pathKey, expiry in self._blockedEdges.items()
+                       if expiry is not None and expiry <= now]
+            if len(expired) <= 0:
+                return
+            for pathKey in expired:
+                del self._blockedEdges[pathKey]
+            self._reopenEdges(expired)
+        print(f"Block expired on {len(expired)} path(s)")
+
+    def _reopenEdges(self, pathKeys: list[tuple[str, str]]):
+        if len(self._blockedEdges) <= 0:
+            # Nothing left blocked, so the original tables are exact again
+            self.distanceTable = self._openDistanceTable
+            self.predecessorTable = self._openPredecessorTable
+            self._invalidatePlans()
+            return
+
+        # Distances only shrink when an edge reopens, and only for
+        # pairs that are now shorter by going through it
+        distances = self.distanceTable
+        rows = np.zeros(len(self.nodeIds), dtype=bool)
+        for pathKey in pathKeys:
+            u, v = self.nodeIndex[pathKey[0]], self.nodeIndex[pathKey[1]]
+            length = self.pathLengths[pathKey]
+            tolerance = 1e-9 * np.maximum(np.nan_to_num(distances, posinf=1.0), 1.0)
+            improves = (distances[:, u, np.newaxis] + length + distances[np.newaxis, v, :] < distances - tolerance) \
+                | (distances[:, v, np.newaxis] + length + distances[np.newaxis, u, :] < distances - tolerance)
+            rows |= improves.any(axis=1)
+        self._recomputeRows(np.flatnonzero(rows))
+
+    def _recomputeRows(self, rows: np.ndarray):
+        excluded = self._blockedIndexPairs()
+
+        # Swap in new tables rather than editing them, since the current
+        # ones may be shared with the open tables or memory-mapped
+        distances = np.array(self.distanceTable)
+        predecessors = np.array(self.predecessorTable)
+        for row in rows.tolist():
+            distances[row], predecessors[row] = dijkstra(self._adjacency, row, excluded)
+        self.distanceTable = distances
+        self.predecessorTable = predecessors
+        self._invalidatePlans()
+        print(f"Recomputed shortest paths from {len(rows)} of {len(self.nodeIds)} nodes")
+
+    def _blockedIndexPairs(self) -> set[tuple[int, int]]:
+        """Returns both directions of every blocked edge, by node index."""
+        excluded = set()
+        for pathStartId, pathEndId in self._blockedEdges:
+            i, j = self.nodeIndex[pathStartId], self.nodeIndex[pathEndId]
+            excluded.update([(i, j), (j, i)])
+        return excluded
+
+    def _invalidatePlans(self):
+        self._tripCache.clear()
+
+    def _getPathKey(self, startNodeId: str, endNodeId: str) -> tuple[str, str]:
+        if (startNodeId, endNodeId) in self.paths:
+            return (startNodeId, endNodeId)
+        if (endNodeId, startNodeId) in self.paths:
+            return (endNodeId, startNodeId)
+        raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
+
+    def _buildSpatialIndex(self, edgeSamples: dict[str, np.ndarray]):
+        self.spatialIndex = EdgeSpatialIndex(list(self.paths.keys()), edgeSamples, self.nodes)
+
+    def locate(self, point: complex) -> EdgeLocation | None:
+        """Finds the closest point on any edge of the map."""
+        location = self.spatialIndex.nearestEdge(point)
+        if location is None:
+            return None
+
+        # The index only knows edges as polylines, so project onto the
+        # real path for the exact answer
+        projection = closestPointOnPath(self.paths[location.edge], point)
+        return EdgeLocation(location.edge, projection.t, projection.arcLength,
+                            projection.distance, projection.point)
 
     def getHome(self):
         return list(self.nodes.keys())[0]
     
     def computeTripHash(self, nodeIds: list[str]) -> str:
-        return ",".join(nodeIds)
-    
-    def getShortestPathsByTrip(self, tripHash: str) -> EdgeToPathMap:
-        return self._shortestPathCache[tripHash]
+        return ",".join(sorted(set(nodeIds)))
     
-    def getShortestPaths(self, nodeIds: list[str]) -> EdgeToPathMap:
-        tripHash = self.computeTripHash(nodeIds)
-        if tripHash in self._shortestPathCache:
-            return self._shortestPathCache[tripHash]
-
-        # Build graph
-        edges: list[list[any, any, float]] = []
-        for pathPoints, path in self.paths.items():
-            pathStartId, pathEndId = pathPoints
-            pathLength = path.length()
-            edges.append([pathStartId, pathEndId, pathLength])
-        
-        # Compute the shortest path between each pair of stops
-        shortestPaths = {}
-        for startNodeId, endNodeId in combinations(nodeIds, 2):
-            graph = Graph(edges=edges, bi_directional=True)
-            finder = DijkstraFinder()
-            shortPath, shortPathLength = finder.find_path(graph.node(startNodeId), graph.node(endNodeId), graph)
-            shortPathIds = [node.node_id for node in shortPath]
-
-            shortestPaths[(startNodeId, endNodeId)] = (shortPathLength, shortPathIds)
-            shortestPaths[(endNodeId, startNodeId)] = (shortPathLength, shortPathIds[::-1])
-
-            # The pathfinding library is dumb and modifies the edges list
-            for edge in edges:
-                edge[0] = edge[0].node_id
-                edge[1] = edge[1].node_id
+    def cacheStats(self) -> dict[str, CacheStats]:
+        return {
+            "trips": self._tripCache.stats(),
+            "legs": self._legCache.stats(),
+        }
+
+    def getShortestPathLength(self, startNodeId: str, endNodeId: str) -> float:
+        return float(self.distanceTable[self.nodeIndex[startNodeId], self.nodeIndex[endNodeId]])
+
+    def getShortestPath(self, startNodeId: str, endNodeId: str) -> tuple[float, list[str]]:
+        start, end = self.nodeIndex[startNodeId], self.nodeIndex[endNodeId]
+        with self._blockLock:
+            distanceTable, predecessorTable = self.distanceTable, self.predecessorTable
+
+        pathLength = float(distanceTable[start, end])
+        if np.isinf(pathLength):
+            raise ValueError(f"There is no path from {startNodeId} to {endNodeId}")
+
+        # Walk the predecessors back from the end
+        pathIndices = [end]
+        while pathIndices[-1] != start:
+            pathIndices.append(int(predecessorTable[start, pathIndices[-1]]))
         
-        self._shortestPathCache[tripHash] = shortestPaths
-        return shortestPaths
+        return pathLength, [self.nodeIds[i] for i in reversed(pathIndices)]
     
+    def findRoute(self, startNodeId: str, endNodeId: str) -> RouteResult:
+        """
+        Finds the shortest route between two nodes with A*, around any
+        blocked paths. This is for one-off moves, like sending the robot
+        to a node by hand or back home, and doesn't touch the tables.
+        """
+        self._purgeExpiredBlocks()
+        start, end = self.nodeIndex[startNodeId], self.nodeIndex[endNodeId]
+        with self._blockLock:
+            excluded = self._blockedIndexPairs()
+
+        # Paths are never shorter than a straight line between their ends
+        positions = np.array(list(self.nodes.values()), dtype=np.complex128)
+        heuristic = np.maximum(np.abs(positions - positions[end]),
+                               landmarkHeuristic(self._landmarkDistances, end))
+
+        result = aStar(self._adjacency, start, end, heuristic, excluded)
+        if np.isinf(result.distance):
+            raise ValueError(f"There is no path from {startNodeId} to {endNodeId}")
+
+        nodeIds = [self.nodeIds[i] for i in result.nodes]
+        paths = [self._adjacentPaths[pathKey] for pathKey in zip(nodeIds[:-1], nodeIds[1:])]
+        return RouteResult(nodeIds, paths, result.distance, result.expanded)
+
     def getShortestAdjacentPath(self, startNodeId: str, endNodeId: str) -> Path:
-        isReversed = False
         pathKey = (startNodeId, endNodeId)
-        path: Path
-        
-        if pathKey not in self.paths:
-            pathKey = (endNodeId, startNodeId)
-            isReversed = True
-            if pathKey not in self.paths:
-                raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
-        
-        path = self.paths[pathKey]
-        if isReversed:
-            path = path.reversed()
+        if pathKey not in self._adjacentPaths:
+            raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
+        return self._adjacentPaths[pathKey]
+
+    def getEdgeWaypoints(self, startNodeId: str, endNodeId: str) -> PoseArray:
+        """
+        Returns the discretized waypoints for driving from one node to an
+        adjacent one, ending on the second node. Each edge is discretized
+        once, the first time it's needed in either direction, and reused
+        from then on.
+        """
+        pathKey = (startNodeId, endNodeId)
+        waypoints = self._waypointCache.get(pathKey)
+        if waypoints is not None:
+            return waypoints
+
+        if pathKey in self.paths:
+            forwardKey, reverseKey = pathKey, (endNodeId, startNodeId)
+        elif (endNodeId, startNodeId) in self.paths:
+            forwardKey, reverseKey = (endNodeId, startNodeId), pathKey
+        else:
+            raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
+
+        with self._waypointLock:
+            if forwardKey not in self._waypointCache:
+                waypoints, deviation = discretizePathAdaptive(
+                    self.paths[forwardKey], self.corridorWidth / 2, self.arcLengthTables[forwardKey])
+
+                # Driving the other way visits the same points backwards
+                # and faces the opposite direction at each one. Neither
+                # direction needs the node it starts from.
+                reverse = waypoints.reversed()[1:]
+
+                self._waypointDeviations[forwardKey] = deviation
+                self._waypointCache[reverseKey] = reverse
+                self._waypointCache[forwardKey] = waypoints[1:]
+        return self._waypointCache[pathKey]
+
+    def getEdgeTrack(self, startNodeId: str, endNodeId: str) -> PoseArray:
+        """
+        Returns poses every TRACK_SPACING inches along the path from one
+        node to an adjacent one, for following the path continuously
+        rather than stopping at waypoints.
+        """
+        if (startNodeId, endNodeId) in self.paths:
+            forwardKey, isReversed = (startNodeId, endNodeId), False
+        elif (endNodeId, startNodeId) in self.paths:
+            forwardKey, isReversed = (endNodeId, startNodeId), True
+        else:
+            raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
+
+        track = sampleTrack(self.paths[forwardKey], self.arcLengthTables[forwardKey])
+        return track.reversed() if isReversed else track
+
+    def findLegEnd(self, nodeIds: list[str], startIndex: int, stopNodeId: str | None) -> int:
+        """
+        Returns the index of the node a leg starting at nodeIds[startIndex]
+        should end on: the next stop, a corner too sharp to round off, or
+        the end of the route, whichever comes first.
+        """
+        for index in range(startIndex + 1, len(nodeIds) - 1):
+            if nodeIds[index] == stopNodeId:
+                return index
+            if self._cornerAngle(*nodeIds[index - 1:index + 2]) > MAX_FILLET_ANGLE:
+                return index
+        return len(nodeIds) - 1
+
+    def getLeg(self, nodeIds: list[str]) -> StitchedLeg:
+        """
+        Joins the paths through a run of adjacent nodes into one, so the
+        robot can drive it without stopping at the nodes in between. The
+        corner at each of those is rounded off with a fillet of up to
+        FILLET_RADIUS, trimming at most half of the edges on either side.
+        """
+        if len(nodeIds) < 2:
+            raise ValueError(f"A leg needs at least two nodes, got {nodeIds}")
+        return self._legCache.getOrCompute(tuple(nodeIds), lambda: self._stitchLeg(nodeIds))
+
+    def _stitchLeg(self, nodeIds: list[str]) -> StitchedLeg:
+        edges = list(zip(nodeIds[:-1], nodeIds[1:]))
+        if len(edges) == 1:
+            path = self.getShortestAdjacentPath(*edges[0])
+            return StitchedLeg(nodeIds, path, np.array([0.0, self.getArcLengthTable(*edges[0]).length]),
+                               self.getEdgeWaypoints(*edges[0]), self.getEdgeTrack(*edges[0]))
 
-        return path
+        # How much of each edge the fillets at either end of it take up
+        arcLengths = [self.getArcLengthTable(*edge) for edge in edges]
+        trims = np.zeros((len(edges), 2))
+        for index in range(1, len(nodeIds) - 1):
+            angle = self._cornerAngle(*nodeIds[index - 1:index + 2])
+            if angle > MAX_FILLET_ANGLE:
+                raise ValueError(f"The {angle:.0f}° corner at {nodeIds[index]} is too sharp to round off")
+            if angle < MIN_FILLET_ANGLE:
+                continue
+            trim = min(FILLET_RADIUS * np.tan(np.deg2rad(angle) / 2),
+                       arcLengths[index - 1].length / 2, arcLengths[index].length / 2)
+            trims[index - 1, 1] = trims[index, 0] = trim
 
-    def planTrip(self, stopIds: list[str]) -> PlanTripResult:
+        segments = []
+        nodeArcLengths = [0.0]
+        length = 0.0
+        lastEnd, lastTangent = None, None
+        for index, (edge, edgeArcLengths) in enumerate(zip(edges, arcLengths)):
+            edgePath = self.getShortestAdjacentPath(*edge)
+            cutTs = edgeArcLengths.tAt(np.array([trims[index, 0], edgeArcLengths.length - trims[index, 1]]))
+            cutPoints, cutTangents = evaluatePath(edgePath, cutTs)
+
+            # Round off the corner from where the last edge was cut to
+            # where this one starts
+            if trims[index, 0] > 0:
+                fillet = _fillet(lastEnd, lastTangent, complex(cutPoints[0]), complex(cutTangents[0]))
+                segments.append(fillet)
+                length += fillet.length()
+                nodeArcLengths[-1] = length - fillet.length() / 2
+
+            startT, endT = cutTs.tolist()
+            if endT > startT:
+                piece = edgePath.cropped(startT, endT) if startT > 0.0 or endT < 1.0 else edgePath
+                piece = [segment for segment in piece if segment.start != segment.end]
+                segments += piece
+                length += sum(segment.length() for segment in piece)
+            nodeArcLengths.append(length)
+            lastEnd, lastTangent = complex(cutPoints[1]), complex(cutTangents[1])
+
+        path = Path(*segments)
+        pathArcLengths = _measurePath(path)
+        waypoints, _ = discretizePathAdaptive(path, self.corridorWidth / 2, pathArcLengths)
+        return StitchedLeg(nodeIds, path, np.array(nodeArcLengths), waypoints[1:],
+                           sampleTrack(path, pathArcLengths))
+
+    def _edgeTangents(self, startNodeId: str, endNodeId: str) -> tuple[complex, complex]:
+        """Returns the direction of travel leaving the first node and arriving at the second."""
+        if (startNodeId, endNodeId) in self.paths:
+            _, tangents = evaluatePath(self.paths[(startNodeId, endNodeId)], np.array([0.0, 1.0]))
+            return complex(tangents[0]), complex(tangents[1])
+        _, tangents = evaluatePath(self.paths[self._getPathKey(startNodeId, endNodeId)], np.array([0.0, 1.0]))
+        return complex(-tangents[1]), complex(-tangents[0])
+
+    def _cornerAngle(self, previousNodeId: str, nodeId: str, nextNodeId: str) -> float:
+        """Returns how far the robot turns passing through a node, in degrees."""
+        _, arriving = self._edgeTangents(previousNodeId, nodeId)
+        leaving, _ = self._edgeTangents(nodeId, nextNodeId)
+        return float(abs(np.angle(leaving * np.conj(arriving), deg=True)))
+
+    def locateOnLeg(self, leg: StitchedLeg, point: complex) -> int:
+        """Returns the index in the leg's nodeIds of the start of the edge closest to point."""
+        return leg.edgeIndexAt(closestPointOnPath(leg.path, point).arcLength)
+
+    def getEdgeRemainder(self, startNodeId: str, endNodeId: str, point: complex) -> Path:
+        """
+        Returns the rest of the path from one node to an adjacent one,
+        starting from the closest point on it to point.
+        """
+        path = self.getShortestAdjacentPath(startNodeId, endNodeId)
+        t = closestPointOnPath(path, point).t
+        if t >= 1.0:
+            return Path()
+        return path.cropped(t, 1.0) if t > 0.0 else path
+
+    def getDiscretizationReport(self) -> dict[tuple[str, str], DiscretizationReport]:
+        """Discretizes every edge and reports how well the waypoints fit it."""
+        report = {}
+        for pathKey in self.paths.keys():
+            waypoints = self.getEdgeWaypoints(*pathKey)
+            report[pathKey] = DiscretizationReport(len(waypoints), self._waypointDeviations[pathKey])
+        return report
+
+    def getArcLengthTable(self, startNodeId: str, endNodeId: str) -> ArcLengthTable:
+        """Returns the arc length table for driving from one node to an adjacent one."""
+        if (startNodeId, endNodeId) in self.arcLengthTables:
+            return self.arcLengthTables[(startNodeId, endNodeId)]
+        if (endNodeId, startNodeId) in self.arcLengthTables:
+            return self.arcLengthTables[(endNodeId, startNodeId)].reversed()
+        raise ValueError(f"Nodes {startNodeId} and {endNodeId} are not directly connected")
+
+    def precomputeWaypoints(self) -> Thread:
+        """Discretizes every edge on a background thread."""
+        def precompute():
+            for pathStartId, pathEndId in list(self.paths.keys()):
+                self.getEdgeWaypoints(pathStartId, pathEndId)
+            print(f"Precomputed waypoints for {len(self.paths)} paths")
+
+        thread = Thread(target=precompute, daemon=True)
+        thread.start()
+        return thread
+
+    def planTrip(self, stopIds: list[str], solver: str | None = None,
+                 timeBudget: float = DEFAULT_TIME_BUDGET) -> PlanTripResult:
         homeId = self.getHome()
         print(f"Using {homeId} as HOME")
+        self._purgeExpiredBlocks()
 
-        shortestPaths = self.getShortestPaths([homeId, *stopIds])
-        
-        shortestPath: list[str] = None
-        shortestPathLength = float("inf")
-        
-        for x in itertools.permutations(stopIds):
-            candidatePath = [homeId, *x, homeId]
-            
-            candidateFullPath = []
-            candidateLength = 0
-            for i in range(len(candidatePath) - 1):
-                startNodeId = candidatePath[i]
-                endNodeId = candidatePath[i + 1]
-                subpathLength, subpath = shortestPaths[(startNodeId, endNodeId)]
-                candidateLength += subpathLength
-                candidateFullPath += subpath[:-1]
-            candidateFullPath.append(homeId)
-
-            if candidateLength < shortestPathLength:
-                shortestPath = candidateFullPath
-                shortestPathLength = candidateLength
-        return (self.computeTripHash([homeId, *stopIds]), shortestPath)
+        tripHash = self.computeTripHash([homeId, *stopIds])
+        cacheKey = (tripHash, solver)
+        trip = self._tripCache.get(cacheKey)
+        if trip is not None:
+            print(f"Reusing cached trip, length {trip.length:.1f}\"")
+            return trip
+
+        trip = self._planRoute(tripHash, homeId, stopIds, solver, timeBudget)
+        self._tripCache.put(cacheKey, trip)
+        return trip
+
+    def replanTrip(self, currentNodeId: str, stopIds: list[str], solver: str | None = None,
+                   timeBudget: float = DEFAULT_TIME_BUDGET) -> PlanTripResult:
+        """
+        Plans the rest of a trip that's already underway: from the
+        current node, through the remaining stops, and back home, around
+        any blocked paths. Stops that can't be reached are left out.
+        """
+        self._purgeExpiredBlocks()
+        tripHash = self.computeTripHash([self.getHome(), *stopIds])
+        return self._planRoute(tripHash, currentNodeId, stopIds, solver, timeBudget)
+
+    def _planRoute(self, tripHash: str, startId: str, stopIds: list[str],
+                   solver: str | None, timeBudget: float) -> PlanTripResult:
+        homeId = self.getHome()
+
+        # Home is always the end, and each stop only needs to be
+        # visited once no matter how many bins it has
+        with self._blockLock:
+            distanceTable = self.distanceTable
+        start, home = self.nodeIndex[startId], self.nodeIndex[homeId]
+        if np.isinf(distanceTable[start, home]):
+            raise ValueError(f"There is no path from {startId} back to {homeId}")
+
+        uniqueStopIds = []
+        for stopId in dict.fromkeys(stopIds):
+            if stopId == homeId or stopId == startId:
+                continue
+            if np.isinf(distanceTable[start, self.nodeIndex[stopId]]):
+                print(f"Skipping unreachable stop {stopId}")
+                continue
+            uniqueStopIds.append(stopId)
+
+        routeNodeIds = [startId, homeId, *uniqueStopIds]
+        routeIndices = [self.nodeIndex[nodeId] for nodeId in routeNodeIds]
+        distances = distanceTable[np.ix_(routeIndices, routeIndices)]
+
+        solution = solveTour(distances, 0, 1, list(range(2, len(routeNodeIds))),
+                             solver, timeBudget)
+        print(f"Planned trip with {solution.solver}, length {solution.cost:.1f}\"")
+
+        tripPath = self.expandRoute([startId, *[routeNodeIds[i] for i in solution.order], homeId])
+        return PlanTripResult(tripHash, tripPath, solution.cost, solution.solver)
+
+    def getDistanceMatrix(self, nodeIds: list[str]) -> np.ndarray:
+        """Returns the shortest path lengths between every pair of the given nodes."""
+        self._purgeExpiredBlocks()
+        indices = [self.nodeIndex[nodeId] for nodeId in nodeIds]
+        with self._blockLock:
+            return self.distanceTable[np.ix_(indices, indices)]
+
+    def expandRoute(self, nodeIds: list[str]) -> list[str]:
+        """
+        Fills in every node passed through when travelling between the
+        given nodes in order along shortest paths.
+        """
+        tripPath = nodeIds[:1]
+        for startNodeId, endNodeId in zip(nodeIds[:-1], nodeIds[1:]):
+            if startNodeId == endNodeId:
+                continue
+            _, subpath = self.getShortestPath(startNodeId, endNodeId)
+            tripPath += subpath[1:]
+        return tripPath
+
+    def estimateArrivalTimes(self, nodeIds: list[str]) -> np.ndarray:
+        """
+        Estimates the seconds of driving from the first node until each
+        node of a route is reached, starting out facing along the first
+        edge. Time spent waiting at stops isn't included.
+        """
+        # The whole route is estimated as one run of waypoints, so
+        # passing through a node costs no more than turning onto the
+        # next edge
+        edgeWaypoints = [self.getEdgeWaypoints(startNodeId, endNodeId) if startNodeId != endNodeId else PoseArray()
+                         for startNodeId, endNodeId in zip(nodeIds[:-1], nodeIds[1:])]
+        counts = np.array([len(waypoints) for waypoints in edgeWaypoints], dtype=np.int64)
+        if counts.sum() == 0:
+            return np.zeros(len(nodeIds))
+
+        waypoints = PoseArray(np.concatenate([waypoints.pos for waypoints in edgeWaypoints]),
+                              np.concatenate([waypoints.dir for waypoints in edgeWaypoints]))
+        times = estimateTravelTime(Pose(self.nodes[nodeIds[0]], waypoints[0].dir), waypoints)
+
+        # Each node is reached with the last waypoint of the edge into it
+        reached = np.cumsum(counts)
+        return np.concatenate(([0.0], np.where(reached > 0, times[np.maximum(reached - 1, 0)], 0.0)))
+
+    def measureProgress(self, nodeIds: list[str], edgeIndex: int, t: float = 0.0,
+                        arrivalTimes: np.ndarray | None = None) -> RouteProgress:
+        """
+        Measures how far along a route the robot is when it's at path
+        parameter t on the edge from nodeIds[edgeIndex] to the next node.
+        Pass the route's estimateArrivalTimes to avoid recomputing them.
+        """
+        edgeLengths = np.array([self.getArcLengthTable(a, b).length if a != b else 0.0
+                                for a, b in zip(nodeIds[:-1], nodeIds[1:])])
+        if arrivalTimes is None:
+            arrivalTimes = self.estimateArrivalTimes(nodeIds)
+
+        travelled = float(edgeLengths[:edgeIndex].sum())
+        timeTaken = float(arrivalTimes[edgeIndex])
+        if edgeIndex < len(edgeLengths) and edgeLengths[edgeIndex] > 0:
+            # Assume time passes evenly with distance along the edge
+            edgeTravelled = float(self.getArcLengthTable(nodeIds[edgeIndex], nodeIds[edgeIndex + 1]).sAt(t))
+            travelled += edgeTravelled
+            edgeTime = arrivalTimes[edgeIndex + 1] - arrivalTimes[edgeIndex]
+            timeTaken += edgeTime * edgeTravelled / edgeLengths[edgeIndex]
+
+        return RouteProgress(travelled, float(edgeLengths.sum()) - travelled,
+                             float(arrivalTimes[-1]) - timeTaken)
 
     def toSvg(self):
         xmin, xmax, ymin, ymax = bboxCombine([p.bbox() for p in self.paths.values()])
@@ -148,21 +831,21 @@ class FloorMap:
         vbWidth = 2 * xmax * scaleFactor
         vbHeight = 2 * ymax * scaleFactor
 
-        svgStr = f"<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"{vbWidth}\" height=\"{vbHeight}\" >"
+        svgParts = [f"<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"{vbWidth}\" height=\"{vbHeight}\" >"]
         
-        svgStr += f"<g transform=\"scale({scaleFactor})\">"
+        svgParts.append(f"<g transform=\"scale({scaleFactor})\">")
         
         for pathId, path in self.paths.items():
-            svgStr += f"<path id=\"{pathId}\" d=\"{path.d()}\" stroke-width=\"2\" stroke=\"#C83737\" fill=\"transparent\" />"
+            svgParts.append(f"<path id=\"{pathId}\" d=\"{path.d()}\" stroke-width=\"2\" stroke=\"#C83737\" fill=\"transparent\" />")
         
         for nodeId, nodePoint in self.nodes.items():
             nodeColor = "#500000"
             if nodeId in self.rooms.keys():
                 nodeColor = "#005000"
-            svgStr += f"<circle id=\"{nodeId}\" cx=\"{nodePoint.real}\" cy=\"{nodePoint.imag}\" r=\"2\" fill=\"{nodeColor}\"/>"
+            svgParts.append(f"<circle id=\"{nodeId}\" cx=\"{nodePoint.real}\" cy=\"{nodePoint.imag}\" r=\"2\" fill=\"{nodeColor}\"/>")
         
-        svgStr += "</g></svg>"
-        return svgStr
+        svgParts.append("</g></svg>")
+        return "".join(svgParts)
 
 
 if __name__ == "__main__":
@@ -176,5 +859,10 @@ if __name__ == "__main__":
         floormapSvg = floormap.toSvg()
         file.write(floormapSvg)
 
+    report = floormap.getDiscretizationReport()
+    for (startNodeId, endNodeId), (waypointCount, maxDeviation) in report.items():
+        print(f"{startNodeId} -> {endNodeId}: {waypointCount} waypoints, {maxDeviation:.2f}\" off the path")
+    print(f"{sum(r.waypointCount for r in report.values())} waypoints in total, corridor {floormap.corridorWidth}\" wide")
+
     trip = floormap.planTrip(["r111a", "r106-1"])
     print(trip)
@@ -0,0 +1,196 @@
+from svgpathtools import Path, Line, QuadraticBezier, CubicBezier, Arc
+from typing import Any
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+
+# Compiled maps live next to their source, e.g. maps/TestA.floormapc
+COMPILED_SUFFIX = ".floormapc"
+
+# Bump this whenever the layout or the set of stored arrays changes
+# so stale files get rebuilt instead of misread.
+COMPILED_VERSION = 3
+
+_MAGIC = b"FMAPC\x00\x00"
+_ALIGNMENT = 64
+
+SEGMENT_LINE = 0
+SEGMENT_QUADRATIC = 1
+SEGMENT_CUBIC = 2
+SEGMENT_ARC = 3
+
+_ARC_LARGE = 0b01
+_ARC_SWEEP = 0b10
+
+class CompiledMap:
+    """
+    A compiled floor map. The header holds the small, structured
+    values (names, ids, rooms) and the arrays are read-only views
+    into a single memory map of the file.
+    """
+    header: dict[str, Any]
+    arrays: dict[str, np.ndarray]
+
+    def __init__(self, header: dict[str, Any], arrays: dict[str, np.ndarray]):
+        self.header = header
+        self.arrays = arrays
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+def compiledPathFor(sourcePath: str) -> str:
+    return os.path.splitext(sourcePath)[0] + COMPILED_SUFFIX
+
+def hashSource(sourceBytes: bytes) -> str:
+    return hashlib.sha256(sourceBytes).hexdigest()
+
+def readCompiledMap(compiledPath: str, sourceHash: str) -> CompiledMap | None:
+    """
+    Memory-maps a compiled map. Returns None if the file is missing,
+    was written by a different version, or was built from a different
+    source than the one with the given hash.
+    """
+    try:
+        with open(compiledPath, "rb") as file:
+            prefix = file.read(len(_MAGIC) + 5)
+            if len(prefix) < len(_MAGIC) + 5 or not prefix.startswith(_MAGIC):
+                return None
+
+            version, headerLength = struct.unpack("<BI", prefix[len(_MAGIC):])
+            if version != COMPILED_VERSION:
+                return None
+
+            header = json.loads(file.read(headerLength))
+            if header.get("sourceHash") != sourceHash:
+                return None
+
+        data = np.memmap(compiledPath, dtype=np.uint8, mode="r")
+    except (OSError, ValueError):
+        return None
+
+    arrays: dict[str, np.ndarray] = {}
+    for name, (dtype, shape, offset) in header.pop("arrays").items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = data[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+
+    return CompiledMap(header, arrays)
+
+def writeCompiledMap(compiledPath: str, sourceHash: str,
+                     header: dict[str, Any], arrays: dict[str, np.ndarray]) -> bool:
+    """
+    Writes a compiled map, replacing any existing one atomically.
+    Returns False if the file could not be written, which is not fatal:
+    the map simply gets parsed again next time.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    relativeOffsets: dict[str, int] = {}
+    offset = 0
+    for name, array in arrays.items():
+        relativeOffsets[name] = offset
+        offset = _align(offset + array.nbytes)
+
+    # Array offsets are absolute, so they depend on the header length,
+    # which in turn depends on the offsets. Grow until it fits.
+    prefixLength = len(_MAGIC) + 5
+    dataStart = 0
+    while True:
+        arrayTable = {
+            name: (array.dtype.str, list(array.shape), dataStart + relativeOffsets[name])
+            for name, array in arrays.items()
+        }
+        headerBytes = json.dumps({**header, "sourceHash": sourceHash, "arrays": arrayTable}).encode("utf-8")
+        requiredStart = _align(prefixLength + len(headerBytes))
+        if requiredStart <= dataStart:
+            break
+        dataStart = requiredStart
+    headerBytes = headerBytes.ljust(dataStart - prefixLength)
+
+    tempPath = f"{compiledPath}.{os.getpid()}.tmp"
+    try:
+        with open(tempPath, "wb") as file:
+            file.write(_MAGIC)
+            file.write(struct.pack("<BI", COMPILED_VERSION, len(headerBytes)))
+            file.write(headerBytes)
+            for array in arrays.values():
+                file.write(b"\x00" * (_align(file.tell()) - file.tell()))
+                file.write(array.tobytes())
+        os.replace(tempPath, compiledPath)
+        return True
+    except OSError as e:
+        print(f"Could not write compiled map {compiledPath}: {e}")
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        return False
+
+def encodePaths(paths: list[Path]) -> dict[str, np.ndarray]:
+    """
+    Flattens paths into segment arrays. Each segment stores up to four
+    complex values: the Bezier control points, or for arcs the start,
+    radius, end and rotation (as the real part).
+    """
+    offsets = [0]
+    kinds = []
+    points = []
+    flags = []
+    for path in paths:
+        for segment in path:
+            segmentPoints = [0j] * 4
+            segmentFlags = 0
+            if isinstance(segment, Line):
+                kind = SEGMENT_LINE
+                segmentPoints[:2] = segment.bpoints()
+            elif isinstance(segment, QuadraticBezier):
+                kind = SEGMENT_QUADRATIC
+                segmentPoints[:3] = segment.bpoints()
+            elif isinstance(segment, CubicBezier):
+                kind = SEGMENT_CUBIC
+                segmentPoints[:4] = segment.bpoints()
+            elif isinstance(segment, Arc):
+                kind = SEGMENT_ARC
+                segmentPoints = [segment.start, segment.radius, segment.end, complex(segment.rotation)]
+                segmentFlags = (_ARC_LARGE if segment.large_arc else 0) \
+                    | (_ARC_SWEEP if segment.sweep else 0)
+            else:
+                raise TypeError(f"Unsupported path segment {type(segment).__name__}")
+
+            kinds.append(kind)
+            points.append(segmentPoints)
+            flags.append(segmentFlags)
+        offsets.append(len(kinds))
+
+    return {
+        "pathSegmentOffsets": np.array(offsets, dtype=np.int32),
+        "segmentKinds": np.array(kinds, dtype=np.uint8),
+        "segmentPoints": np.array(points, dtype=np.complex128).reshape(-1, 4),
+        "segmentFlags": np.array(flags, dtype=np.uint8),
+    }
+
+def decodePaths(compiled: CompiledMap) -> list[Path]:
+    offsets = compiled["pathSegmentOffsets"].tolist()
+    kinds = compiled["segmentKinds"].tolist()
+    points = compiled["segmentPoints"].tolist()
+    flags = compiled["segmentFlags"].tolist()
+
+    paths = []
+    for pathIndex in range(len(offsets) - 1):
+        segments = []
+        for i in range(offsets[pathIndex], offsets[pathIndex + 1]):
+            kind, p = kinds[i], points[i]
+            if kind == SEGMENT_LINE:
+                segments.append(Line(p[0], p[1]))
+            elif kind == SEGMENT_QUADRATIC:
+                segments.append(QuadraticBezier(p[0], p[1], p[2]))
+            elif kind == SEGMENT_CUBIC:
+                segments.append(CubicBezier(p[0], p[1], p[2], p[3]))
+            else:
+                segments.append(Arc(p[0], p[1], p[3].real,
+                                    bool(flags[i] & _ARC_LARGE), bool(flags[i] & _ARC_SWEEP), p[2]))
+        paths.append(Path(*segments))
+    return paths
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
@@ -0,0 +1,172 @@
+from typing import Callable, NamedTuple
+import heapq
+import numpy as np
+
+# adjacency[i] lists (neighbor, edge length) for every edge out of node i
+Adjacency = list[list[tuple[int, float]]]
+
+def dijkstra(adjacency: Adjacency, source: int,
+             excluded: set[tuple[int, int]] = frozenset()) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Single-source shortest paths. Returns the distance to every node
+    and the node before it on the shortest path (-1 if unreachable or
+    the source). Edges (i, j) in excluded are skipped in that direction.
+    """
+    nodeCount = len(adjacency)
+    distances = np.full(nodeCount, np.inf)
+    predecessors = np.full(nodeCount, -1, dtype=np.int32)
+    distances[source] = 0.0
+
+    visited = [False] * nodeCount
+    queue = [(0.0, source)]
+    while len(queue) > 0:
+        distance, node = heapq.heappop(queue)
+        if visited[node]:
+            continue
+        visited[node] = True
+
+        for neighbor, length in adjacency[node]:
+            if (node, neighbor) in excluded:
+                continue
+            candidate = distance + length
+            if candidate < distances[neighbor]:
+                distances[neighbor] = candidate
+                predecessors[neighbor] = node
+                heapq.heappush(queue, (candidate, neighbor))
+
+    return distances, predecessors
+
+class SearchResult(NamedTuple):
+    distance: float
+    """The length of the path found, inf if the target is unreachable."""
+
+    nodes: list[int]
+    """The path from source to target, empty if unreachable."""
+
+    expanded: int
+    """How many nodes were taken off the queue, a measure of the work done."""
+
+def aStar(adjacency: Adjacency, source: int, target: int, heuristic: np.ndarray | None = None,
+          excluded: set[tuple[int, int]] = frozenset()) -> SearchResult:
+    """
+    Point-to-point shortest path. heuristic[i] must be a consistent
+    lower bound on the distance from i to target, such as the
+    straight-line distance, or the landmark bounds from
+    landmarkHeuristic. Without one this is Dijkstra stopping early.
+    """
+    nodeCount = len(adjacency)
+    if heuristic is None:
+        heuristic = np.zeros(nodeCount)
+    heuristic = heuristic.tolist()
+
+    distances = [np.inf] * nodeCount
+    predecessors = [-1] * nodeCount
+    visited = [False] * nodeCount
+    distances[source] = 0.0
+
+    expanded = 0
+    queue = [(heuristic[source], source)]
+    while len(queue) > 0:
+        _, node = heapq.heappop(queue)
+        if visited[node]:
+            continue
+        visited[node] = True
+        expanded += 1
+        if node == target:
+            break
+
+        for neighbor, length in adjacency[node]:
+            if visited[neighbor] or (node, neighbor) in excluded:
+                continue
+            candidate = distances[node] + length
+            if candidate < distances[neighbor]:
+                distances[neighbor] = candidate
+                predecessors[neighbor] = node
+                heapq.heappush(queue, (candidate + heuristic[neighbor], neighbor))
+
+    if not visited[target]:
+        return SearchResult(np.inf, [], expanded)
+
+    nodes = [target]
+    while nodes[-1] != source:
+        nodes.append(predecessors[nodes[-1]])
+    return SearchResult(distances[target], nodes[::-1], expanded)
+
+def selectLandmarks(distancesFrom: Callable[[int], np.ndarray], nodeCount: int,
+                    count: int, first: int = 0) -> tuple[list[int], np.ndarray]:
+    """
+    Picks landmarks farthest-first: the node farthest from first, then
+    repeatedly the node farthest from every landmark so far. Nodes no
+    landmark can reach are picked before anything else, so each
+    connected part of the graph gets one. Returns the landmarks and
+    their distances to every node, one row per landmark.
+    """
+    landmarks = []
+    rows = []
+    nearest = np.asarray(distancesFrom(first), dtype=np.float64)
+    for _ in range(min(count, nodeCount)):
+        candidate = np.where(np.isin(np.arange(nodeCount), landmarks), -1.0, nearest)
+        landmark = int(np.argmax(candidate))
+        if candidate[landmark] < 0:
+            break
+
+        row = np.asarray(distancesFrom(landmark), dtype=np.float64)
+        landmarks.append(landmark)
+        rows.append(row)
+        nearest = np.minimum(nearest, row) if len(landmarks) > 1 else row
+
+    return landmarks, np.array(rows).reshape(len(rows), nodeCount)
+
+def landmarkHeuristic(landmarkDistances: np.ndarray, target: int) -> np.ndarray:
+    """
+    Lower bounds on the distance from every node to target from the
+    triangle inequality, |d(L, target) - d(L, i)| for each landmark L.
+    The bounds still hold after edges are removed, since that can only
+    make real distances longer.
+    """
+    if len(landmarkDistances) <= 0:
+        return np.zeros(landmarkDistances.shape[1])
+
+    with np.errstate(invalid="ignore"):
+        bounds = np.abs(landmarkDistances[:, target, np.newaxis] - landmarkDistances)
+    # A landmark that reaches neither node says nothing about them
+    bounds[np.isnan(bounds)] = 0.0
+    return bounds.max(axis=0)
+
+if __name__ == "__main__":
+    import time
+
+    # A jittered grid with some corridors missing, standing in for a
+    # large floor map, with every edge a little longer than its chord
+    rng = np.random.default_rng(0)
+    size = 120
+    positions = (np.arange(size)[:, np.newaxis] + 1j * np.arange(size)[np.newaxis, :]).ravel() * 48.0
+    positions += rng.normal(0.0, 6.0, positions.shape) + 1j * rng.normal(0.0, 6.0, positions.shape)
+    adjacency: Adjacency = [[] for _ in positions]
+    for i in range(len(positions)):
+        for j in (i + 1, i + size):
+            if j < len(positions) and (j != i + 1 or j % size != 0) and rng.random() > 0.15:
+                length = abs(positions[j] - positions[i]) * rng.uniform(1.0, 1.3)
+                adjacency[i].append((j, length))
+                adjacency[j].append((i, length))
+
+    landmarks, landmarkDistances = selectLandmarks(lambda i: dijkstra(adjacency, i)[0], len(positions), 8)
+    queries = [tuple(rng.integers(0, len(positions), 2)) for _ in range(200)]
+
+    def euclidean(target):
+        return np.abs(positions - positions[target])
+
+    heuristics = {
+        "dijkstra": lambda target: None,
+        "euclidean": euclidean,
+        "landmarks": lambda target: landmarkHeuristic(landmarkDistances, target),
+        "both": lambda target: np.maximum(euclidean(target), landmarkHeuristic(landmarkDistances, target)),
+    }
+
+    print(f"{len(positions)} nodes, {len(queries)} queries")
+    for name, heuristic in heuristics.items():
+        start = time.perf_counter()
+        results = [aStar(adjacency, source, target, heuristic(target)) for source, target in queries]
+        elapsed = time.perf_counter() - start
+        expanded = np.mean([result.expanded for result in results])
+        print(f"{name:>10}: {expanded:8.1f} nodes expanded, {elapsed / len(queries) * 1000:.2f}ms per query")
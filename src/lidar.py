@@ -1,4 +1,4 @@
-from threading import Thread
+from threading import Condition, Thread
 from typing import Union
 import numpy as np
 from rplidar import RPLidar
@@ -10,6 +10,11 @@ _abort = False
 _rawScanData: dict[float, float] = {}
 _scanData: dict[float, float] = None
 
+# Counts completed revolutions. _scanReady is notified each time one is
+# published, so consumers can wait for the next one instead of polling.
+_scanSeq: int = 0
+_scanReady = Condition()
+
 class LidarScanData:
     _data: dict[float, float]
 
@@ -67,13 +72,18 @@ class LidarScanData:
 def _scanLoop():
     global _scanData
     global _rawScanData
+    global _scanSeq
 
     for (new_scan, quality, angle, distance) in lidar.iter_measures(scan_type='express'):
         if _abort:
             return
         if new_scan:
-            _scanData = dict(_rawScanData)
-            _rawScanData.clear()
+            # A published scan is never modified again, so it can be
+            # handed out without copying
+            with _scanReady:
+                _scanData, _rawScanData = _rawScanData, {}
+                _scanSeq += 1
+                _scanReady.notify_all()
         if distance != 0.0:
             # Un-mirror the image, align with x-y axes, then correct orientation
             angle = np.mod(360 - angle + 11.4 + 90.0, 360.0)
@@ -86,6 +96,17 @@ def scan() -> LidarScanData:
         sleep(0.1)
     return LidarScanData(dict(_scanData))
 
+def waitForScan(afterSeq: int, timeout: float | None = None) -> tuple[int, dict[float, float]] | None:
+    """
+    Waits for a revolution newer than afterSeq and returns its sequence
+    number with the raw scan, in inches. The scan must not be modified.
+    Returns None if no new revolution arrives within the timeout.
+    """
+    with _scanReady:
+        if not _scanReady.wait_for(lambda: _scanSeq > afterSeq, timeout):
+            return None
+        return _scanSeq, _scanData
+
 def cleanScan() -> LidarScanData:
     """
     Cleans a raw scan and returns data in inches
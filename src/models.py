@@ -39,9 +39,45 @@ class MailRouteStop(Serializable):
 
 class RequestedMailRoute(Serializable):
     stops: Dict[int, str]
+    followMode: str
+    """How the robot follows paths, one of FOLLOW_MODES in path_following."""
 
-    def __init__(self, json: dict[str, str] | None = None) -> None:
+    def __init__(self, json: dict[str, str] | None = None, followMode: str = "waypoints") -> None:
         self.stops = {}
+        self.followMode = followMode
         if json is not None:
             for k, v in json.items():
-                self.stops[int(k)] = str(v)
\ No newline at end of file
+                self.stops[int(k)] = str(v)
+
+class BlockedPath(Serializable):
+    start: str
+    end: str
+    ttl: Optional[float]
+    """Seconds until the path reopens, or None if it's blocked until cleared."""
+
+    def __init__(self, start: str, end: str, ttl: Optional[float] = None) -> None:
+        self.start = start
+        self.end = end
+        self.ttl = ttl
+
+class TripPlan(Serializable):
+    stops: List[str]
+    """The room IDs of the stops, in the order they'll be visited."""
+
+    nodeIds: List[str]
+    length: float
+    """The total length of the trip in inches."""
+
+    eta: float
+    """Estimated seconds of driving for the whole trip."""
+
+    stopEtas: List[float]
+    """Estimated seconds of driving until each stop is reached."""
+
+    def __init__(self, stops: List[str], nodeIds: List[str], length: float,
+                 eta: float, stopEtas: List[float]) -> None:
+        self.stops = stops
+        self.nodeIds = nodeIds
+        self.length = length
+        self.eta = eta
+        self.stopEtas = stopEtas
@@ -0,0 +1,89 @@
+from typing import NamedTuple
+import numpy as np
+
+class MotionLimits(NamedTuple):
+    maxSpeed: float
+    """Peak speed, in units per second."""
+
+    maxAccel: float
+    """Acceleration and deceleration, in units per second squared."""
+
+class MoveReport(NamedTuple):
+    target: float
+    """The requested displacement of the wheel that had furthest to go."""
+
+    duration: float
+    """Seconds from the start of the move until it settled."""
+
+    profileDuration: float
+    """Seconds the profile was planned to take."""
+
+    settleTime: float
+    """Seconds spent after the profile ended getting within tolerance."""
+
+    overshoot: float
+    """How far either wheel went past its target, 0 if neither did."""
+
+    finalError: float
+    """How far the furthest wheel was from its target once stopped."""
+
+    def summary(self) -> str:
+        return (f"{self.target:.1f}° in {self.duration:.2f}s ({self.profileDuration:.2f}s planned, "
+                f"{self.settleTime:.2f}s settling), overshoot {self.overshoot:.1f}°, error {self.finalError:.1f}°")
+
+class TrapezoidalProfile:
+    """
+    Position and velocity targets for moving a displacement as fast as
+    the limits allow: accelerate at maxAccel, cruise at maxSpeed, then
+    decelerate to a stop right on the target. Moves too short to reach
+    cruising speed become triangular.
+    """
+    def __init__(self, displacement: float, limits: MotionLimits):
+        if limits.maxSpeed <= 0 or limits.maxAccel <= 0:
+            raise ValueError(f"Speed and acceleration limits must be positive, got {limits}")
+        self.displacement = displacement
+        self.limits = limits
+
+        distance = abs(displacement)
+        accelTime = limits.maxSpeed / limits.maxAccel
+        if limits.maxAccel * accelTime ** 2 > distance:
+            accelTime = np.sqrt(distance / limits.maxAccel)
+        self.accelTime = float(accelTime)
+        self.peakSpeed = float(limits.maxAccel * accelTime)
+        self.cruiseTime = (distance - self.peakSpeed * accelTime) / self.peakSpeed if self.peakSpeed > 0 else 0.0
+        self.duration = 2 * self.accelTime + self.cruiseTime
+
+    def sample(self, t):
+        """Returns the target position and velocity t seconds into the move."""
+        t = np.clip(t, 0.0, self.duration)
+        accel = self.limits.maxAccel
+        decelStart = self.accelTime + self.cruiseTime
+        untilEnd = self.duration - t
+
+        position = np.where(t < self.accelTime, accel * t ** 2 / 2,
+                   np.where(t < decelStart, self.peakSpeed * (t - self.accelTime / 2),
+                            abs(self.displacement) - accel * untilEnd ** 2 / 2))
+        velocity = np.where(t < self.accelTime, accel * t,
+                   np.where(t < decelStart, self.peakSpeed, accel * untilEnd))
+
+        sign = np.sign(self.displacement)
+        if np.ndim(position) == 0:
+            return float(sign * position), float(sign * velocity)
+        return sign * position, sign * velocity
+
+def trapezoidDuration(displacements: np.ndarray, limits: MotionLimits) -> np.ndarray:
+    """TrapezoidalProfile.duration for a whole array of displacements at once."""
+    distances = np.abs(displacements)
+    rampDistance = limits.maxSpeed ** 2 / limits.maxAccel
+    return np.where(distances >= rampDistance,
+                    distances / limits.maxSpeed + limits.maxSpeed / limits.maxAccel,
+                    2 * np.sqrt(distances / limits.maxAccel))
+
+if __name__ == "__main__":
+    limits = MotionLimits(320.0, 1200.0)
+    for displacement in (30.0, 600.0, -600.0):
+        profile = TrapezoidalProfile(displacement, limits)
+        ts = np.linspace(0.0, profile.duration, 9)
+        positions, velocities = profile.sample(ts)
+        print(f"{displacement:.0f}°: {profile.duration:.2f}s, peak {profile.peakSpeed:.0f}°/s")
+        print("  " + ", ".join(f"{p:.0f}°@{v:.0f}°/s" for p, v in zip(positions, velocities)))
@@ -1,15 +1,17 @@
-from collections.abc import Generator
-from svgpathtools import Path
-from numpy import arange
-from typing import  Tuple
+from svgpathtools import Path, Line, QuadraticBezier, CubicBezier, Arc
+from typing import NamedTuple, Tuple
+from arc_length import ArcLengthTable
+import math
 import sys
 import numpy as np
 
 class Pose:
-    pos: complex = complex(0)
+    __slots__ = ("pos", "dir")
+
+    pos: complex
     """The position of the body's center of mass."""
 
-    dir: float = 0.0
+    dir: float
     """The heading angle in degrees relative to the forward direction of the body."""
 
     def __init__(self, pos: complex = complex(0), dir: float = 0.0):
@@ -18,6 +20,9 @@ class Pose:
 
     def __str__(self) -> str:
         return f"{self.pos.real:.2f}\", {self.pos.imag:.2f}\", {self.dir:.1f}°"
+
+    def __repr__(self) -> str:
+        return f"Pose({self.pos!r}, {self.dir!r})"
     
     def __add__(self, other):
         pos = self.pos + other.pos
@@ -32,17 +37,117 @@ class Pose:
     def _addDir(self, otherDir: float):
         return addAnglesDeg(self.dir, otherDir)
 
+class PoseView(Pose):
+    """A Pose that reads and writes one entry of a PoseArray."""
+    __slots__ = ("_poses", "_index")
+
+    def __init__(self, poses: "PoseArray", index: int):
+        self._poses = poses
+        self._index = index
+
+    @property
+    def pos(self) -> complex:
+        return complex(self._poses.pos[self._index])
+
+    @pos.setter
+    def pos(self, value: complex):
+        self._poses.pos[self._index] = value
+
+    @property
+    def dir(self) -> float:
+        return float(self._poses.dir[self._index])
+
+    @dir.setter
+    def dir(self, value: float):
+        self._poses.dir[self._index] = value
+
+class PoseArray:
+    """
+    A sequence of poses stored as columns, so whole trajectories can be
+    transformed at once. Indexing gives a PoseView, slicing gives a
+    PoseArray sharing the same memory, like NumPy does.
+    """
+    __slots__ = ("pos", "dir")
+
+    pos: np.ndarray
+    """Positions, as complex128."""
+
+    dir: np.ndarray
+    """Headings in degrees, as float64."""
+
+    def __init__(self, pos: np.ndarray | None = None, dir: np.ndarray | None = None):
+        self.pos = np.zeros(0, dtype=np.complex128) if pos is None else np.asarray(pos, dtype=np.complex128)
+        self.dir = np.zeros(len(self.pos)) if dir is None else np.asarray(dir, dtype=np.float64)
+        if self.pos.shape != self.dir.shape:
+            raise ValueError(f"Got {len(self.pos)} positions but {len(self.dir)} headings")
+
+    @staticmethod
+    def fromPoses(poses) -> "PoseArray":
+        if isinstance(poses, PoseArray):
+            return poses
+        poses = list(poses)
+        return PoseArray(np.array([p.pos for p in poses], dtype=np.complex128),
+                         np.array([p.dir for p in poses], dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self.pos)
+            if not 0 <= index < len(self.pos):
+                raise IndexError("PoseArray index out of range")
+            return PoseView(self, int(index))
+        return PoseArray(self.pos[index], self.dir[index])
+
+    def __iter__(self):
+        for i in range(len(self.pos)):
+            yield PoseView(self, i)
+
+    def __str__(self) -> str:
+        return "[" + ", ".join(str(pose) for pose in self) + "]"
+
+    def __repr__(self) -> str:
+        return f"PoseArray({self.pos!r}, {self.dir!r})"
+
+    def __add__(self, other):
+        return PoseArray(self.pos + other.pos, np.fmod(self.dir + other.dir, 360.0))
+
+    def __sub__(self, other):
+        return PoseArray(self.pos - other.pos, np.fmod(self.dir - other.dir, 360.0))
+
+    def normalized(self) -> "PoseArray":
+        """Returns a copy with every heading in [-180°, 180°]."""
+        return PoseArray(self.pos.copy(), normalizeHeadings(self.dir))
+
+    def reversed(self) -> "PoseArray":
+        """Returns the poses for driving the same points the other way."""
+        return PoseArray(self.pos[::-1].copy(), normalizeHeadings(self.dir[::-1] + 180.0))
+
+    def copy(self) -> "PoseArray":
+        return PoseArray(self.pos.copy(), self.dir.copy())
+
+    def toList(self) -> list[Pose]:
+        return [Pose(pos, dir) for pos, dir in zip(self.pos.tolist(), self.dir.tolist())]
+
 def addAnglesDeg(theta1: float, theta2: float) -> float:
     theta3 = theta1 + theta2
-    return np.fmod(theta3, 360.0)
+    return math.fmod(theta3, 360.0)
 
 def normalizeHeading(dir: float) -> float:
-    dir = np.fmod(dir, 360.0)
+    dir = math.fmod(dir, 360.0)
     absDir = abs(dir)
     if absDir > 180.0:
-        return -np.sign(dir) * (360.0 - absDir)
+        return -math.copysign(360.0 - absDir, dir)
     return dir
 
+def normalizeHeadings(dirs: np.ndarray) -> np.ndarray:
+    """normalizeHeading for a whole array at once."""
+    dirs = np.fmod(dirs, 360.0)
+    absDirs = np.abs(dirs)
+    return np.where(absDirs > 180.0, -np.sign(dirs) * (360.0 - absDirs), dirs)
+
 def bboxCombine(bboxes: list[Tuple[float, float, float, float]]) -> Tuple[float, float, float, float]:
     xmin, xmax, ymin, ymax = sys.float_info.max, sys.float_info.min, sys.float_info.max, sys.float_info.min
     for bbox in bboxes:
@@ -56,82 +161,353 @@ def bboxCombine(bboxes: list[Tuple[float, float, float, float]]) -> Tuple[float,
             ymax = bbox[3]
     return xmin, xmax, ymin, ymax
 
-def closestPointOnPath(path: Path, point: complex) -> Tuple[float, complex]:
-    closest = (-1.0, None, sys.float_info.max)
-    epsilon = 0.0001
-    step = 0.01
-
-    while True:
-        current = _closestPointOnPath(path, point, step)
-        delta = abs(current[2] - closest[2])
-        print(delta)
-        if delta > 0:
-            closest = current
-        if delta > epsilon:
-            step /= 10
+class PathProjection(NamedTuple):
+    t: float
+    """The path parameter of the closest point."""
+
+    point: complex
+    distance: float
+    """The distance from the query point to the closest point."""
+
+    arcLength: float
+    """The distance along the path from its start to the closest point."""
+
+def closestPointOnPath(path: Path, point: complex) -> PathProjection:
+    """
+    Projects a point onto a path. Lines are projected exactly, and
+    Beziers by solving for the roots of d/dt |B(t) - point|^2, with
+    every segment of the same degree solved in one batch.
+    """
+    segmentStarts, segmentEnds = _segmentBreaks(path)
+    segmentTs = np.zeros(len(path))
+    distances = np.full(len(path), np.inf)
+    projections = np.zeros(len(path), dtype=np.complex128)
+
+    byType: dict[type, list[int]] = {}
+    for segmentIndex, segment in enumerate(path):
+        byType.setdefault(type(segment), []).append(segmentIndex)
+
+    for segmentType, segmentIndices in byType.items():
+        segments = [path[i] for i in segmentIndices]
+        if segmentType is Line:
+            ts = _projectOntoLines(segments, point)
+        elif segmentType is QuadraticBezier or segmentType is CubicBezier:
+            ts = _projectOntoBeziers(segments, point)
         else:
-            break
-        
-    return closest
-
-def _closestPointOnPath(path: Path, point: complex, step: float) -> Tuple[float, complex, float]:
-    closest = (-1.0, None, sys.float_info.max)
-
-    for t in arange(0, 1, step):
-        pathPoint: complex = path.point(t)
-        distance = abs(pathPoint - point)
-        if distance < closest[2]:
-            closest = (float(t), pathPoint, distance)
-        
-    return closest
-
-def discretizePath(path: Path) -> list[Pose]:
-    # Preston doesn't need hundredth-of-an-inch accuracy,
-    # so any two points with a change in heading of less than
-    # 0.04774 degrees is assumed to be a straight line.
-    # This value was computed as the maximum angle that
-    # produces less than 1/100" across a distance of 10 feet.
-    MERGE_TOLERANCE_DIR = 0.04774
-    MERGE_TOLERANCE_POS = 6
-
-    # Determine delta t to achieve segments of <1 inch
-    dt = path.ilength(1.0)
-
-    points: list[Pose] = []
-    lastState: Pose = None
-
-    for t in np.arange(0.0, 1.0 + dt, dt):
-        if t > 1.0:
-            break
-
-        # Use t-value to get position and orientation
-        baseVec = path.point(t)
-        tangentVec = path.unit_tangent(t)
-
-        # Note that the heading is in degrees, relative to +x
-        heading = np.angle(tangentVec, deg=True)
-        
-        state = Pose()
-        state.pos = baseVec
-        state.dir = heading
-
-        # For straight lines, there's no need to go a single inch
-        # at a time, so let's combine it with the previous one
-        if lastState != None \
-            and abs(lastState.dir - heading) <= MERGE_TOLERANCE_DIR \
-            and abs(lastState.pos - baseVec) <= MERGE_TOLERANCE_POS:
-            # Skip previous state
-            points[-1] = state
-
-            # Make sure we don't duplicate this state or update the
-            # previous heading. This should help prevent long, gentle
-            # curves from being optimized to straight lines
+            ts = np.array([_projectBySampling(segment, point) for segment in segments])
+
+        for segmentIndex, segment, t in zip(segmentIndices, segments, ts.tolist()):
+            segmentPoint = evaluateSegment(segment, np.array([t]))[0][0]
+            segmentTs[segmentIndex] = t
+            projections[segmentIndex] = segmentPoint
+            distances[segmentIndex] = abs(segmentPoint - point)
+
+    best = int(np.argmin(distances))
+    t = float(segmentTs[best])
+    arcLength = sum(segment.length() for segment in path[:best]) + path[best].length(0, t)
+    pathT = segmentStarts[best] + t * (segmentEnds[best] - segmentStarts[best])
+    return PathProjection(float(pathT), complex(projections[best]), float(distances[best]), float(arcLength))
+
+def _projectOntoLines(lines: list[Line], point: complex) -> np.ndarray:
+    starts = np.array([line.start for line in lines])
+    directions = np.array([line.end for line in lines]) - starts
+    lengthsSquared = np.abs(directions) ** 2
+    dots = ((point - starts) * np.conj(directions)).real
+    return np.clip(np.divide(dots, lengthsSquared, out=np.zeros_like(dots), where=lengthsSquared > 0), 0.0, 1.0)
+
+def _projectOntoBeziers(beziers: list, point: complex) -> np.ndarray:
+    # Power basis coefficients of B(t) - point, lowest order first
+    bpoints = np.array([bezier.bpoints() for bezier in beziers])
+    if bpoints.shape[1] == 3:
+        p0, p1, p2 = bpoints.T
+        coeffs = np.stack([p0 - point, 2 * (p1 - p0), p0 - 2 * p1 + p2], axis=1)
+    else:
+        p0, p1, p2, p3 = bpoints.T
+        coeffs = np.stack([p0 - point, 3 * (p1 - p0), 3 * (p0 - 2 * p1 + p2), -p0 + 3 * (p1 - p2) + p3], axis=1)
+    degree = coeffs.shape[1] - 1
+    derivativeCoeffs = coeffs[:, 1:] * np.arange(1, degree + 1)
+
+    # The closest point is an end or a root of Re[(B(t) - point) * conj(B'(t))]
+    products = np.zeros((len(beziers), 2 * degree), dtype=np.float64)
+    for i in range(degree + 1):
+        for j in range(degree):
+            products[:, i + j] += (coeffs[:, i] * np.conj(derivativeCoeffs[:, j])).real
+
+    candidates = [np.zeros((len(beziers), 1)), np.ones((len(beziers), 1)), _realRootsInUnitInterval(products)]
+    candidates = np.concatenate(candidates, axis=1)
+
+    # Evaluate |B(t) - point| at every candidate by Horner's rule
+    values = np.zeros(candidates.shape, dtype=np.complex128)
+    for k in range(degree, -1, -1):
+        values = values * candidates + coeffs[:, k, np.newaxis]
+    distances = np.where(np.isnan(candidates), np.inf, np.abs(values))
+    return candidates[np.arange(len(beziers)), np.argmin(distances, axis=1)]
+
+def _realRootsInUnitInterval(coeffs: np.ndarray) -> np.ndarray:
+    """
+    Finds the real roots in [0, 1] of a batch of polynomials, given
+    lowest order first, as the eigenvalues of their companion matrices.
+    Returns one row per polynomial, padded with NaN.
+    """
+    count, order = coeffs.shape
+    roots = np.full((count, order - 1), np.nan)
+
+    # A vanishing leading coefficient means a lower degree, which the
+    # batch can't handle, so those fall back to np.roots one at a time
+    scale = np.abs(coeffs).max(axis=1)
+    isFullDegree = np.abs(coeffs[:, -1]) > 1e-12 * np.maximum(scale, 1e-300)
+    full = np.flatnonzero(isFullDegree)
+    if len(full) > 0:
+        monic = coeffs[full, :-1] / coeffs[full, -1, np.newaxis]
+        companions = np.zeros((len(full), order - 1, order - 1))
+        companions[:, 0, :] = -monic[:, ::-1]
+        companions[:, np.arange(1, order - 1), np.arange(order - 2)] = 1.0
+        roots[full] = _keepUnitInterval(np.linalg.eigvals(companions))
+    for i in np.flatnonzero(~isFullDegree).tolist():
+        found = _keepUnitInterval(np.roots(np.trim_zeros(coeffs[i, ::-1], "f"))[np.newaxis, :])[0]
+        roots[i, :len(found)] = found
+    return roots
+
+def _keepUnitInterval(roots: np.ndarray) -> np.ndarray:
+    isReal = np.abs(roots.imag) <= 1e-9 * np.maximum(1.0, np.abs(roots.real))
+    real = np.clip(roots.real, 0.0, 1.0)
+    return np.where(isReal & (roots.real >= -1e-9) & (roots.real <= 1 + 1e-9), real, np.nan)
+
+def _projectBySampling(segment, point: complex) -> float:
+    # Arcs don't have polynomial roots to find, so zoom in on the
+    # closest sample until the bracket is negligible
+    low, high = 0.0, 1.0
+    for _ in range(5):
+        ts = np.linspace(low, high, 65)
+        best = int(np.argmin(np.abs(evaluateSegment(segment, ts)[0] - point)))
+        low, high = ts[max(best - 1, 0)], ts[min(best + 1, len(ts) - 1)]
+    return float((low + high) / 2)
+
+# Preston doesn't need hundredth-of-an-inch accuracy,
+# so any two points with a change in heading of less than
+# 0.04774 degrees is assumed to be a straight line.
+# This value was computed as the maximum angle that
+# produces less than 1/100" across a distance of 10 feet.
+MERGE_TOLERANCE_DIR = 0.04774
+MERGE_TOLERANCE_POS = 6
+
+def evaluatePath(path: Path, ts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates path.point(T) and path.unit_tangent(T) for an array of
+    path parameters at once, one array operation per segment. T maps
+    onto segments by length exactly like svgpathtools does it.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    segmentStarts, segmentEnds = _segmentBreaks(path)
+
+    # The first segment that ends at or after T, with T = 0 and T = 1
+    # pinned to the very start and end like Path.point does. Maps
+    # often end paths with a zero length line, which has no tangent,
+    # so T = 1 goes to the end of the last segment that has a length.
+    segmentIndices = np.minimum(np.searchsorted(segmentEnds, ts, side="left"), len(path) - 1)
+    segmentIndices[ts == 0.0] = 0
+    hasLength = np.flatnonzero(segmentEnds > segmentStarts)
+    segmentIndices[ts == 1.0] = hasLength[-1] if len(hasLength) > 0 else len(path) - 1
+    spans = segmentEnds[segmentIndices] - segmentStarts[segmentIndices]
+    segmentTs = np.divide(ts - segmentStarts[segmentIndices], spans,
+                          out=np.zeros_like(ts), where=spans > 0)
+    segmentTs[ts == 0.0] = 0.0
+    segmentTs[ts == 1.0] = 1.0
+
+    points = np.empty(len(ts), dtype=np.complex128)
+    tangents = np.empty(len(ts), dtype=np.complex128)
+    for segmentIndex, segment in enumerate(path):
+        mask = segmentIndices == segmentIndex
+        if not mask.any():
             continue
+        points[mask], tangents[mask] = evaluateSegment(segment, segmentTs[mask])
+    return points, tangents
 
-        points.append(state)
-        lastState = state
-    
-    return points
+def _segmentBreaks(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the path parameters where each segment starts and ends."""
+    segmentLengths = np.array([segment.length() for segment in path])
+    pathLength = segmentLengths.sum()
+    segmentEnds = np.cumsum(segmentLengths / pathLength) if pathLength > 0 else segmentLengths
+    return np.concatenate(([0.0], segmentEnds[:-1])), segmentEnds
+
+def evaluateSegment(segment, t: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if isinstance(segment, Line):
+        direction = segment.end - segment.start
+        tangent = direction / abs(direction) if direction != 0 else 0j
+        return segment.start + direction * t, np.full(len(t), tangent)
+
+    if isinstance(segment, QuadraticBezier):
+        p0, p1, p2 = segment.bpoints()
+        tc = 1 - t
+        points = tc * tc * p0 + 2 * tc * t * p1 + t * t * p2
+        derivatives = 2 * ((p1 - p0) * tc + (p2 - p1) * t)
+    elif isinstance(segment, CubicBezier):
+        p0, p1, p2, p3 = segment.bpoints()
+        points = p0 + t * (3 * (p1 - p0) + t * (3 * (p0 + p2) - 6 * p1 + t * (-p0 + 3 * (p1 - p2) + p3)))
+        tc = 1 - t
+        derivatives = 3 * (p1 - p0) * tc ** 2 + 6 * (p2 - p1) * tc * t + 3 * (p3 - p2) * t ** 2
+    elif isinstance(segment, Arc):
+        angles = np.radians(segment.theta + t * segment.delta)
+        cosPhi, sinPhi = segment.rot_matrix.real, segment.rot_matrix.imag
+        rx, ry = segment.radius.real, segment.radius.imag
+        points = (rx * cosPhi * np.cos(angles) - ry * sinPhi * np.sin(angles) + segment.center.real) \
+            + 1j * (rx * sinPhi * np.cos(angles) + ry * cosPhi * np.sin(angles) + segment.center.imag)
+        phi = np.radians(segment.rotation)
+        k = np.radians(segment.delta)
+        derivatives = k * ((-rx * np.cos(phi) * np.sin(angles) - ry * np.sin(phi) * np.cos(angles))
+                           + 1j * (-rx * np.sin(phi) * np.sin(angles) + ry * np.cos(phi) * np.cos(angles)))
+    else:
+        return np.array([segment.point(ti) for ti in t]), np.array([segment.unit_tangent(ti) for ti in t])
+
+    magnitudes = np.abs(derivatives)
+    tangents = np.divide(derivatives, magnitudes, out=np.zeros_like(derivatives), where=magnitudes > 0)
+
+    # Where the derivative vanishes the tangent is a limit, which
+    # svgpathtools knows how to find
+    for i in np.flatnonzero(magnitudes == 0).tolist():
+        tangents[i] = segment.unit_tangent(float(t[i]))
+    return points, tangents
+
+def discretizePath(path: Path, arcLengths: ArcLengthTable | None = None) -> PoseArray:
+    """
+    Samples the path about every inch, merging samples along straight
+    stretches. The robot drives with discretizePathAdaptive instead;
+    this is kept as the fixed-spacing reference it's measured against,
+    and for the benchmark below.
+    """
+    # Determine delta t to achieve segments of <1 inch, from the
+    # path's arc length table if it has one
+    dt = float(arcLengths.tAt(1.0)) if arcLengths is not None else path.ilength(1.0)
+    ts = np.arange(0.0, 1.0 + dt, dt)
+    ts = ts[ts <= 1.0]
+
+    # Note that the heading is in degrees, relative to +x
+    positions, tangents = evaluatePath(path, ts)
+    headings = np.angle(tangents, deg=True)
+
+    # For straight lines, there's no need to go a single inch at a
+    # time, so consecutive samples close to the first one in their
+    # run are combined and only the last of each run is kept. Runs
+    # are measured from their first sample rather than the previous
+    # one to prevent long, gentle curves from being optimized to
+    # straight lines.
+    keep = [runEnd - 1 for runEnd in _mergeRuns(positions, headings)]
+    return PoseArray(positions[keep], headings[keep])
+
+def _mergeRuns(positions: np.ndarray, headings: np.ndarray) -> list[int]:
+    """Returns the index just past the end of each run of mergeable samples."""
+    sampleCount = len(positions)
+    nextRun = np.full(sampleCount, sampleCount)
+    pending = np.arange(sampleCount)
+    window = 16
+    while len(pending) > 0:
+        # Compare every sample to the next few after it, and find the
+        # first one that's too far off to merge
+        offsets = np.arange(1, window + 1)
+        candidates = pending[:, np.newaxis] + offsets
+        inRange = candidates < sampleCount
+        candidates = np.minimum(candidates, sampleCount - 1)
+        breaksRun = inRange & (
+            (np.abs(headings[candidates] - headings[pending, np.newaxis]) > MERGE_TOLERANCE_DIR)
+            | (np.abs(positions[candidates] - positions[pending, np.newaxis]) > MERGE_TOLERANCE_POS))
+
+        hasBreak = breaksRun.any(axis=1)
+        nextRun[pending[hasBreak]] = candidates[hasBreak, np.argmax(breaksRun[hasBreak], axis=1)]
+
+        # Runs that reach the end of the path are done, the rest need
+        # a wider window
+        pending = pending[~hasBreak & (pending + window < sampleCount - 1)]
+        window *= 2
+
+    runEnds = []
+    runStart = 0
+    while runStart < sampleCount:
+        runStart = int(nextRun[runStart])
+        runEnds.append(runStart)
+    return runEnds
+
+# Spacing of the samples discretizePathAdaptive checks its chords
+# against. A corner can be cut by at most half of this on top of the
+# deviation allowed.
+ADAPTIVE_SAMPLE_SPACING = 0.25        # in
+
+def discretizePathAdaptive(path: Path, maxDeviation: float,
+                           arcLengths: ArcLengthTable | None = None) -> tuple[PoseArray, float]:
+    """
+    Picks as few waypoints as it can while keeping the straight line
+    between each pair within maxDeviation inches of the path. Spacing
+    starts from the local curvature, so straight stretches become a
+    single move and tight curves get as many as they need. Unlike
+    discretizePath, the first waypoint is the start of the path.
+    Returns the waypoints and the largest deviation of any chord.
+    """
+    if maxDeviation <= 0:
+        raise ValueError(f"Maximum deviation must be positive, got {maxDeviation}")
+
+    # Dense samples, evenly spaced along the path, plus every segment
+    # break so corners are never cut
+    if arcLengths is not None:
+        length = arcLengths.length
+        ts = arcLengths.tAt(np.arange(0.0, length, ADAPTIVE_SAMPLE_SPACING))
+    else:
+        length = path.length()
+        ts = np.linspace(0.0, 1.0, max(int(np.ceil(length / ADAPTIVE_SAMPLE_SPACING)), 1), endpoint=False)
+    ts = np.unique(np.concatenate((ts, _segmentBreaks(path)[1], [0.0, 1.0])))
+    positions, tangents = evaluatePath(path, ts)
+    headings = np.angle(tangents, deg=True)
+
+    # Curvature from the turn between neighbouring tangents. A chord
+    # across an arc of radius r bulges by c²/8r, so the longest chord
+    # that fits is sqrt(8 r maxDeviation).
+    distances = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(positions)))))
+    turns = np.abs(np.angle(tangents[1:] * np.conj(tangents[:-1])))
+    curvatures = np.divide(turns, np.diff(distances), out=np.zeros_like(turns), where=np.diff(distances) > 0)
+    curvatures = np.maximum(np.concatenate((curvatures, [0.0])), 1e-9)
+    chordLengths = np.sqrt(8 * maxDeviation / curvatures)
+
+    keep = [0]
+    worstDeviation = 0.0
+    last = len(positions) - 1
+    while keep[-1] < last:
+        start = keep[-1]
+
+        # Guess the end from the curvature, grow the chord until it
+        # doesn't fit, then narrow down on the longest one that does
+        guess = int(np.searchsorted(distances, distances[start] + chordLengths[start], side="right")) - 1
+        end = min(max(guess, start + 1), last)
+        fits, tooFar = start + 1, last + 1
+        if _chordDeviation(positions, start, end) <= maxDeviation:
+            fits = end
+            step = max(end - start, 1)
+            while fits < last:
+                end = min(fits + step, last)
+                if _chordDeviation(positions, start, end) > maxDeviation:
+                    tooFar = end
+                    break
+                fits = end
+                step *= 2
+        else:
+            tooFar = end
+        while tooFar - fits > 1:
+            middle = (fits + tooFar) // 2
+            if _chordDeviation(positions, start, middle) <= maxDeviation:
+                fits = middle
+            else:
+                tooFar = middle
+
+        worstDeviation = max(worstDeviation, _chordDeviation(positions, start, fits))
+        keep.append(fits)
+
+    return PoseArray(positions[keep], headings[keep]), worstDeviation
+
+def _chordDeviation(positions: np.ndarray, start: int, end: int) -> float:
+    """The farthest the samples from start to end get from the line between them."""
+    chord = positions[end] - positions[start]
+    offsets = positions[start:end + 1] - positions[start]
+    if chord == 0:
+        return float(np.abs(offsets).max())
+    along = np.clip((offsets * np.conj(chord)).real / (abs(chord) ** 2), 0.0, 1.0)
+    return float(np.abs(offsets - along * chord).max())
 
 if __name__ == "__main__":
     from svgpathtools import parse_path
@@ -144,3 +520,43 @@ if __name__ == "__main__":
         correction = point - robotState
         robotState += correction
         print(correction)
+
+    def discretizePathScalar(path: Path) -> list[Pose]:
+        """discretizePath as it was before it was vectorized, one sample at a time."""
+        dt = path.ilength(1.0)
+        points: list[Pose] = []
+        lastState: Pose = None
+        for t in np.arange(0.0, 1.0 + dt, dt):
+            if t > 1.0:
+                break
+            state = Pose(path.point(t), np.angle(path.unit_tangent(t), deg=True))
+            if lastState != None \
+                and abs(lastState.dir - state.dir) <= MERGE_TOLERANCE_DIR \
+                and abs(lastState.pos - state.pos) <= MERGE_TOLERANCE_POS:
+                points[-1] = state
+                continue
+            points.append(state)
+            lastState = state
+        return points
+
+    # Time discretizePath against the one-sample-at-a-time version it
+    # replaced, on a long, curvy path
+    import time
+    path = parse_path("M 0 0 C 120 0 120 240 240 240 S 360 0 480 0 Q 600 0 600 120 A 120 120 0 0 1 480 240 L 0 240")
+    timings = {}
+    for discretize in (discretizePathScalar, discretizePath):
+        start = time.perf_counter()
+        for _ in range(10):
+            waypoints = discretize(path)
+        timings[discretize] = (time.perf_counter() - start) / 10
+        print(f"{discretize.__name__}: {len(waypoints)} waypoints in {timings[discretize] * 1000:.1f}ms")
+    print(f"Speedup: {timings[discretizePathScalar] / timings[discretizePath]:.1f}x")
+
+    # And the adaptive discretizer the robot drives with, at a few
+    # deviations from the path
+    for maxDeviation in (0.5, 1.0, 2.0, 4.0):
+        start = time.perf_counter()
+        waypoints, deviation = discretizePathAdaptive(path, maxDeviation)
+        elapsed = time.perf_counter() - start
+        print(f"discretizePathAdaptive({maxDeviation}\"): {len(waypoints)} waypoints, "
+              f"{deviation:.2f}\" off the path, in {elapsed * 1000:.1f}ms")
@@ -1,6 +1,15 @@
-from lidar import LidarScanData, cleanScan, disconnect, init
+from lidar import LidarScanData, cleanScan, disconnect, init, waitForScan
+from threading import Event, Thread
+from time import monotonic
 import numpy as np
-from typing import Iterator, Union
+from typing import Iterator, NamedTuple, Union
+
+# The path counts as blocked when more than this many lidar points
+# are inside the box
+BLOCKING_POINT_COUNT = 3
+
+# Closer than this is the lidar seeing itself, see cleanScan
+MINIMUM_VALID_DISTANCE = 0.5          # in
 
 _box = None
 
@@ -34,6 +43,16 @@ def minimumDistance(angle: float) -> float:
         return 15 / (_cosDeg(180-x))
     return 0.0
 
+def minimumDistances(angles: np.ndarray) -> np.ndarray:
+    """minimumDistance for a whole array of angles at once."""
+    x = np.mod(angles, 360.0)
+    with np.errstate(divide="ignore"):
+        return np.select(
+            [x < 25, x < 90, x < 155, x < 180],
+            [15 / np.cos(np.deg2rad(x)), 6 / np.cos(np.deg2rad(90 - x)),
+             6 / np.cos(np.deg2rad(x - 90)), 15 / np.cos(np.deg2rad(180 - x))],
+            0.0)
+
 def nearestWithinBox(scanData: Union[LidarScanData, None] = None) -> Iterator[tuple[float, float]]:
     """
     Returns the angle and distance of all obstacles within the box window.
@@ -41,10 +60,104 @@ def nearestWithinBox(scanData: Union[LidarScanData, None] = None) -> Iterator[tu
     if scanData == None:
         scanData = cleanScan()
 
-    for angle, measured in scanData:
-        minimum = minimumDistance(angle)
-        if measured <= minimum:
-            yield angle, measured
+    data = scanData.data()
+    angles = np.fromiter(data.keys(), dtype=np.float64, count=len(data))
+    distances = np.fromiter(data.values(), dtype=np.float64, count=len(data))
+    inBox = distances <= minimumDistances(angles)
+    yield from zip(angles[inBox].tolist(), distances[inBox].tolist())
+
+class ObstacleState(NamedTuple):
+    scanSeq: int
+    """The lidar revolution this was worked out from, 0 if none yet."""
+
+    blocked: bool
+    obstacleCount: int
+    """How many lidar points are inside the box."""
+
+    nearestAngle: float
+    """Angle of the closest point inside the box, NaN if there isn't one."""
+
+    nearestDistance: float
+    """Distance to the closest point inside the box in inches, inf if there isn't one."""
+
+    timestamp: float
+    """The time.monotonic() at which the revolution was processed."""
+
+NO_OBSTACLES = ObstacleState(0, False, 0, float("nan"), float("inf"), 0.0)
+
+def evaluateScan(data: dict[float, float], scanSeq: int = 0) -> ObstacleState:
+    """Works out the obstacle state from one raw lidar revolution."""
+    angles = np.fromiter(data.keys(), dtype=np.float64, count=len(data))
+    distances = np.fromiter(data.values(), dtype=np.float64, count=len(data))
+    inBox = (distances >= MINIMUM_VALID_DISTANCE) & (distances <= minimumDistances(angles))
+
+    obstacleCount = int(np.count_nonzero(inBox))
+    if obstacleCount <= 0:
+        return ObstacleState(scanSeq, False, 0, float("nan"), float("inf"), monotonic())
+
+    nearest = np.flatnonzero(inBox)[np.argmin(distances[inBox])]
+    return ObstacleState(scanSeq, obstacleCount > BLOCKING_POINT_COUNT, obstacleCount,
+                         float(angles[nearest]), float(distances[nearest]), monotonic())
+
+class ObstacleMonitor:
+    """
+    Checks every lidar revolution for obstacles exactly once, on its own
+    thread, and publishes the result as a single ObstacleState. Reading
+    the state is just reading an attribute, so the drive loop pays the
+    same tiny cost no matter how dense the scans are.
+    """
+    def __init__(self):
+        self.state: ObstacleState = NO_OBSTACLES
+        self._thread: Thread | None = None
+        self._stopping = Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="obstacle-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        lastSeq = 0
+        while not self._stopping.is_set():
+            # Time out now and then to notice being stopped
+            latest = waitForScan(lastSeq, timeout=0.5)
+            if latest is None:
+                continue
+
+            # Replacing the whole tuple keeps readers from ever seeing
+            # half of one revolution and half of another
+            lastSeq, data = latest
+            self.state = evaluateScan(data, lastSeq)
+
+monitor = ObstacleMonitor()
+
+def getObstacleState() -> ObstacleState:
+    """
+    Returns the latest obstacle state from the monitor. If it isn't
+    running, a revolution newer than the last one checked is evaluated
+    on the spot, without waiting for one. Until any revolution arrives
+    that's NO_OBSTACLES.
+    """
+    if monitor.running:
+        return monitor.state
+
+    latest = waitForScan(monitor.state.scanSeq, timeout=0)
+    if latest is not None:
+        scanSeq, data = latest
+        monitor.state = evaluateScan(data, scanSeq)
+    return monitor.state
 
 
 if __name__ == "__main__":
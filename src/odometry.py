@@ -1,6 +1,7 @@
 import numpy as np
 
-from nav_utils import Pose, normalizeHeading
+from nav_utils import Pose, PoseArray, normalizeHeading, normalizeHeadings
+from motion_profile import MotionLimits, trapezoidDuration
 from vector import polar2cart, rotationMatrix
 
 # define robot geometry
@@ -15,6 +16,22 @@ TURN_RATIO = 10.0544                  # wheel_deg / body_deg
 ANGLE_DISTANCE_RATIO = 49.822         # deg/in
 DISTANCE_ANGLE_RATIO = 1 / ANGLE_DISTANCE_RATIO         # in/deg
 
+# Drive parameters, also used for estimating travel times
+FORWARD_DUTY_CYCLE = 0.8              # duty cycle for straight moves
+TURN_DUTY_CYCLE = 1.0                 # duty cycle for turns in place
+MAX_WHEEL_SPEED = np.rad2deg(7.0)     # deg/s at full duty, see phi_max in speed_control
+MAX_WHEEL_ACCEL = 1200.0              # deg/s², how hard moves speed up and slow down
+MOVE_OVERHEAD = 0.15                  # s lost settling onto the target at the end of each move
+
+# Moves never plan for more than this fraction of full speed, leaving
+# the wheel speed controllers room to make up for a low battery
+SPEED_HEADROOM = 0.85
+
+# Wheel speed and acceleration limits for the motion profiles of each
+# kind of move, in wheel deg/s and deg/s²
+FORWARD_LIMITS = MotionLimits(min(FORWARD_DUTY_CYCLE, SPEED_HEADROOM) * MAX_WHEEL_SPEED, MAX_WHEEL_ACCEL)
+TURN_LIMITS = MotionLimits(min(TURN_DUTY_CYCLE, SPEED_HEADROOM) * MAX_WHEEL_SPEED, MAX_WHEEL_ACCEL)
+
 def computeWheelAnglesForTurn(bodyAngle: float) -> tuple[float, float]:
     """
     Effectively converts a body rotation to wheel rotations.
@@ -38,6 +55,17 @@ def computeWheelAnglesForForward(forwardDistanceInches: float) -> tuple[float, f
     wheelAngle = forwardDistanceInches * ANGLE_DISTANCE_RATIO
     return wheelAngle, wheelAngle
 
+def computeWheelAnglesForArc(forwardDistanceInches: float, curvature: float) -> tuple[float, float]:
+    """
+    Converts driving along an arc to wheel rotations. Curvature is in
+    radians per inch, positive to turn left like computeWheelAnglesForTurn.
+    A curvature of 0 is the same as computeWheelAnglesForForward.
+    Return value is (left, right) in degrees.
+    """
+    forwardAngle = forwardDistanceInches * ANGLE_DISTANCE_RATIO
+    turnAngle = np.rad2deg(forwardDistanceInches * curvature) * TURN_RATIO
+    return forwardAngle - turnAngle, forwardAngle + turnAngle
+
 def computeDeltaThetaDeg(previousAngle: float, currentAngle: float) -> float:
     dTheta = currentAngle - previousAngle
     if abs(dTheta) > 180.0:
@@ -48,26 +76,103 @@ def computeDeltaThetaDeg(previousAngle: float, currentAngle: float) -> float:
     # Divide by 2, the motor-sproket gear ratio
     return dTheta / 2.0
 
-def computePoseFromWheelAngles(startPose: Pose, wheelAngleL: float, wheelAngleR: float):
-    distanceL, distanceR = wheelAngleL * DISTANCE_ANGLE_RATIO, wheelAngleR * DISTANCE_ANGLE_RATIO
+def computePoseFromWheelAngles(startPose: Pose, wheelAngleL: float, wheelAngleR: float) -> Pose:
+    """
+    Updates a pose for any wheel displacements, assuming both wheels
+    turned at steady speeds so the robot drove along a circular arc.
+    Pure forward moves and turns in place are the two extremes of that.
+    Exact for small steps of a continuously steered move.
+    """
+    distance = (wheelAngleL + wheelAngleR) / 2 * DISTANCE_ANGLE_RATIO
+    headingChange = (wheelAngleR - wheelAngleL) / 2 / TURN_RATIO
+
+    # The arc's chord points halfway between the start and end headings,
+    # and is shorter than the arc by sin(x)/x of half the turn
+    halfTurn = np.deg2rad(headingChange) / 2
+    chord = distance * np.sinc(halfTurn / np.pi)
+    posDelta = polar2cart(chord, startPose.dir + headingChange / 2)
+    return Pose(startPose.pos + posDelta, normalizeHeading(startPose.dir + headingChange))
+
+class OdometryIntegrator:
+    """
+    Dead reckons the robot's pose from the wheel displacements read at
+    each encoder sample, treating the motion between two samples as an
+    arc. Feed it every dThetaL, dThetaR from computeDeltaThetaDeg.
+    """
+    def __init__(self, startPose: Pose | None = None):
+        self.pose = Pose() if startPose is None else Pose(startPose.pos, startPose.dir)
+        self.distance = 0.0
+        """Total inches driven, forwards or backwards."""
+
+    def update(self, dThetaL: float, dThetaR: float) -> Pose:
+        self.pose = computePoseFromWheelAngles(self.pose, dThetaL, dThetaR)
+        self.distance += abs(dThetaL + dThetaR) / 2 * DISTANCE_ANGLE_RATIO
+        return self.pose
+
+    def reset(self, pose: Pose):
+        self.pose = Pose(pose.pos, pose.dir)
+
+def integrateWheelDeltas(startPose: Pose, dThetaL: np.ndarray, dThetaR: np.ndarray) -> PoseArray:
+    """
+    Integrates a whole series of wheel displacements at once, the same
+    way OdometryIntegrator does one at a time. Returns the pose after
+    each sample.
+    """
+    dThetaL, dThetaR = np.asarray(dThetaL, dtype=np.float64), np.asarray(dThetaR, dtype=np.float64)
+    distances = (dThetaL + dThetaR) / 2 * DISTANCE_ANGLE_RATIO
+    headingChanges = (dThetaR - dThetaL) / 2 / TURN_RATIO
+
+    headings = startPose.dir + np.cumsum(headingChanges)
+    chordHeadings = headings - headingChanges / 2
+    chords = distances * np.sinc(np.deg2rad(headingChanges) / 2 / np.pi)
+    positions = startPose.pos + np.cumsum(chords * np.exp(1j * np.deg2rad(chordHeadings)))
+    return PoseArray(positions, normalizeHeadings(headings))
+
+def integrateLog(filePath: str, startPose: Pose | None = None) -> PoseArray:
+    """
+    Replays the dThetaL and dThetaR columns of a drive log written by
+    path_following, returning the pose after each entry.
+    """
+    with open(filePath, "r") as file:
+        headers = file.readline().strip().split(",")
+    columns = np.loadtxt(filePath, delimiter=",", skiprows=1, ndmin=2,
+                         usecols=(headers.index("dThetaL"), headers.index("dThetaR")))
+    return integrateWheelDeltas(Pose() if startPose is None else startPose, columns[:, 0], columns[:, 1])
+
+def estimateTravelTime(startPose: Pose, waypoints: PoseArray | list[Pose]) -> np.ndarray:
+    """
+    Estimates how long it takes to drive through each waypoint the way
+    follow_waypoints does: turn to face it and drive straight to it,
+    then at the last one, turn to its heading. Returns the seconds from
+    startPose until each waypoint is reached, so the last entry is the
+    total.
+    """
+    waypoints = PoseArray.fromPoses(waypoints)
+    if len(waypoints) <= 0:
+        return np.zeros(0)
+
+    positions = np.concatenate(([startPose.pos], waypoints.pos))
+    steps = np.diff(positions)
+    bearings = np.angle(steps, deg=True)
 
-    # Approx. pure forward motion (~½" tolerance)
-    if abs(distanceL - distanceR) < (ANGLE_DISTANCE_RATIO / 2):
-        posDelta = polar2cart(distanceL, startPose.dir)
-        return Pose(startPose.pos + posDelta, startPose.dir)
-    
-    # Approx. pure rotational motion (~10° body rotation tolerance)
-    if np.sign(distanceL) != np.sign(distanceR) \
-        and abs(abs(distanceL) - abs(distanceR)) < (10 / TURN_RATIO):
-        W = 2.0 * L
-        headingChangeRad = (distanceR - distanceL) / W
-        return Pose(startPose.pos, startPose.dir + np.rad2deg(headingChangeRad))
+    # The robot faces along each move it makes, and moves too short to
+    # need a turn keep the previous heading
+    isMove = np.abs(steps) > 1e-9
+    headingSources = np.maximum.accumulate(np.where(isMove, np.arange(1, len(steps) + 1), 0))
+    headings = np.concatenate(([startPose.dir], bearings))[np.concatenate(([0], headingSources))]
+    startTurns = np.where(isMove, np.abs(normalizeHeadings(bearings - headings[:-1])), 0.0)
+    endTurn = abs(normalizeHeading(waypoints.dir[-1] - headings[-1]))
 
-    raise NotImplementedError(f"Generalized movements not supported\r\n\tStart pose: {startPose}\r\n\tDisp.: {wheelAngleL:.1f}°, {wheelAngleR:.1f}°")
+    # Each move follows a trapezoidal profile of wheel angle
+    times = trapezoidDuration(startTurns * TURN_RATIO, TURN_LIMITS) \
+        + trapezoidDuration(np.abs(steps) * ANGLE_DISTANCE_RATIO, FORWARD_LIMITS) + 2 * MOVE_OVERHEAD
+    times[-1] += trapezoidDuration(endTurn * TURN_RATIO, TURN_LIMITS) + MOVE_OVERHEAD
+    return np.cumsum(times)
 
 if __name__ == "__main__":
     print("1: Compute angular displacements for target")
     print("2: Update pose from angular displacements")
+    print("3: Replay the drive logs")
     selection = input("? ")
 
     if selection == "1":
@@ -91,3 +196,11 @@ if __name__ == "__main__":
         angleL, angleR = -2149.6, 2067.6
         newPose = computePoseFromWheelAngles(Pose(), angleL, angleR)
         print(newPose)
+    elif selection == "3":
+        import glob
+        import time
+        for filePath in sorted(glob.glob("logs/*_to_*.csv")):
+            start = time.perf_counter()
+            poses = integrateLog(filePath)
+            elapsed = time.perf_counter() - start
+            print(f"{filePath}: {len(poses)} samples in {elapsed * 1000:.1f}ms, ended at {poses[-1]}")
@@ -1,16 +1,26 @@
 from queue import Queue
-from floormap import FloorMap
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import suppress
+from functools import partial
+from threading import Event
+from floormap import DEFAULT_CORRIDOR_WIDTH, FloorMap, PlanTripResult, sampleTrack
 from mail_route_events import *
 from models import *
 from svgpathtools import Path
-from typing import Callable
-from nav_utils import Pose, discretizePath, normalizeHeading
-from odometry import computeWheelAnglesForTurn, computeWheelAnglesForForward, computeDeltaThetaDeg
-from obstacle_avoidance import nearestWithinBox
+from typing import Awaitable, Callable
+from nav_utils import Pose, PoseArray, discretizePathAdaptive, normalizeHeading
+from odometry import computeWheelAnglesForTurn, computeWheelAnglesForForward, computeWheelAnglesForArc, \
+    computeDeltaThetaDeg, OdometryIntegrator, FORWARD_LIMITS, MAX_WHEEL_SPEED, TURN_LIMITS
+from motion_profile import MotionLimits, MoveReport, TrapezoidalProfile
+from speed_control import WheelSpeedController
+from collections import deque
+from obstacle_avoidance import getObstacleState
+from control_loop import FixedRateScheduler
 import data_log as dl
 from vector import cart2polar
 import numpy as np
-from time import sleep
+import asyncio
+from time import monotonic
 
 MOCK = False
 
@@ -22,12 +32,130 @@ else:
     from motor_mock import drive, driveLeft, driveRight, startMock, stopMock
     from encoder_mock import readShaftPositions
 
+# How long an obstacle has to stay in the way before we give up on
+# the current path and find another way around
+BLOCKED_TIMEOUT = 10.0
+
+# How long a path we gave up on stays closed before we try it again
+BLOCKED_PATH_TTL = 300.0
+
+# Closer than this to the node it came from, the robot doesn't back up
+# to it after giving up on a path
+MIN_RETREAT_DISTANCE = 1.0            # in
+
+# How long to wait for a delivery to be confirmed before sending the
+# arrival again, in case the control panel never got it
+CONFIRMATION_TIMEOUT = 30.0
+
+# How often the encoders are read while driving. Each read has to be
+# far enough apart that the change in angle is greater than the error
+# in the encoder measurements.
+CONTROL_RATE = 20.0                   # Hz
+
+# Tracking the motion profile of each move
+POSITION_GAIN = 4.0                   # wheel deg/s per wheel degree behind the profile
+MIN_MOVING_SPEED = 0.2 * MAX_WHEEL_SPEED  # deg/s, slowest a wheel is asked to turn while short of its target
+SETTLE_TOLERANCE = 2.0                # wheel deg, close enough to the target to stop
+SETTLE_TIMEOUT = 1.0                  # s to wait for a move to settle before giving up on it
+
+# Wheel speeds are closed-loop, each wheel with its own controller
+leftSpeedController = WheelSpeedController()
+rightSpeedController = WheelSpeedController()
+
+# Reports for the most recent moves, oldest first
+moveReports: deque[MoveReport] = deque(maxlen=100)
+
+# Ways of following a path. "waypoints" stops at every waypoint to
+# turn, drive straight, then turn again, and "pursuit" steers
+# continuously towards a point a little further along the path.
+FOLLOW_MODES = ("waypoints", "pursuit")
+DEFAULT_FOLLOW_MODE = "waypoints"
+
+# Pure pursuit tuning
+PURSUIT_RATE = 20.0                   # Hz
+PURSUIT_LOOKAHEAD = 12.0              # in, how far ahead of the robot to steer towards
+PURSUIT_MAX_HEADING_ERROR = 45.0      # deg, turn in place first if facing further off than this
+PURSUIT_GOAL_TOLERANCE = 0.5          # in
+
+# Loop timing statistics accumulate here for as long as the process runs
+controlLoop = FixedRateScheduler(CONTROL_RATE)
+pursuitLoop = FixedRateScheduler(PURSUIT_RATE)
+
+class PathBlockedError(Exception):
+    """Raised when an obstacle doesn't clear within BLOCKED_TIMEOUT."""
+    botState: Pose | None = None
+    """Where the robot was when it stopped."""
+
+    waypointIndex: int = 0
+    """The index of the waypoint the robot was driving towards."""
+
+class RouteAbortedError(Exception):
+    """Raised when a route is stopped partway with abortRoute."""
+
+# Set to stop the route that's running. The control loops check it
+# every tick, so the robot stops within one tick of it being set.
+abortRequested = Event()
+
+def abortRoute():
+    abortRequested.set()
+
 def transitFeed(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int, str],
                 emitEvent: Callable[[MailRouteEvent], None],
-                waitForConfirmation: Callable[[], None]):
+                waitForConfirmation: Callable[[], None],
+                plannedTrip: PlanTripResult | None = None):
+    """Runs transitFeedAsync to completion from synchronous code."""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive") as executor:
+        asyncio.run(transitFeedAsync(route, floorplan, bins, emitEvent,
+                                     lambda: asyncio.to_thread(waitForConfirmation),
+                                     plannedTrip, executor, confirmationTimeout=None))
+
+async def transitFeedAsync(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int, str],
+                           emitEvent: Callable[[MailRouteEvent], None],
+                           waitForConfirmation: Callable[[], Awaitable[None]],
+                           plannedTrip: PlanTripResult | None,
+                           executor: Executor,
+                           confirmationTimeout: float | None = CONFIRMATION_TIMEOUT):
+    """
+    Drives the route, emitting events for the control panel as it goes.
+    Planning and driving block, so they run on the executor while the
+    event loop stays free. A delivery that isn't confirmed within
+    confirmationTimeout is announced again.
+
+    Once abortRoute is called, the move in progress stops within a
+    control tick and RouteAbortedError is raised. To also interrupt a
+    wait for confirmation, cancel the task running this after calling
+    abortRoute. If it's cancelled mid-move, the move is aborted and the
+    motors stopped before the cancellation goes through.
+    """
+    abortRequested.clear()
+    try:
+        await _transitFeed(route, floorplan, bins, emitEvent, waitForConfirmation,
+                           plannedTrip, executor, confirmationTimeout)
+    except asyncio.CancelledError:
+        if abortRequested.is_set():
+            raise RouteAbortedError() from None
+        raise
+
+async def _transitFeed(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int, str],
+                       emitEvent: Callable[[MailRouteEvent], None],
+                       waitForConfirmation: Callable[[], Awaitable[None]],
+                       plannedTrip: PlanTripResult | None,
+                       executor: Executor,
+                       confirmationTimeout: float | None):
+    async def run(function, *args):
+        return await _runUntilAborted(executor, function, *args)
+
     print("Preparing route...")
     stopIds = [*route.stops.values()]
-    _, tripNodes = floorplan.planTrip(stopIds)
+    remainingStopIds = list(dict.fromkeys(stopIds))
+
+    # Use the trip planned when the route was submitted, unless a path
+    # on it has been blocked since
+    if plannedTrip is None or any(floorplan.isEdgeBlocked(a, b)
+                                  for a, b in zip(plannedTrip.nodeIds[:-1], plannedTrip.nodeIds[1:])):
+        plannedTrip = await run(floorplan.planTrip, stopIds)
+    tripNodes = plannedTrip.nodeIds
+    arrivalTimes = await run(floorplan.estimateArrivalTimes, tripNodes)
     print(f"Planned route: {tripNodes}")
     
     # The full route is already broken into atoms, which represent
@@ -35,20 +163,24 @@ def transitFeed(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int,
     # connected to it. We'll navigate between these atoms to
     # simplify the navigation logic. 
 
-    # Build a queue to keep track of which stops
-    # we've already completed.
-    stopQueue = Queue(len(stopIds))
-    for stopId in stopIds:
-        stopQueue.put(stopId)
+    # Build a queue to keep track of which stops we've
+    # already completed, in the order the trip visits them.
+    stopQueue = _buildStopQueue(tripNodes, remainingStopIds)
 
     statusesSent: int = 0
-    botState = Pose()
-    nextStopId: str | None = stopQueue.get()
+
+    # Dead reckon in map coordinates from home, where the trip and its
+    # arrival times start
+    botState = Pose(floorplan.nodes[tripNodes[0]])
+    nextStopId: str | None = None if stopQueue.empty() else stopQueue.get()
     
-    for nextNodeIndex in range(1, len(tripNodes)):
+    nextNodeIndex = 1
+    while nextNodeIndex < len(tripNodes):
         currentNodeId = tripNodes[nextNodeIndex - 1]
-        nextNodeId = tripNodes[nextNodeIndex]
-        print(f"Navi: {currentNodeId} -> {nextNodeId}")
+
+        progress = floorplan.measureProgress(tripNodes, nextNodeIndex - 1, 0.0, arrivalTimes)
+        print(f"Progress: {progress.travelled:.0f}\" driven, {progress.remaining:.0f}\" "
+              f"and about {progress.timeRemaining:.0f}s to go")
 
         if currentNodeId == nextStopId:
             roomName = floorplan.rooms[nextStopId]
@@ -68,8 +200,15 @@ def transitFeed(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int,
                     emitEvent(arrivedAtStopEvent)
                     statusesSent += 1
 
-                    waitForConfirmation()
+                    while True:
+                        try:
+                            await asyncio.wait_for(waitForConfirmation(), confirmationTimeout)
+                            break
+                        except asyncio.TimeoutError:
+                            print(f"No confirmation for bin {binNum}, sending arrival again")
+                            emitEvent(arrivedAtStopEvent)
 
+            remainingStopIds.remove(nextStopId)
             if stopQueue.empty():
                 nextStopId = None
                 print("Stop queue was empty, going home!")
@@ -91,21 +230,104 @@ def transitFeed(route: RequestedMailRoute, floorplan: FloorMap, bins: dict[int,
         emitEvent(transitEvent)
         statusesSent += 1
 
-        pathToFollow: Path = floorplan.getShortestAdjacentPath(currentNodeId, nextNodeId)
-        botState = follow_path(botState, pathToFollow, None)
+        # Drive straight through every node up to the next stop, unless
+        # a corner is too sharp to take without stopping
+        legEndIndex = floorplan.findLegEnd(tripNodes, nextNodeIndex - 1, nextStopId)
+        legNodes = tripNodes[nextNodeIndex - 1:legEndIndex + 1]
+        print(f"Navi: {' -> '.join(legNodes)}")
+        leg = await run(floorplan.getLeg, legNodes)
+
+        try:
+            if route.followMode == "pursuit":
+                botState = await run(pursue_track, botState, leg.track, None)
+            else:
+                botState = await run(follow_waypoints, botState, leg.waypoints, None)
+        except PathBlockedError as e:
+            blockedIndex = floorplan.locateOnLeg(leg, e.botState.pos)
+            blockedStartId, blockedEndId = legNodes[blockedIndex], legNodes[blockedIndex + 1]
+            print(f"Path {blockedStartId} -> {blockedEndId} is blocked, finding another way")
+            await run(floorplan.blockEdge, blockedStartId, blockedEndId, BLOCKED_PATH_TTL)
+
+            # Back up along the blocked path to the node it starts
+            # from, then plan the rest from there. The way back was
+            # just driven and the obstacle is still in front of the
+            # robot, so it isn't watched for on the way.
+            retreat = floorplan.getEdgeRemainder(blockedEndId, blockedStartId, e.botState.pos)
+            if retreat.length() < MIN_RETREAT_DISTANCE:
+                botState = e.botState
+            elif route.followMode == "pursuit":
+                botState = await run(partial(pursue_track, avoidObstacles=False),
+                                     e.botState, sampleTrack(retreat), None)
+            else:
+                botState = await run(partial(follow_path, avoidObstacles=False), e.botState, retreat, None)
+
+            tripNodes = (await run(floorplan.replanTrip, blockedStartId, remainingStopIds)).nodeIds
+            arrivalTimes = await run(floorplan.estimateArrivalTimes, tripNodes)
+            print(f"Replanned route: {tripNodes}")
+            stopQueue = _buildStopQueue(tripNodes, remainingStopIds)
+            nextStopId = None if stopQueue.empty() else stopQueue.get()
+            nextNodeIndex = 1
+            continue
+
+        nextNodeIndex = legEndIndex + 1
     
     print("Completed route!")
+    print(f"Control loop: {controlLoop.stats().summary()}")
+    if route.followMode == "pursuit":
+        print(f"Pursuit loop: {pursuitLoop.stats().summary()}")
     doneEvent = DoneEvent()
     doneEvent.orderNumber = statusesSent
     emitEvent(doneEvent)
 
-def follow_path(botState: Pose, path: Path, logSession: dl.DataLogSession) -> Pose:
+async def _runUntilAborted(executor: Executor, function, *args):
+    """
+    Runs a blocking function on the executor. If the awaiting task is
+    cancelled, the function is aborted and waited for, so nothing is
+    left driving the motors once the cancellation goes through.
+    """
+    future = asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        abortRequested.set()
+        with suppress(Exception):
+            await future
+        raise
+
+def _stopIfAborted():
+    if abortRequested.is_set():
+        drive(0)
+        raise RouteAbortedError()
+
+def _buildStopQueue(tripNodes: list[str], stopIds: list[str]) -> Queue:
+    stopQueue = Queue(len(stopIds))
+    for nodeId in dict.fromkeys(tripNodes):
+        if nodeId in stopIds:
+            stopQueue.put(nodeId)
+    return stopQueue
+
+def follow_path(botState: Pose, path: Path, logSession: dl.DataLogSession,
+                useMeasuredPose: bool = True, avoidObstacles: bool = True) -> Pose:
+    waypoints, _ = discretizePathAdaptive(path, DEFAULT_CORRIDOR_WIDTH / 2)
+    return follow_waypoints(botState, waypoints[1:], logSession, useMeasuredPose, avoidObstacles)
+
+def follow_waypoints(botState: Pose, waypoints: PoseArray, logSession: dl.DataLogSession,
+                     useMeasuredPose: bool = True, avoidObstacles: bool = True) -> Pose:
+    """
+    Drives to each waypoint in turn: turn to face it and drive straight
+    to it, then once at the last one, turn to its heading. With
+    useMeasuredPose, each move starts from the pose dead reckoned from
+    the encoders so errors are corrected as they happen. Otherwise the
+    robot is assumed to have reached each waypoint exactly. Without
+    avoidObstacles, the robot doesn't stop for obstacles.
+    """
     # Configure data logging
     if logSession:
         logSession.writeHeaders(["angleL", "angleR", "angDispL", "angDispR", "dThetaL", "dThetaR"])
 
-    segments = discretizePath(path)
-    for targetState in segments:
+    odometry = OdometryIntegrator(botState) if useMeasuredPose else None
+
+    for waypointIndex, targetState in enumerate(waypoints):
         # Compute correction for position in polar coordinates
         positionCorrection = targetState.pos - botState.pos
         positionForwardCorrection, positionHeadingTarget = cart2polar(positionCorrection)
@@ -114,36 +336,181 @@ def follow_path(botState: Pose, path: Path, logSession: dl.DataLogSession) -> Po
         # If the magnitude of the angle is greater than 180°,
         # just turn the opposite direction
         positionHeadingCorrection = normalizeHeading(positionHeadingCorrection)
+        isLastWaypoint = waypointIndex == len(waypoints) - 1
+
+        try:
+            # Correct heading angle for position
+            print(f"Correct forward heading: {positionHeadingCorrection:.1f}°")
+            targetAngDispL, targetAngDispR = computeWheelAnglesForTurn(positionHeadingCorrection)
+            driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession, odometry,
+                                       avoidObstacles=avoidObstacles)
+
+            # Correct forward distance
+            print(f"Correct forward distance: {positionForwardCorrection:.2f}\"")
+            targetAngDispL, targetAngDispR = computeWheelAnglesForForward(positionForwardCorrection)
+            driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession, odometry,
+                                       avoidObstacles=avoidObstacles)
+
+            # Correct heading angle for final heading. Anywhere but the
+            # last waypoint, the next turn faces the robot onwards anyway.
+            if isLastWaypoint:
+                currentHeading = odometry.pose.dir if odometry is not None else positionHeadingTarget
+                finalHeadingCorrection = normalizeHeading(targetState.dir - currentHeading)
+                print(f"Correct final heading: {finalHeadingCorrection:.1f}°")
+                targetAngDispL, targetAngDispR = computeWheelAnglesForTurn(finalHeadingCorrection)
+                driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession, odometry,
+                                       avoidObstacles=avoidObstacles)
+        except PathBlockedError as e:
+            e.botState = odometry.pose if odometry is not None else botState
+            e.waypointIndex = waypointIndex
+            raise
+
+        if odometry is not None:
+            botState = odometry.pose
+        else:
+            botState = Pose(targetState.pos, targetState.dir if isLastWaypoint else positionHeadingTarget)
+
+    print(f"Bot state: {botState}")
+    return botState
 
-        # Correct heading angle for position
+def pursue_track(botState: Pose, track: PoseArray, logSession: dl.DataLogSession,
+                 avoidObstacles: bool = True) -> Pose:
+    """
+    Follows a densely sampled path without stopping, using pure pursuit:
+    every control tick, steer along the arc that passes through the
+    point PURSUIT_LOOKAHEAD inches further along the path. The pose is
+    dead reckoned from the encoders, and the measured pose at the end
+    of the path is returned. Without avoidObstacles, the robot doesn't
+    stop for obstacles.
+    """
+    if logSession:
+        logSession.writeHeaders(["angleL", "angleR", "angDispL", "angDispR", "dThetaL", "dThetaR"])
+    if len(track) <= 0:
+        return botState
+
+    # Distance along the track to each pose, and a point beyond the end
+    # to aim at once the lookahead runs past it
+    trackDistances = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(track.pos)))))
+    endPose = track[-1]
+    endDirection = complex(np.cos(np.deg2rad(endPose.dir)), np.sin(np.deg2rad(endPose.dir)))
+    searchWindow = max(int(np.searchsorted(trackDistances, 2 * PURSUIT_LOOKAHEAD)), 2)
+
+    # The robot may be starting partway along, like when it backs out
+    # of a blocked path
+    closestIndex = int(np.argmin(np.abs(track.pos - botState.pos)))
+
+    def lookaheadPoint() -> complex:
+        target = trackDistances[closestIndex] + PURSUIT_LOOKAHEAD
+        if target >= trackDistances[-1]:
+            return endPose.pos + endDirection * (target - trackDistances[-1])
+        targetIndex = int(np.searchsorted(trackDistances, target))
+        return complex(track.pos[targetIndex])
+
+    odometry = OdometryIntegrator(botState)
+
+    # Pure pursuit can't recover from facing away from the path, so
+    # turn to face it first
+    positionHeadingCorrection = normalizeHeading(cart2polar(lookaheadPoint() - botState.pos)[1] - botState.dir)
+    if abs(positionHeadingCorrection) > PURSUIT_MAX_HEADING_ERROR:
         print(f"Correct forward heading: {positionHeadingCorrection:.1f}°")
-        targetAngDispL, targetAngDispR = computeWheelAnglesForTurn(positionHeadingCorrection)
-        actualAngDispL, actualAngDispR = driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession)
-        #botState = computePoseFromWheelAngles(botState, actualAngDispL, actualAngDispR)
-
-        # Correct forward distance
-        print(f"Correct forward distance: {positionForwardCorrection:.2f}\"")
-        targetAngDispL, targetAngDispR = computeWheelAnglesForForward(positionForwardCorrection)
-        actualAngDispL, actualAngDispR = driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession)
-        #botState = computePoseFromWheelAngles(botState, actualAngDispL, actualAngDispR)
-
-        # Correct heading angle for final heading
-        print(f"Correct final heading: {positionHeadingCorrection:.1f}°")
-        targetAngDispL, targetAngDispR = computeWheelAnglesForForward(targetState.dir - positionHeadingTarget)
-        actualAngDispL, actualAngDispR = driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession)
-        #botState = computePoseFromWheelAngles(botState, actualAngDispL, actualAngDispR)
-        
-        # TODO: Update pose with real data
-        botState = targetState
+        try:
+            targetAngDispL, targetAngDispR = computeWheelAnglesForTurn(positionHeadingCorrection)
+            driveToAngularDisplacement(targetAngDispL, targetAngDispR, logSession, odometry,
+                                       avoidObstacles=avoidObstacles)
+        except PathBlockedError as e:
+            e.botState = odometry.pose
+            raise
+        botState = odometry.pose
+
+    angDispL, angDispR = 0.0, 0.0
+    lastAngleL, lastAngleR = readShaftPositions()
+    lastReadTime = monotonic()
+    dataEntries = []
+    _resetSpeedControllers()
 
+    def tick() -> bool:
+        nonlocal botState, closestIndex, angDispL, angDispR, lastAngleL, lastAngleR, lastReadTime
+        _stopIfAborted()
+        angleL, angleR = readShaftPositions()
+        readTime = monotonic()
+        dThetaL = computeDeltaThetaDeg(lastAngleL, angleL)
+        dThetaR = computeDeltaThetaDeg(lastAngleR, angleR)
+        angDispL += dThetaL
+        angDispR += dThetaR
+        wheelSpeedL, wheelSpeedR = _wheelSpeeds(dThetaL, dThetaR, readTime - lastReadTime)
+        lastAngleL, lastAngleR, lastReadTime = angleL, angleR, readTime
+        botState = odometry.update(dThetaL, dThetaR)
+        dataEntries.append([angleL, angleR, angDispL, angDispR, dThetaL, dThetaR])
+
+        # Done once the robot is at or past the end of the path
+        windowEnd = min(closestIndex + searchWindow, len(track))
+        closestIndex += int(np.argmin(np.abs(track.pos[closestIndex:windowEnd] - botState.pos)))
+        alongEnd = ((botState.pos - endPose.pos) * np.conj(endDirection)).real
+        if closestIndex == len(track) - 1 and alongEnd >= -PURSUIT_GOAL_TOLERANCE:
+            return False
+
+        # The arc through the lookahead point, in the robot's frame,
+        # has a curvature of 2 sin(α) / distance
+        distance, bearing = cart2polar(lookaheadPoint() - botState.pos)
+        alpha = np.deg2rad(normalizeHeading(bearing - botState.dir))
+        curvature = 2 * np.sin(alpha) / max(distance, 1e-6)
+
+        # Wheel speeds in proportion to their displacements along
+        # the arc, with the faster wheel at the forward cruising speed
+        wheelL, wheelR = computeWheelAnglesForArc(1.0, curvature)
+        scale = FORWARD_LIMITS.maxSpeed / max(abs(wheelL), abs(wheelR))
+        _driveWheelSpeeds(wheelL * scale, wheelR * scale, wheelSpeedL, wheelSpeedR)
+
+        if avoidObstacles and waitWhileBlocked():
+            pursuitLoop.resync()
+            _resetSpeedControllers()
+        return True
+
+    try:
+        pursuitLoop.run(tick)
+    except PathBlockedError as e:
+        e.botState = botState
+        raise
+    except KeyboardInterrupt:
+        drive(0)
+        print("Navi: Stopping")
+        raise
+    finally:
+        if logSession is not None:
+            for entry in dataEntries:
+                logSession.writeEntry(entry)
+
+    drive(0)
     print(f"Bot state: {botState}")
     return botState
 
+def waitWhileBlocked() -> bool:
+    """
+    Stops while obstacles are detected, and raises PathBlockedError if
+    they don't clear within BLOCKED_TIMEOUT. Returns whether it stopped.
+    """
+    blockedSince = None
+    while (obstacles := getObstacleState()).blocked:
+        _stopIfAborted()
+        drive(0)
+        print(f"Obstacle detected {obstacles.nearestDistance:.1f}\" away at {obstacles.nearestAngle:.0f}°")
+        if blockedSince is None:
+            blockedSince = monotonic()
+        elif monotonic() - blockedSince >= BLOCKED_TIMEOUT:
+            raise PathBlockedError()
+        abortRequested.wait(0.5)
+    return blockedSince is not None
+
 def trackDisplacementWhile(action: Callable[..., bool]) -> tuple[float, float]:
     angDispL, angDispR = 0, 0
     lastAngleL, lastAngleR = readShaftPositions()
 
-    while action():
+    def tick() -> bool:
+        nonlocal angDispL, angDispR, lastAngleL, lastAngleR
+        _stopIfAborted()
+        if not action():
+            return False
+
         angleL, angleR = readShaftPositions()
         
         # Handle when angle overflows (crossing 0 deg)
@@ -156,91 +523,154 @@ def trackDisplacementWhile(action: Callable[..., bool]) -> tuple[float, float]:
         print(f"Displacement: {angDispL:.2f} {angDispR:.2f}")
 
         lastAngleL, lastAngleR = angleL, angleR
+        return True
 
-        # Ensure the delta theta is greater than the error
-        # in the encoder measurements
-        sleep(0.05)
+    controlLoop.run(tick)
     return angDispL, angDispR
 
 def driveToAngularDisplacement(targetAngDispL: float, targetAngDispR: float,
-                               logSession: dl.DataLogSession):
-    angDispSignL, angDispSignR = np.sign(targetAngDispL), np.sign(targetAngDispR)
-
-    dutyCycle = 0.8
-    if angDispSignL != angDispSignR:
-        dutyCycle = 1.0
-
-    motorSpeedL, motorSpeedR = dutyCycle * angDispSignL, dutyCycle * angDispSignR
-    
-    doneL, doneR = False, False
-    angDispL, angDispR = 0, 0
-    
+                               logSession: dl.DataLogSession,
+                               odometry: OdometryIntegrator | None = None,
+                               limits: MotionLimits | None = None,
+                               avoidObstacles: bool = True):
+    """
+    Drives each wheel through its target displacement by tracking a
+    trapezoidal motion profile, then holds until both are within
+    SETTLE_TOLERANCE. The wheel with further to go follows the profile
+    and the other is scaled to match, so both finish together. Limits
+    default to FORWARD_LIMITS or TURN_LIMITS depending on the move.
+    Without avoidObstacles, the move doesn't stop for obstacles.
+    """
+    if limits is None:
+        limits = TURN_LIMITS if np.sign(targetAngDispL) != np.sign(targetAngDispR) else FORWARD_LIMITS
+
+    target = max(abs(targetAngDispL), abs(targetAngDispR))
+    if target <= SETTLE_TOLERANCE:
+        return 0.0, 0.0
+    scaleL, scaleR = targetAngDispL / target, targetAngDispR / target
+
+    angDispL, angDispR = 0.0, 0.0
     lastAngleL, lastAngleR = readShaftPositions()
-    lastTargetDeltaL, lastTargetDeltaR = np.nan, np.nan
-
+    lastReadTime = monotonic()
+    overshoot = 0.0
     dataEntries = []
+    _resetSpeedControllers()
 
-    try:
-        #print("Entering step loop...")
-        while not (doneL and doneR):
-            # Compute the remaining angular displacement
-            targetDeltaL, targetDeltaR = targetAngDispL - angDispL, targetAngDispR - angDispR
-            #print(f"Disp remaining: {targetDeltaL:.1f} {targetDeltaR:.1f}\t\t{motorSpeedL:.1f} {motorSpeedR:.1f}")
-
-            reachedTargetL = isTargetReached(lastTargetDeltaL, targetDeltaL, 0.01)
-            if reachedTargetL:
-                doneL = True
-                motorSpeedL = 0.0
-
-            reachedTargetR = isTargetReached(lastTargetDeltaR, targetDeltaR, 0.01)
-            if reachedTargetR:
-                doneR = True
-                motorSpeedR = 0.0
-            
-            # This in intentionally swapped.
-            driveRight(motorSpeedL)
-            driveLeft(motorSpeedR)
-
-            if doneL and doneR:
-                break
-
-            angleL, angleR = readShaftPositions()
-            
-            # Handle when angle overflows (crossing 0 deg)
-            dThetaL = computeDeltaThetaDeg(lastAngleL, angleL)
-            angDispL += dThetaL
-
-            dThetaR = computeDeltaThetaDeg(lastAngleR, angleR)
-            angDispR += dThetaR
-            #print(f"Delta Theta: {dThetaL:.1f} {dThetaR:.1f}")
-
-            lastAngleL, lastAngleR = angleL, angleR
-            lastTargetDeltaL, lastTargetDeltaR = targetDeltaL, targetDeltaR
+    # The profile is replanned from wherever the wheels are if an
+    # obstacle stops them partway
+    profile = TrapezoidalProfile(target, limits)
+    originL, originR = 0.0, 0.0
+    moveStart = profileStart = monotonic()
 
-            # Ensure the delta theta is greater than the error
-            # in the encoder measurements
-            sleep(0.05)
+    def tick() -> bool:
+        nonlocal angDispL, angDispR, lastAngleL, lastAngleR, lastReadTime, overshoot, \
+            profile, originL, originR, profileStart
+        _stopIfAborted()
 
-            dataEntries.append([angleL, angleR, angDispL, angDispR, dThetaL, dThetaR])
+        angleL, angleR = readShaftPositions()
+        readTime = monotonic()
+        
+        # Handle when angle overflows (crossing 0 deg)
+        dThetaL = computeDeltaThetaDeg(lastAngleL, angleL)
+        angDispL += dThetaL
 
-            # Stop if obstacles are detected
-            while len(list(nearestWithinBox())) > 3:
-               drive(0)
-               print("Obstacle detected")
-               sleep(0.5)
-               pass
+        dThetaR = computeDeltaThetaDeg(lastAngleR, angleR)
+        angDispR += dThetaR
+        #print(f"Delta Theta: {dThetaL:.1f} {dThetaR:.1f}")
+        if odometry is not None:
+            odometry.update(dThetaL, dThetaR)
+
+        wheelSpeedL, wheelSpeedR = _wheelSpeeds(dThetaL, dThetaR, readTime - lastReadTime)
+        lastAngleL, lastAngleR, lastReadTime = angleL, angleR, readTime
+        dataEntries.append([angleL, angleR, angDispL, angDispR, dThetaL, dThetaR])
+
+        errorL, errorR = targetAngDispL - angDispL, targetAngDispR - angDispR
+        overshoot = max(overshoot, -errorL * np.sign(targetAngDispL), -errorR * np.sign(targetAngDispR))
+
+        elapsed = monotonic() - profileStart
+        if elapsed >= profile.duration:
+            settled = abs(errorL) <= SETTLE_TOLERANCE and abs(errorR) <= SETTLE_TOLERANCE
+            if settled or elapsed - profile.duration >= SETTLE_TIMEOUT:
+                drive(0)
+                return False
+
+        # Follow the profile's speed, corrected for how far behind or
+        # ahead of it each wheel is
+        position, velocity = profile.sample(elapsed)
+        _driveWheelSpeeds(_trackingSpeed(scaleL * velocity, originL + scaleL * position - angDispL, errorL),
+                          _trackingSpeed(scaleR * velocity, originR + scaleR * position - angDispR, errorR),
+                          wheelSpeedL, wheelSpeedR)
+
+        # Stop if obstacles are detected, and give up on this
+        # path if they don't clear
+        if avoidObstacles and waitWhileBlocked():
+            controlLoop.resync()
+            _resetSpeedControllers()
+            remaining = target - (scaleL * angDispL + scaleR * angDispR) / (scaleL ** 2 + scaleR ** 2)
+            profile = TrapezoidalProfile(remaining, limits)
+            originL, originR = angDispL, angDispR
+            profileStart = monotonic()
+        return True
 
+    try:
+        controlLoop.run(tick)
     except KeyboardInterrupt:
         drive(0)
         print("Navi: Stopping")
         raise
-    if logSession is not None:
-        for entry in dataEntries:
-            logSession.writeEntry(entry)
-    
+    finally:
+        if logSession is not None:
+            for entry in dataEntries:
+                logSession.writeEntry(entry)
+
+    moveEnd = monotonic()
+    settleTime = max(moveEnd - profileStart - profile.duration, 0.0)
+    report = MoveReport(target, moveEnd - moveStart, moveEnd - moveStart - settleTime, settleTime, overshoot,
+                        max(abs(targetAngDispL - angDispL), abs(targetAngDispR - angDispR)))
+    moveReports.append(report)
+    print(f"Move: {report.summary()}")
+
     # Return the actual angular displacement for future calculations
     return angDispL, angDispR
 
+def _trackingSpeed(velocity: float, lag: float, remaining: float) -> float:
+    """Wheel speed in deg/s for a wheel to follow its profile."""
+    speed = velocity + POSITION_GAIN * lag
+
+    # Anything still short of its target moves at least a little, and
+    # anything on target once the profile is done stays put
+    if abs(remaining) > SETTLE_TOLERANCE and abs(speed) < MIN_MOVING_SPEED:
+        speed = MIN_MOVING_SPEED * np.sign(speed if speed != 0 else remaining)
+    elif abs(remaining) <= SETTLE_TOLERANCE and velocity == 0:
+        speed = 0.0
+    return float(speed)
+
+def _wheelSpeeds(dThetaL: float, dThetaR: float, dt: float) -> tuple[float, float]:
+    """Wheel speeds in deg/s from the displacements since the last read."""
+    if dt <= 0:
+        return 0.0, 0.0
+    return dThetaL / dt, dThetaR / dt
+
+def _driveWheelSpeeds(targetSpeedL: float, targetSpeedR: float, measuredSpeedL: float, measuredSpeedR: float):
+    """Drives both wheels at the given speeds in deg/s, closing the loop on the measured ones."""
+    if targetSpeedL == 0 and targetSpeedR == 0:
+        _resetSpeedControllers()
+        drive(0)
+        return
+
+    dutyCycleL = leftSpeedController.update(np.deg2rad(targetSpeedL), np.deg2rad(measuredSpeedL)) \
+        if targetSpeedL != 0 else 0.0
+    dutyCycleR = rightSpeedController.update(np.deg2rad(targetSpeedR), np.deg2rad(measuredSpeedR)) \
+        if targetSpeedR != 0 else 0.0
+
+    # This in intentionally swapped.
+    driveRight(dutyCycleL)
+    driveLeft(dutyCycleR)
+
+def _resetSpeedControllers():
+    leftSpeedController.reset()
+    rightSpeedController.reset()
+
 def isTargetReached(previous: float, current: float, tolerance: float) -> bool:
     # If we're already within the specified tolerance, we're golden
     if np.abs(current) <= tolerance:
@@ -1,11 +1,14 @@
 from models import *
 from mail_route_events import *
-from floormap import FloorMap
+from floormap import FloorMap, PlanTripResult
+from cached_response import CachedResponse
+from lru_cache import LruCache
 from sanic import Config, Sanic, text, json, Request
 from orjson import dumps, loads
 from queue import SimpleQueue
-from path_following import transitFeed
-import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from path_following import DEFAULT_FOLLOW_MODE, FOLLOW_MODES, RouteAbortedError, abortRoute, transitFeedAsync
+import asyncio
 import socket
 import os
 
@@ -24,12 +27,16 @@ class NavigatorContext:
     floorplan: FloorMap
     bins: dict[int, str]
     requestedRoute: RequestedMailRoute
+    plannedTrip: Future[PlanTripResult] | None = None
+    planner: ThreadPoolExecutor
     events: SimpleQueue = SimpleQueue()
-    transitFeedSock: socket.socket
-    abortTransitFeed: bool
+    driver: ThreadPoolExecutor
+    transitFeedTransport: asyncio.DatagramTransport | None = None
+    confirmations: asyncio.Queue | None = None
+    routeTask: asyncio.Task | None = None
+    responseCache: LruCache = LruCache(16)
 
 ctx = NavigatorContext()
-ctx.abortTransitFeed = False
 ctx.floorplan = FloorMap(os.path.join("maps", "PIC_Sample_Map.floormap"))
 ctx.bins = {
     1: "Letter Slot 1",
@@ -48,9 +55,14 @@ app: NavigatorApp = Sanic("talaria_navigator",
 async def health(request: Request):
     return text("OK")
 
-@app.get("/possibleRoute")
-async def getPossibleRouteInfo(request: Request):
-    ctx: NavigatorContext = request.app.ctx
+def getCachedResponse(name: str, render) -> CachedResponse:
+    """
+    Renders a response the first time it's asked for with the current
+    floormap, and serves the same bytes until a different map is loaded.
+    """
+    return ctx.responseCache.getOrCompute((name, ctx.floorplan.sourceHash), render)
+
+def renderPossibleRouteInfo() -> CachedResponse:
     floorplan = ctx.floorplan
     routeInfo = PossibleMailRouteInfo()
     routeInfo.id = floorplan.id
@@ -63,56 +75,180 @@ async def getPossibleRouteInfo(request: Request):
 
     routeInfo.bins = [
         MailBin(number, name)
-        for number, name in app.ctx.bins.items()
+        for number, name in ctx.bins.items()
     ]
 
-    return json(routeInfo)
+    return CachedResponse(custom_dumps(routeInfo), "application/json")
+
+def renderMapSvg() -> CachedResponse:
+    return CachedResponse(ctx.floorplan.toSvg().encode("utf-8"), "image/svg+xml")
+
+@app.get("/possibleRoute")
+async def getPossibleRouteInfo(request: Request):
+    return getCachedResponse("possibleRoute", renderPossibleRouteInfo).respond(request)
+
+@app.get("/map.svg")
+async def getMapSvg(request: Request):
+    return getCachedResponse("map.svg", renderMapSvg).respond(request)
 
 @app.post("/route")
 async def setRoute(request: Request):
-    requestedRoute = RequestedMailRoute(request.json)
-    print(f"Received route: {requestedRoute.stops}")
+    followMode = request.args.get("follow", DEFAULT_FOLLOW_MODE)
+    if followMode not in FOLLOW_MODES:
+        return text(f"Unknown follow mode '{followMode}', expected one of {', '.join(FOLLOW_MODES)}", status=400)
+
+    requestedRoute = RequestedMailRoute(request.json, followMode)
+    print(f"Received route: {requestedRoute.stops}, following {followMode}")
     
     ctx.requestedRoute = requestedRoute
+
+    # Start planning now so the trip is ready by the time the control
+    # panel says go
+    ctx.plannedTrip = ctx.planner.submit(ctx.floorplan.planTrip, [*requestedRoute.stops.values()])
     return json(request.json)
 
-def transitFeedEntry(app: NavigatorApp):
+@app.post("/plan")
+async def previewPlan(request: Request):
+    requestedRoute = RequestedMailRoute(request.json)
+
+    def plan() -> TripPlan:
+        trip = ctx.floorplan.planTrip([*requestedRoute.stops.values()])
+        arrivalTimes = ctx.floorplan.estimateArrivalTimes(trip.nodeIds)
+
+        stops, stopEtas = [], []
+        remainingStopIds = set(requestedRoute.stops.values())
+        for nodeId, arrivalTime in zip(trip.nodeIds, arrivalTimes.tolist()):
+            if nodeId in remainingStopIds:
+                remainingStopIds.remove(nodeId)
+                stops.append(nodeId)
+                stopEtas.append(arrivalTime)
+        return TripPlan(stops, trip.nodeIds, trip.length, float(arrivalTimes[-1]), stopEtas)
+
+    try:
+        tripPlan = await asyncio.get_running_loop().run_in_executor(ctx.planner, plan)
+    except (KeyError, ValueError) as e:
+        return text(str(e), status=400)
+    return json(tripPlan)
+
+# Blocking, unblocking and expiring paths all recompute shortest
+# paths, so they run on the planner rather than the event loop
+
+@app.get("/blockedPaths")
+async def getBlockedPaths(request: Request):
+    blockedEdges = await asyncio.get_running_loop().run_in_executor(ctx.planner, ctx.floorplan.getBlockedEdges)
+    return json([
+        BlockedPath(start, end, ttl)
+        for (start, end), ttl in blockedEdges.items()
+    ])
+
+@app.post("/blockedPaths")
+async def blockPath(request: Request):
+    try:
+        blockedPath = BlockedPath(request.json["start"], request.json["end"], request.json.get("ttl"))
+        await asyncio.get_running_loop().run_in_executor(
+            ctx.planner, ctx.floorplan.blockEdge, blockedPath.start, blockedPath.end, blockedPath.ttl)
+    except (KeyError, TypeError, ValueError) as e:
+        return text(str(e), status=400)
+    return json(blockedPath)
+
+@app.delete("/blockedPaths/<start:str>/<end:str>")
+async def unblockPath(request: Request, start: str, end: str):
+    try:
+        await asyncio.get_running_loop().run_in_executor(ctx.planner, ctx.floorplan.unblockEdge, start, end)
+    except (KeyError, ValueError) as e:
+        return text(str(e), status=400)
+    return text("OK")
+
+@app.post("/abort")
+async def abort(request: Request):
+    routeTask = ctx.routeTask
+    if routeTask is None or routeTask.done():
+        return text("No route is running", status=409)
+
+    abortRoute()
+    routeTask.cancel()
+
+    # The robot stops within a control tick, so answer once it has
+    await asyncio.wait({routeTask})
+    return text("OK")
+
+class TransitFeedProtocol(asyncio.DatagramProtocol):
+    """
+    Listens for the control panel on the event loop. "%ready" starts
+    the requested route, and "%acceptDelivery" confirms the delivery
+    the route is waiting on.
+    """
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        if data.startswith(b'%ready'):
+            if ctx.routeTask is not None and not ctx.routeTask.done():
+                print(f"Ignoring ready from {addr}, a route is already running")
+                return
+
+            print(f"Connected to Control Panel at {addr}")
+            ctx.routeTask = asyncio.get_running_loop().create_task(runTransitFeed(addr))
+        elif data.startswith(b'%acceptDelivery'):
+            ctx.confirmations.put_nowait(data)
+
+async def runTransitFeed(addr: tuple[str, int]):
+    plannedTrip = None
+    if ctx.plannedTrip is not None:
+        try:
+            plannedTrip = await asyncio.wrap_future(ctx.plannedTrip)
+        except Exception as e:
+            print(f"Planning failed, trying again: {e}")
+
+    # Confirmations sent while nothing was waiting for them don't count
+    while not ctx.confirmations.empty():
+        ctx.confirmations.get_nowait()
+
+    try:
+        await transitFeedAsync(ctx.requestedRoute, ctx.floorplan, ctx.bins,
+                               lambda e: sendEventToSocket(e, ctx.transitFeedTransport, addr),
+                               waitForConfirmation, plannedTrip, ctx.driver)
+    except RouteAbortedError:
+        print("Route aborted")
+    except Exception as e:
+        print(f"Route failed: {e!r}")
+
+def sendEventToSocket(event: MailRouteEvent, transport: asyncio.DatagramTransport, addr: tuple[str, int]):
+    eventStr = dumps(event, default=vars)
+    print(f"Sending event '{eventStr}'")
+    transport.sendto(eventStr, addr)
+
+async def waitForConfirmation():
+    await ctx.confirmations.get()
+
+async def startTransitFeed(loop: asyncio.AbstractEventLoop):
     print("Binding to UDP socket...")
-    
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    # Disable the timeout so we wait indefinitely for a connection
-    sock.settimeout(None)
     sock.bind(("", TRANSITFEED_UDP_PORT))
-    print(f"Bound to port {TRANSITFEED_UDP_PORT}")
 
-    while not ctx.abortTransitFeed:
-        msg, addr = sock.recvfrom(512)
-        if not msg.startswith(b'%ready'):
-            continue
+    ctx.confirmations = asyncio.Queue()
+    ctx.transitFeedTransport, _ = await loop.create_datagram_endpoint(TransitFeedProtocol, sock=sock)
+    print(f"Bound to port {TRANSITFEED_UDP_PORT}")
 
-        print(f"Connected to Control Panel at {addr}")
+@app.before_server_stop
+async def stopWorker(app: NavigatorApp, loop):
+    if ctx.routeTask is not None and not ctx.routeTask.done():
+        abortRoute()
+        ctx.routeTask.cancel()
+        await asyncio.wait({ctx.routeTask})
 
-        transitFeed(ctx.requestedRoute, ctx.floorplan, ctx.bins,
-                    lambda e: sendEventToSocket(e, sock, addr),
-                    lambda: waitForConfirmationFromSocket(sock))
+    if ctx.transitFeedTransport is not None:
+        ctx.transitFeedTransport.close()
 
-def sendEventToSocket(event: MailRouteEvent, sock: socket.socket, addr: str):
-    eventStr = dumps(event, default=vars)
-    print(f"Sending event '{eventStr}'")
-    sock.sendto(eventStr, addr)
+    # The planner, driver and obstacle monitor all run in this worker,
+    # so stopping them from the main process would do nothing
+    ctx.planner.shutdown(wait=False, cancel_futures=True)
+    ctx.driver.shutdown(wait=False, cancel_futures=True)
 
-def waitForConfirmationFromSocket(sock: socket.socket):
-    while True:
-        confirmationData = sock.recv(512)
-        if confirmationData.startswith(b'%acceptDelivery'):
-            break
+    import obstacle_avoidance
+    obstacle_avoidance.monitor.stop()
 
 @app.main_process_stop
 def shutdown_handler(app: NavigatorApp, loop):
-    ctx.abortTransitFeed = True
-
     import motor
     motor.drive(0)
 
@@ -120,11 +256,27 @@ def shutdown_handler(app: NavigatorApp, loop):
     lidar.disconnect()
 
 @app.after_server_start
-def init(app, loop):
+async def init(app, loop):
+    ctx.planner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planner")
+    ctx.driver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive")
+
     import lidar
     lidar.init()
 
-    thread = threading.Thread(target=transitFeedEntry, args=(app,))
-    thread.start()
+    # Check each lidar revolution for obstacles once, in the background,
+    # rather than in the middle of every drive loop tick
+    import obstacle_avoidance
+    obstacle_avoidance.monitor.start()
+
+    # Discretize the map while we wait for a route so the robot
+    # never stalls at an edge transition
+    ctx.floorplan.precomputeWaypoints()
+
+    # Render the static responses up front so the first poll is as
+    # cheap as every other
+    getCachedResponse("possibleRoute", renderPossibleRouteInfo)
+    getCachedResponse("map.svg", renderMapSvg)
+
+    await startTransitFeed(loop)
     print("Initialization complete")
 
@@ -0,0 +1,241 @@
+from svgpathtools import Path, Line
+from nav_utils import evaluateSegment
+from typing import NamedTuple
+import numpy as np
+
+# Curved segments are approximated by chords this long (in inches).
+SAMPLE_SPACING = 1.0
+
+# Straight segments are exact with any number of samples, they're only
+# split up so a long diagonal doesn't land in every cell of its bbox.
+MAX_LINE_CHORD = 24.0
+
+# Curves are measured along chords this many times finer than the
+# samples, so arc lengths stay accurate between samples.
+ARC_LENGTH_REFINEMENT = 16
+
+# Side length of one grid cell, in inches. A bit wider than a
+# corridor keeps most queries to a handful of cells.
+DEFAULT_CELL_SIZE = 24.0
+
+class EdgeLocation(NamedTuple):
+    edge: tuple[str, str]
+    """The key of the matched edge in FloorMap.paths."""
+
+    t: float
+    """The path parameter of the closest point on the edge."""
+
+    arcLength: float
+    """The distance along the edge from its start to the closest point."""
+
+    distance: float
+    """The distance from the query point to the closest point."""
+
+    point: complex
+
+class NodeLocation(NamedTuple):
+    nodeId: str
+    distance: float
+
+def sampleEdges(paths: list[Path], spacing: float = SAMPLE_SPACING) -> dict[str, np.ndarray]:
+    """
+    Discretizes every path into a polyline, keeping the path parameter
+    and cumulative arc length of each vertex. Samples for path i are
+    edgeSample*[edgeSampleOffsets[i]:edgeSampleOffsets[i + 1]]. Chord
+    lengths are scaled so every segment's samples add up to its true
+    length, which makes the arc lengths exact at segment boundaries.
+    """
+    offsets = [0]
+    allPoints, allT, allS = [], [], []
+    for path in paths:
+        segmentLengths = [segment.length() for segment in path]
+        pathLength = sum(segmentLengths)
+
+        points, ts, arcLengths = [path.start], [0.0], [0.0]
+        startT = 0.0
+        for segment, segmentLength in zip(path, segmentLengths):
+            # This matches how Path maps T onto its segments
+            endT = startT + (segmentLength / pathLength if pathLength > 0 else 0.0)
+            if isinstance(segment, Line):
+                count = max(1, int(np.ceil(segmentLength / MAX_LINE_CHORD)))
+            else:
+                count = max(2, int(np.ceil(segmentLength / spacing)))
+            segmentTs = np.linspace(0.0, 1.0, count + 1)[1:]
+            segmentPoints, _ = evaluateSegment(segment, segmentTs)
+
+            if isinstance(segment, Line):
+                segmentArcLengths = segmentTs * segmentLength
+            else:
+                finePoints, _ = evaluateSegment(segment, np.linspace(0.0, 1.0, count * ARC_LENGTH_REFINEMENT + 1))
+                fineChords = np.abs(np.diff(finePoints)).reshape(count, ARC_LENGTH_REFINEMENT).sum(axis=1)
+                segmentArcLengths = np.cumsum(fineChords)
+                if segmentArcLengths[-1] > 0:
+                    segmentArcLengths *= segmentLength / segmentArcLengths[-1]
+
+            points += segmentPoints.tolist()
+            ts += list(startT + segmentTs * (endT - startT))
+            arcLengths += list(arcLengths[-1] + segmentArcLengths)
+            startT = endT
+        ts[-1] = 1.0
+
+        points = np.array(points, dtype=np.complex128)
+        arcLengths = np.array(arcLengths)
+
+        allPoints.append(points)
+        allT.append(np.array(ts))
+        allS.append(arcLengths)
+        offsets.append(offsets[-1] + len(points))
+
+    return {
+        "edgeSampleOffsets": np.array(offsets, dtype=np.int32),
+        "edgeSamplePoints": np.concatenate(allPoints) if allPoints else np.zeros(0, np.complex128),
+        "edgeSampleT": np.concatenate(allT) if allT else np.zeros(0),
+        "edgeSampleS": np.concatenate(allS) if allS else np.zeros(0),
+    }
+
+class _Grid:
+    """
+    Buckets items by the cells their bounding boxes overlap so that a
+    nearest-item search only has to look at rings of cells around
+    the query point.
+    """
+    def __init__(self, lows: np.ndarray, highs: np.ndarray, cellSize: float):
+        self.cellSize = cellSize
+        self.itemCount = len(lows)
+        if self.itemCount == 0:
+            self._cells = {}
+            return
+
+        lowCells = np.floor(np.stack([lows.real, lows.imag], axis=1) / cellSize).astype(np.int64)
+        highCells = np.floor(np.stack([highs.real, highs.imag], axis=1) / cellSize).astype(np.int64)
+        self._minCell = lowCells.min(axis=0)
+        self._maxCell = highCells.max(axis=0)
+
+        cells: dict[tuple[int, int], list[int]] = {}
+        for item, (low, high) in enumerate(zip(lowCells.tolist(), highCells.tolist())):
+            for cx in range(low[0], high[0] + 1):
+                for cy in range(low[1], high[1] + 1):
+                    cells.setdefault((cx, cy), []).append(item)
+        self._cells = {cell: np.array(items) for cell, items in cells.items()}
+
+    def search(self, point: complex, distanceTo, k: int = 1) -> list[tuple[float, int]]:
+        """
+        Returns up to k (distance, key) pairs with the smallest distances,
+        where distanceTo maps an array of item indices to their
+        distances and keys. Items sharing a key are only counted once.
+        """
+        if self.itemCount == 0:
+            return []
+
+        cx, cy = int(np.floor(point.real / self.cellSize)), int(np.floor(point.imag / self.cellSize))
+
+        # Once the ring is past every occupied cell there's nothing left
+        maxRing = int(max(abs(cx - self._minCell[0]), abs(cx - self._maxCell[0]),
+                          abs(cy - self._minCell[1]), abs(cy - self._maxCell[1])))
+
+        best: dict[int, float] = {}
+        seen: set[int] = set()
+        for ring in range(maxRing + 1):
+            items = []
+            for cell in self._ringCells(cx, cy, ring):
+                if cell in self._cells:
+                    items.append(self._cells[cell])
+            if len(items) > 0:
+                items = np.unique(np.concatenate(items))
+                items = np.array([i for i in items.tolist() if i not in seen], dtype=np.int64)
+                seen.update(items.tolist())
+                if len(items) > 0:
+                    distances, keys = distanceTo(items)
+                    for distance, key in zip(distances.tolist(), keys.tolist()):
+                        if distance < best.get(key, np.inf):
+                            best[key] = distance
+
+            # Anything in the next ring is at least this far away
+            if len(best) >= k and sorted(best.values())[k - 1] <= ring * self.cellSize:
+                break
+
+        return sorted((distance, key) for key, distance in best.items())[:k]
+
+    def _ringCells(self, cx: int, cy: int, ring: int):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
+
+class EdgeSpatialIndex:
+    """
+    Uniform grid over the polyline approximation of every edge, and
+    over every node, for nearest-edge and nearest-node queries.
+    """
+    def __init__(self, edges: list[tuple[str, str]], samples: dict[str, np.ndarray],
+                 nodes: dict[str, complex], cellSize: float = DEFAULT_CELL_SIZE):
+        self.edges = edges
+        self.nodeIds = list(nodes.keys())
+        self._nodePositions = np.array(list(nodes.values()), dtype=np.complex128)
+
+        # One entry per chord between consecutive samples of the same edge
+        offsets = samples["edgeSampleOffsets"]
+        points, ts, arcLengths = samples["edgeSamplePoints"], samples["edgeSampleT"], samples["edgeSampleS"]
+        chordStarts = np.concatenate([np.arange(offsets[i], offsets[i + 1] - 1) for i in range(len(edges))]) \
+            if len(edges) > 0 else np.zeros(0, dtype=np.int64)
+        self._chordEdge = np.repeat(np.arange(len(edges)), np.diff(offsets) - 1)
+        self._p0, self._p1 = points[chordStarts], points[chordStarts + 1]
+        self._t0, self._t1 = ts[chordStarts], ts[chordStarts + 1]
+        self._s0, self._s1 = arcLengths[chordStarts], arcLengths[chordStarts + 1]
+
+        lows = np.minimum(self._p0.real, self._p1.real) + 1j * np.minimum(self._p0.imag, self._p1.imag)
+        highs = np.maximum(self._p0.real, self._p1.real) + 1j * np.maximum(self._p0.imag, self._p1.imag)
+        self._chordGrid = _Grid(lows, highs, cellSize)
+        self._nodeGrid = _Grid(self._nodePositions, self._nodePositions, cellSize)
+
+    def nearestEdge(self, point: complex) -> EdgeLocation | None:
+        nearest = self.nearestEdges(point, 1)
+        return nearest[0] if len(nearest) > 0 else None
+
+    def nearestEdges(self, point: complex, k: int) -> list[EdgeLocation]:
+        """Returns the closest point on each of the k closest edges."""
+        chordMatches = {}
+
+        def distanceTo(chords: np.ndarray):
+            u, projected = self._project(chords, point)
+            distances = np.abs(projected - point)
+            for chord, chordU, distance in zip(chords.tolist(), u.tolist(), distances.tolist()):
+                edge = int(self._chordEdge[chord])
+                if distance < chordMatches.get(edge, (np.inf,))[0]:
+                    chordMatches[edge] = (distance, chord, chordU)
+            return distances, self._chordEdge[chords]
+
+        locations = []
+        for distance, edge in self._chordGrid.search(point, distanceTo, k):
+            _, chord, u = chordMatches[edge]
+            locations.append(EdgeLocation(
+                self.edges[edge],
+                float(self._t0[chord] + u * (self._t1[chord] - self._t0[chord])),
+                float(self._s0[chord] + u * (self._s1[chord] - self._s0[chord])),
+                distance,
+                complex(self._p0[chord] + u * (self._p1[chord] - self._p0[chord]))))
+        return locations
+
+    def nearestNode(self, point: complex) -> NodeLocation | None:
+        nearest = self.nearestNodes(point, 1)
+        return nearest[0] if len(nearest) > 0 else None
+
+    def nearestNodes(self, point: complex, k: int) -> list[NodeLocation]:
+        def distanceTo(nodes: np.ndarray):
+            return np.abs(self._nodePositions[nodes] - point), nodes
+
+        return [NodeLocation(self.nodeIds[node], distance)
+                for distance, node in self._nodeGrid.search(point, distanceTo, k)]
+
+    def _project(self, chords: np.ndarray, point: complex) -> tuple[np.ndarray, np.ndarray]:
+        p0, p1 = self._p0[chords], self._p1[chords]
+        direction = p1 - p0
+        lengthSquared = np.abs(direction) ** 2
+        dot = ((point - p0) * np.conj(direction)).real
+        u = np.clip(np.divide(dot, lengthSquared, out=np.zeros_like(dot), where=lengthSquared > 0), 0.0, 1.0)
+        return u, p0 + u * direction
@@ -3,6 +3,7 @@
 
 # Import external libraries
 import numpy as np                                  # for handling arrays
+from time import monotonic                          # for measuring real timesteps
 
 # Import local files
 import motor as m                               # for controlling motors
@@ -23,6 +24,63 @@ pidGains = np.array([[kp_left, kp_right],
                      [ki_left, ki_right], 
                      [kd_left, kd_right]])                   # form an array to collect pid gains.
 
+# Defaults for WheelSpeedController, on top of the open-loop duty. The
+# derivative gain is kd above rescaled from per tick to per second at
+# 20 Hz, the control loop rate.
+SPEED_KP = 0.08                                     # duty per rad/s of error
+SPEED_KI = 0.4                                      # duty per rad of accumulated error
+SPEED_KD = 0.002                                    # duty per rad/s² of change in speed
+SPEED_DERIVATIVE_TAU = 0.1                          # s, time constant of the derivative filter
+
+class WheelSpeedController:
+    """
+    Closed-loop speed control for one wheel. Each update takes the target
+    and measured speeds in rad/s and returns a duty cycle in [-1, 1]:
+    the open-loop duty for the target plus a PID correction. Each wheel
+    gets its own controller, so no state is shared between them.
+
+    The integral stops growing while the output is saturated in the
+    direction it would push, so it can't wind up. The derivative acts
+    on the measured speed rather than the error, so a new target doesn't
+    kick, and is low-pass filtered since encoder speeds are noisy.
+    """
+    def __init__(self, kp: float = SPEED_KP, ki: float = SPEED_KI, kd: float = SPEED_KD,
+                 derivativeTau: float = SPEED_DERIVATIVE_TAU, maxSpeed: float = phi_max):
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.derivativeTau = derivativeTau
+        self.maxSpeed = maxSpeed
+        self.reset()
+
+    def reset(self):
+        """Forgets all state, for when the wheel has been stopped."""
+        self.integral = 0.0
+        self.derivative = 0.0
+        self._lastMeasured: float | None = None
+        self._lastTime: float | None = None
+
+    def update(self, targetSpeed: float, measuredSpeed: float, now: float | None = None) -> float:
+        now = monotonic() if now is None else now
+        dt = now - self._lastTime if self._lastTime is not None else 0.0
+        error = targetSpeed - measuredSpeed
+
+        # Filtered rate of change of the measured speed, which is
+        # already noisy before being differentiated
+        if dt > 0 and self._lastMeasured is not None:
+            rawDerivative = (measuredSpeed - self._lastMeasured) / dt
+            self.derivative += (rawDerivative - self.derivative) * dt / (self.derivativeTau + dt)
+
+        feedforward = targetSpeed / self.maxSpeed * DRS
+        unclamped = feedforward + self.kp * error + self.integral - self.kd * self.derivative
+        output = float(np.clip(unclamped, -1.0, 1.0))
+
+        # Only integrate when it won't push further into saturation
+        if dt > 0 and (output == unclamped or np.sign(error) != np.sign(unclamped)):
+            self.integral = float(np.clip(self.integral + self.ki * error * dt, -1.0, 1.0))
+
+        self._lastMeasured = measuredSpeed
+        self._lastTime = now
+        return output
+
 # a function for converting target rotational speeds to PWMs without feedback
 def openLoop(pdl, pdr):
     duties = np.array([pdl, pdr])                   # put the values into an array
@@ -0,0 +1,199 @@
+from typing import NamedTuple
+import time
+import numpy as np
+
+# Held-Karp is O(2^n * n^2) in time and O(2^n * n) in memory,
+# 15 stops is ~4 MB of tables and well under a second on the Pi.
+HELD_KARP_MAX_STOPS = 15
+
+# Default time budget for the heuristic solver, in seconds
+DEFAULT_TIME_BUDGET = 0.5
+
+SOLVER_HELD_KARP = "held-karp"
+SOLVER_HEURISTIC = "nn-2opt-oropt"
+
+# Improvements smaller than this are treated as noise, otherwise
+# floating point error can make the local search cycle forever
+_IMPROVEMENT_EPSILON = 1e-9
+
+class TourSolution(NamedTuple):
+    order: list[int]
+    """The indices of the stops in the order they should be visited,
+    excluding the start and end."""
+
+    cost: float
+    """The total length of the tour, including the start and end legs."""
+
+    solver: str
+    """The name of the solver that produced this solution."""
+
+def solveTour(distances: np.ndarray, start: int, end: int, stops: list[int],
+              solver: str | None = None, timeBudget: float = DEFAULT_TIME_BUDGET) -> TourSolution:
+    """
+    Finds the shortest route that leaves `start`, visits every index in
+    `stops` exactly once, and finishes at `end`. Uses the exact solver
+    when the stop count allows it and the heuristic otherwise, unless
+    a specific solver is requested.
+    """
+    if solver is None:
+        solver = SOLVER_HELD_KARP if len(stops) <= HELD_KARP_MAX_STOPS else SOLVER_HEURISTIC
+
+    if solver == SOLVER_HELD_KARP:
+        return solveHeldKarp(distances, start, end, stops)
+    if solver == SOLVER_HEURISTIC:
+        return solveHeuristic(distances, start, end, stops, timeBudget)
+    raise ValueError(f"Unknown solver '{solver}'")
+
+def tourCost(distances: np.ndarray, start: int, end: int, order: list[int]) -> float:
+    route = [start, *order, end]
+    return float(distances[route[:-1], route[1:]].sum())
+
+def solveHeldKarp(distances: np.ndarray, start: int, end: int, stops: list[int]) -> TourSolution:
+    """
+    Exact bitmask dynamic program. Each layer of subsets with the same
+    number of stops is relaxed at once with NumPy, so the Python
+    overhead is O(n^2) rather than O(2^n * n^2).
+    """
+    n = len(stops)
+    if n > HELD_KARP_MAX_STOPS:
+        raise ValueError(f"Held-Karp is limited to {HELD_KARP_MAX_STOPS} stops, got {n}")
+    if n == 0:
+        return TourSolution([], float(distances[start, end]), SOLVER_HELD_KARP)
+
+    stopDistances = distances[np.ix_(stops, stops)]
+    fromStart = distances[start, stops]
+    toEnd = distances[stops, end]
+
+    subsetCount = 1 << n
+    masks = np.arange(subsetCount)
+    popcounts = np.zeros(subsetCount, dtype=np.int8)
+    for bit in range(n):
+        popcounts += (masks >> bit) & 1
+
+    # cost[mask, j] is the shortest route from the start that visits
+    # exactly the stops in mask and ends at stop j
+    cost = np.full((subsetCount, n), np.inf)
+    parent = np.full((subsetCount, n), -1, dtype=np.int8)
+    for j in range(n):
+        cost[1 << j, j] = fromStart[j]
+
+    for size in range(2, n + 1):
+        layer = masks[popcounts == size]
+        for j in range(n):
+            bit = 1 << j
+            withJ = layer[(layer & bit) != 0]
+            candidates = cost[withJ ^ bit] + stopDistances[:, j]
+            best = np.argmin(candidates, axis=1)
+            cost[withJ, j] = candidates[np.arange(len(withJ)), best]
+            parent[withJ, j] = best
+
+    fullMask = subsetCount - 1
+    totals = cost[fullMask] + toEnd
+    last = int(np.argmin(totals))
+
+    order = []
+    mask = fullMask
+    while last >= 0:
+        order.append(stops[last])
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    order.reverse()
+
+    return TourSolution(order, float(totals.min()), SOLVER_HELD_KARP)
+
+def solveHeuristic(distances: np.ndarray, start: int, end: int, stops: list[int],
+                   timeBudget: float = DEFAULT_TIME_BUDGET) -> TourSolution:
+    """
+    Anytime solver: builds a nearest-neighbour route, then applies
+    2-opt and Or-opt moves until neither improves the route or the
+    time budget (in seconds) runs out. Assumes symmetric distances.
+    """
+    deadline = time.monotonic() + timeBudget
+
+    route = [start, *_nearestNeighbor(distances, start, stops), end]
+    while time.monotonic() < deadline:
+        improved = _improveTwoOpt(distances, route, deadline)
+        improved = _improveOrOpt(distances, route, deadline) or improved
+        if not improved:
+            break
+
+    order = route[1:-1]
+    return TourSolution(order, tourCost(distances, start, end, order), SOLVER_HEURISTIC)
+
+def _nearestNeighbor(distances: np.ndarray, start: int, stops: list[int]) -> list[int]:
+    remaining = list(stops)
+    order = []
+    current = start
+    while len(remaining) > 0:
+        nextIndex = int(np.argmin(distances[current, remaining]))
+        current = remaining.pop(nextIndex)
+        order.append(current)
+    return order
+
+def _improveTwoOpt(distances: np.ndarray, route: list[int], deadline: float) -> bool:
+    """
+    Reverses the section route[i:k+1] whenever doing so shortens the route.
+    The start and end of the route are never moved.
+    """
+    improved = False
+    lastStop = len(route) - 2
+    i = 1
+    while i < lastStop:
+        if time.monotonic() >= deadline:
+            break
+
+        a, b = route[i - 1], route[i]
+        ks = np.arange(i + 1, lastStop + 1)
+        routeArray = np.asarray(route)
+        c, d = routeArray[ks], routeArray[ks + 1]
+        deltas = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+
+        best = int(np.argmin(deltas))
+        if deltas[best] < -_IMPROVEMENT_EPSILON:
+            k = int(ks[best])
+            route[i:k + 1] = route[i:k + 1][::-1]
+            improved = True
+            continue
+        i += 1
+    return improved
+
+def _improveOrOpt(distances: np.ndarray, route: list[int], deadline: float) -> bool:
+    """
+    Moves chains of up to three consecutive stops to a cheaper place in
+    the route, optionally reversing them.
+    """
+    improved = False
+    for chainLength in (1, 2, 3):
+        i = 1
+        while i + chainLength <= len(route) - 1:
+            if time.monotonic() >= deadline:
+                return improved
+
+            chain = route[i:i + chainLength]
+            before, after = route[i - 1], route[i + chainLength]
+            first, last = chain[0], chain[-1]
+            removalGain = distances[before, first] + distances[last, after] - distances[before, after]
+
+            rest = np.asarray(route[:i] + route[i + chainLength:])
+            x, y = rest[:-1], rest[1:]
+            base = distances[x, y]
+            forwardCost = distances[x, first] + distances[last, y] - base
+            reverseCost = distances[x, last] + distances[first, y] - base
+
+            bestForward = int(np.argmin(forwardCost))
+            bestReverse = int(np.argmin(reverseCost))
+            if forwardCost[bestForward] <= reverseCost[bestReverse]:
+                position, insertionCost, reverse = bestForward, forwardCost[bestForward], False
+            else:
+                position, insertionCost, reverse = bestReverse, reverseCost[bestReverse], True
+
+            if insertionCost - removalGain < -_IMPROVEMENT_EPSILON:
+                newRoute = list(rest[:position + 1])
+                newRoute += chain[::-1] if reverse else chain
+                newRoute += list(rest[position + 1:])
+                route[:] = [int(r) for r in newRoute]
+                improved = True
+                continue
+            i += 1
+    return improved